@@ -43,6 +43,8 @@ class Cell(object):
     """
     Cell class representing a particular pixel/cell in a raster band instance. 
     """
+    __slots__ = ("band", "col", "row", "_x", "_y")
+
     def __init__(self, band, col, row):
         """
         Cell is instantiated by referencing the paremt raster band to which it belongs, and the cell's
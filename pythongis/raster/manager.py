@@ -4,6 +4,7 @@ Module containing methods for the management and modification of raster datasets
 
 from . import data
 from ..vector import sql
+from ..vector._packed import iter_flat_polygons, iter_flat_lines
 
 import PIL, PIL.Image, PIL.ImageDraw, PIL.ImagePath, PIL.ImageChops, PIL.ImageMath
 import gc
@@ -547,41 +548,33 @@ def rasterize(vectordata, valuekey=None, stat=None, priority=None, partial=None,
         holeoutline = 1.0 if val is None else None
         #print ["burnmain",fill,outline,"burnhole",holefill,holeoutline]
 
-        # make all multis so can treat all same
-        coords = feat.geometry["coordinates"]
-        if not "Multi" in geotype:
-            coords = [coords]
-
         # polygon, basic black fill, no outline
+        # (flat x,y coordinate lists straight from the packed geometry arrays)
         if "Polygon" in geotype:
-            for poly in coords:
+            for poly in iter_flat_polygons(feat.geometry):
                 # exterior
-                exterior = [tuple(p) for p in poly[0]]
-                path = PIL.ImagePath.Path(exterior)
-                #print list(path)[:10]
+                path = PIL.ImagePath.Path(poly[0])
                 path.transform((a,b,c,d,e,f))
-                #print list(path)[:10]
                 drawer.polygon(path, fill=fill, outline=outline)
                 # holes
-                if len(poly) > 1:
-                    for hole in poly[1:]:
-                        hole = [tuple(p) for p in hole]
-                        path = PIL.ImagePath.Path(hole)
-                        path.transform((a,b,c,d,e,f))
-                        drawer.polygon(path, fill=holefill, outline=holeoutline)
+                for hole in poly[1:]:
+                    path = PIL.ImagePath.Path(hole)
+                    path.transform((a,b,c,d,e,f))
+                    drawer.polygon(path, fill=holefill, outline=holeoutline)
                         
         # line, 1 pixel line thickness
         elif "LineString" in geotype:
-            for line in coords:
+            for line in iter_flat_lines(feat.geometry):
                 path = PIL.ImagePath.Path(line)
                 path.transform((a,b,c,d,e,f))
                 drawer.line(path, fill=val)
             
         # point, 1 pixel square size
         elif "Point" in geotype:
-            path = PIL.ImagePath.Path(coords)
-            path.transform((a,b,c,d,e,f))
-            drawer.point(path, fill=val)
+            for points in iter_flat_lines(feat.geometry):
+                path = PIL.ImagePath.Path(points)
+                path.transform((a,b,c,d,e,f))
+                drawer.point(path, fill=val)
 
     # quickly draw all vector data
     for feat in vectordata:
@@ -606,9 +599,7 @@ def rasterize(vectordata, valuekey=None, stat=None, priority=None, partial=None,
 
         # prepare geometries
         from shapely.prepared import prep
-        for f in vectordata:
-            f._shapely = f.get_shapely()
-            f._prepped = prep(f._shapely)
+        prepped = dict((f.id, prep(f.get_shapely())) for f in vectordata if f.geometry)
 
         # burn all self intersections onto mask (constant time, slower for easy small geoms)
         for f1 in vectordata:
@@ -665,7 +656,7 @@ def rasterize(vectordata, valuekey=None, stat=None, priority=None, partial=None,
                     # get features in that cell
                     spindex = list(vectordata.quick_overlap(cellgeom.bounds))
                     intsecs = [feat for feat in spindex
-                               if feat.geometry and not feat._prepped.disjoint(cellgeom)]
+                               if feat.geometry and not prepped[feat.id].disjoint(cellgeom)]
                     if not intsecs:
                         continue
 
@@ -824,7 +815,7 @@ def vectorize(raster, mergecells=True, metavars=True, bandnum=0):
             outvec = VectorData()
             outvec.fields = ["id"]
             for i,poly in enumerate(union.geoms):
-                outvec.add_feature([i], poly.__geo_interface__)
+                outvec.add_feature([i], poly.wkb)
 
             return outvec
 
@@ -853,9 +844,9 @@ def vectorize(raster, mergecells=True, metavars=True, bandnum=0):
 
                 if hasattr(union, "geoms"):
                     for poly in union.geoms:
-                        outvec.add_feature([zoneval], poly.__geo_interface__)
+                        outvec.add_feature([zoneval], poly.wkb)
                 else:
-                    outvec.add_feature([zoneval], union.__geo_interface__)
+                    outvec.add_feature([zoneval], union.wkb)
 
             return outvec
 
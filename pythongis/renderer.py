@@ -9,6 +9,7 @@ import colour
 import classypie as cp
 
 from .vector.data import VectorData
+from .vector._packed import iter_flat_polygons
 from .vector.loader import detect_filetype as vector_filetype
 from .raster.data import RasterData
 from .raster.loader import detect_filetype as raster_filetype
@@ -861,7 +862,11 @@ class VectorLayer:
         return not self.has_geometry()
 
     def has_geometry(self):
-        return any((feat.geometry for feat in self.features()))
+        if self.datafilter:
+            return any((feat.geometry for feat in self.features()))
+        else:
+            # no need to scan, the data keeps track of its own bbox
+            return self.data.has_geometry()
 
     def copy(self):
         new = VectorLayer(self.data)
@@ -880,6 +885,9 @@ class VectorLayer:
     @property
     def bbox(self):
         if self.has_geometry():
+            if not self.datafilter:
+                # cached by the data
+                return self.data.bbox
             xmins, ymins, xmaxs, ymaxs = itertools.izip(*(feat.bbox for feat in self.features() if feat.geometry))
             bbox = min(xmins),min(ymins),max(xmaxs),max(ymaxs)
             return bbox
@@ -1012,6 +1020,10 @@ class VectorLayer:
                 features = sorted(features, key=self.styleoptions["sortkey"],
                                   reverse=self.styleoptions["sortorder"].lower() == "decr")
 
+            # when zoomed out, draw simplified geometries no more detailed than a pixel (if the data has levels of detail)
+            pixelsize = min(abs(bbox[2] - bbox[0]) / float(width), abs(bbox[3] - bbox[1]) / float(height))
+            lod = self.data.get_lod(pixelsize)
+
             # prep PIL if non-antialias polygon
             if not antialias and "Polygon" in self.data.type:
                 #print "preint",time.time()-t
@@ -1042,27 +1054,21 @@ class VectorLayer:
                             rendict[key] = val
 
                 # draw
+                geometry = lod.get(feat.id, feat.geometry) if lod else feat.geometry
 
                 # fast PIL Approach for non-antialias polygons
-                if not antialias and "Polygon" in feat.geometry["type"]:
-
-                    if "Multi" in feat.geometry["type"]:
-                        geoms = feat.geometry["coordinates"]
-                    else:
-                        geoms = [feat.geometry["coordinates"]]
+                if not antialias and "Polygon" in geometry["type"]:
 
                     fill = tuple((int(c) for c in rendict["fillcolor"])) if rendict.get("fillcolor") else None
                     outline = tuple((int(c) for c in rendict["outlinecolor"])) if rendict.get("outlinecolor") else None
-                    
-                    for poly in geoms:
+
+                    # flat x,y coordinate lists straight from the packed geometry arrays
+                    for poly in iter_flat_polygons(geometry):
                         coords = poly[0]
-                        if len(poly) > 1:
-                            holes = poly[1:0]
-                        else:
-                            holes = []
+                        holes = poly[1:]
 
                         # first exterior
-                        path = PIL.ImagePath.Path([tuple(p) for p in coords])
+                        path = PIL.ImagePath.Path(coords)
                         path.transform(drawer.coordspace_transform)
                         #print "draw",str(path.tolist())[:300]
                         path.compact(1)
@@ -1073,7 +1079,7 @@ class VectorLayer:
 
                         # then holes
                         for hole in holes:
-                            path = PIL.ImagePath.Path([tuple(p) for p in hole])
+                            path = PIL.ImagePath.Path(hole)
                             path.transform(drawer.coordspace_transform)
                             path.compact(1)
                             if len(path) > 1:
@@ -1082,7 +1088,7 @@ class VectorLayer:
 
                 else:
                     # high qual geojson
-                    drawer.draw_geojson(feat.geometry, **rendict)
+                    drawer.draw_geojson(geometry, **rendict)
 
             # flush
             print "internal",time.time()-t
@@ -0,0 +1,190 @@
+"""
+Geodesic kernels for distances, lengths, perimeters and areas of lon,lat coordinates, in km and km2.
+
+The kernels work on whole flat x,y coordinate arrays at once, such as the rings of packed geometries,
+so that each coordinate is converted to radians and has its trigonometry computed only once, instead
+of once for every point pair it is part of.
+
+Distances and lengths can be computed with the fast haversine formula on a sphere with the earth's mean
+radius, or with the precise Vincenty formula on the WGS84 ellipsoid. Areas are computed on a sphere with
+the earth's mean radius, or precisely by first mapping the WGS84 latitudes to authalic latitudes on a sphere
+with the same surface area as the ellipsoid.
+"""
+
+import itertools, math
+
+from ._helpers import packed_parts
+
+
+MEAN_RADIUS = 6371.009
+AUTHALIC_RADIUS = 6371.0072
+WGS84 = (6378.137, 6356.752314245, 1/298.257223563) # semi-major and semi-minor axes in km, and flattening
+
+
+# Kernels over flat coordinate arrays
+
+def _lonlats(flat):
+    """Returns the lons and lats of a flat x,y coordinate sequence, in radians."""
+    rad = math.radians
+    lons = [rad(v) for v in itertools.islice(flat, 0, None, 2)]
+    lats = [rad(v) for v in itertools.islice(flat, 1, None, 2)]
+    return lons, lats
+
+def haversine_lengths(flat):
+    """Returns the haversine length of each segment between the points of a flat x,y coordinate sequence."""
+    sin, asin, sqrt = math.sin, math.asin, math.sqrt
+    lons,lats = _lonlats(flat)
+    coslats = [math.cos(lat) for lat in lats]
+    lengths = []
+    for i in xrange(len(lons)-1):
+        sinlat = sin((lats[i+1] - lats[i]) / 2.0)
+        sinlon = sin((lons[i+1] - lons[i]) / 2.0)
+        h = sinlat*sinlat + coslats[i]*coslats[i+1]*sinlon*sinlon
+        lengths.append(2 * MEAN_RADIUS * asin(min(1.0, sqrt(h))))
+    return lengths
+
+def _vincenty(L, sinU1, cosU1, sinU2, cosU2, MAX_ITERATIONS=200, CONVERGENCE_THRESHOLD=1e-12):
+    # Vincenty's inverse formula, after the reduced latitudes have been computed
+    # adapted from Maurycyp's Vincenty package, https://github.com/maurycyp/vincenty/blob/master/vincenty/__init__.py
+    a,b,f = WGS84
+    sin, cos, sqrt, atan2 = math.sin, math.cos, math.sqrt, math.atan2
+    Lambda = L
+    for iteration in xrange(MAX_ITERATIONS):
+        sinLambda = sin(Lambda)
+        cosLambda = cos(Lambda)
+        sinSigma = sqrt((cosU2 * sinLambda) ** 2 +
+                        (cosU1 * sinU2 - sinU1 * cosU2 * cosLambda) ** 2)
+        if sinSigma == 0:
+            return 0.0  # coincident points
+        cosSigma = sinU1 * sinU2 + cosU1 * cosU2 * cosLambda
+        sigma = atan2(sinSigma, cosSigma)
+        sinAlpha = cosU1 * cosU2 * sinLambda / sinSigma
+        cosSqAlpha = 1 - sinAlpha ** 2
+        if cosSqAlpha:
+            cos2SigmaM = cosSigma - 2 * sinU1 * sinU2 / cosSqAlpha
+        else:
+            cos2SigmaM = 0
+        C = f / 16 * cosSqAlpha * (4 + f * (4 - 3 * cosSqAlpha))
+        LambdaPrev = Lambda
+        Lambda = L + (1 - C) * f * sinAlpha * (sigma + C * sinSigma *
+                                               (cos2SigmaM + C * cosSigma *
+                                                (-1 + 2 * cos2SigmaM ** 2)))
+        if abs(Lambda - LambdaPrev) < CONVERGENCE_THRESHOLD:
+            break  # successful convergence
+    else:
+        return None  # failure to converge, eg for nearly antipodal points
+
+    uSq = cosSqAlpha * (a ** 2 - b ** 2) / (b ** 2)
+    A = 1 + uSq / 16384 * (4096 + uSq * (-768 + uSq * (320 - 175 * uSq)))
+    B = uSq / 1024 * (256 + uSq * (-128 + uSq * (74 - 47 * uSq)))
+    deltaSigma = B * sinSigma * (cos2SigmaM + B / 4 * (cosSigma *
+                 (-1 + 2 * cos2SigmaM ** 2) - B / 6 * cos2SigmaM *
+                 (-3 + 4 * sinSigma ** 2) * (-3 + 4 * cos2SigmaM ** 2)))
+    return b * A * (sigma - deltaSigma)
+
+def vincenty_lengths(flat):
+    """
+    Returns the Vincenty length of each segment between the points of a flat x,y coordinate sequence.
+    Segments between nearly antipodal points, where the formula fails to converge, fall back to the haversine length.
+    """
+    f = WGS84[2]
+    lons,lats = _lonlats(flat)
+    reduced = [math.atan((1 - f) * math.tan(lat)) for lat in lats]
+    sinUs = [math.sin(U) for U in reduced]
+    cosUs = [math.cos(U) for U in reduced]
+    lengths = []
+    for i in xrange(len(lons)-1):
+        if lons[i] == lons[i+1] and lats[i] == lats[i+1]:
+            lengths.append(0.0)
+            continue
+        length = _vincenty(lons[i+1] - lons[i], sinUs[i], cosUs[i], sinUs[i+1], cosUs[i+1])
+        if length is None:
+            length = haversine_lengths(flat[i*2:i*2+4])[0]
+        lengths.append(length)
+    return lengths
+
+def ring_length(flat, precise=False):
+    """Returns the length of a line or ring given as a flat x,y coordinate sequence."""
+    if precise:
+        return sum(vincenty_lengths(flat))
+    else:
+        return sum(haversine_lengths(flat))
+
+def _authalic_latitudes(lats):
+    # maps latitudes on the WGS84 ellipsoid to latitudes on a sphere of the same surface area
+    a,b,f = WGS84
+    e = math.sqrt(f * (2 - f))
+    def q(sinlat):
+        return (1 - e*e) * (sinlat / (1 - e*e*sinlat*sinlat) - 1 / (2*e) * math.log((1 - e*sinlat) / (1 + e*sinlat)))
+    qp = q(1.0)
+    return [math.asin(max(-1.0, min(1.0, q(math.sin(lat)) / qp))) for lat in lats]
+
+def ring_area(flat, precise=False):
+    """
+    Returns the signed area of a closed ring given as a flat x,y coordinate sequence,
+    which is positive for counterclockwise rings.
+    """
+    # the spherical excess of the ring, summed as the area between each edge and the south pole
+    lons,lats = _lonlats(flat)
+    if len(lons) < 3:
+        return 0.0
+    if precise:
+        lats = _authalic_latitudes(lats)
+        radius = AUTHALIC_RADIUS
+    else:
+        radius = MEAN_RADIUS
+    sin, pi = math.sin, math.pi
+    sinlats = [sin(lat) for lat in lats]
+    total = 0.0
+    for i in xrange(len(lons)-1):
+        dlon = lons[i+1] - lons[i]
+        # take the short way around the antimeridian
+        if dlon > pi:
+            dlon -= 2*pi
+        elif dlon < -pi:
+            dlon += 2*pi
+        total += dlon * (2 + sinlats[i] + sinlats[i+1])
+    return -total * radius * radius / 2.0
+
+def distance(point1, point2, precise=False):
+    """Returns the distance between two lon,lat points."""
+    flat = (point1[0], point1[1], point2[0], point2[1])
+    if precise:
+        return vincenty_lengths(flat)[0]
+    else:
+        return haversine_lengths(flat)[0]
+
+
+# Geometries
+
+def geometry_length(geometry, precise=False):
+    """
+    Returns the geodesic length of a GeoJSON, packed or shapely geometry, in km.
+    For polygons this is the perimeter, including any holes, and for points it is 0.
+    """
+    length = 0.0
+    for geom in packed_parts(geometry):
+        if geom.typecode in (1,4):
+            continue
+        for ring in geom.iter_rings():
+            length += ring_length(ring, precise)
+    return length
+
+def geometry_perimeter(geometry, precise=False):
+    """Returns the geodesic perimeter of the polygons in a geometry, in km, or 0 for other types."""
+    perimeter = 0.0
+    for geom in packed_parts(geometry):
+        if geom.typecode in (3,6):
+            for ring in geom.iter_rings():
+                perimeter += ring_length(ring, precise)
+    return perimeter
+
+def geometry_area(geometry, precise=False):
+    """Returns the geodesic area of the polygons in a geometry, in km2, or 0 for other types."""
+    area = 0.0
+    for geom in packed_parts(geometry):
+        for poly in geom.iter_polygons():
+            exterior = abs(ring_area(poly[0], precise))
+            holes = sum(abs(ring_area(hole, precise)) for hole in poly[1:])
+            area += exterior - holes
+    return area
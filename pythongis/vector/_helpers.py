@@ -1,90 +1,14 @@
 
 import itertools, math
+import struct, sys
+
+from ._packed import PackedGeometry, pack
 
 def _pairwise(iterable):
     a, b = itertools.tee(iterable)
     next(b, None)
     return itertools.izip(a, b)
 
-def _vincenty_distance(point1, point2, miles=False, a=6378137, b=6356752.314245, f=1/298.257223563, MILES_PER_KILOMETER=0.621371, MAX_ITERATIONS=200, CONVERGENCE_THRESHOLD=1e-12):
-    """
-    Vincenty's formula (inverse method) to calculate the distance (in
-    kilometers or miles) between two points on the surface of a spheroid
- 
-    NOTE: Taken entirely from Maurycyp's Vincenty package.
-    https://github.com/maurycyp/vincenty/blob/master/vincenty/__init__.py
- 
-    Doctests:
-    >>> vincenty((0.0, 0.0), (0.0, 0.0))  # coincident points
-    0.0
-    >>> vincenty((0.0, 0.0), (0.0, 1.0))
-    111.319491
-    >>> vincenty((0.0, 0.0), (1.0, 0.0))
-    110.574389
-    >>> vincenty((0.0, 0.0), (0.5, 179.5))  # slow convergence
-    19936.288579
-    >>> vincenty((0.0, 0.0), (0.5, 179.7))  # failure to converge
-    >>> boston = (42.3541165, -71.0693514)
-    >>> newyork = (40.7791472, -73.9680804)
-    >>> vincenty(boston, newyork)
-    298.396057
-    >>> vincenty(boston, newyork, miles=True)
-    185.414657
-    """
- 
-    # short-circuit coincident points
-    if point1[0] == point2[0] and point1[1] == point2[1]:
-        return 0.0
- 
-    U1 = math.atan((1 - f) * math.tan(math.radians(point1[0])))
-    U2 = math.atan((1 - f) * math.tan(math.radians(point2[0])))
-    L = math.radians(point2[1] - point1[1])
-    Lambda = L
- 
-    sinU1 = math.sin(U1)
-    cosU1 = math.cos(U1)
-    sinU2 = math.sin(U2)
-    cosU2 = math.cos(U2)
- 
-    for iteration in range(MAX_ITERATIONS):
-        sinLambda = math.sin(Lambda)
-        cosLambda = math.cos(Lambda)
-        sinSigma = math.sqrt((cosU2 * sinLambda) ** 2 +
-                             (cosU1 * sinU2 - sinU1 * cosU2 * cosLambda) ** 2)
-        if sinSigma == 0:
-            return 0.0  # coincident points
-        cosSigma = sinU1 * sinU2 + cosU1 * cosU2 * cosLambda
-        sigma = math.atan2(sinSigma, cosSigma)
-        sinAlpha = cosU1 * cosU2 * sinLambda / sinSigma
-        cosSqAlpha = 1 - sinAlpha ** 2
-        try:
-            cos2SigmaM = cosSigma - 2 * sinU1 * sinU2 / cosSqAlpha
-        except ZeroDivisionError:
-            cos2SigmaM = 0
-        C = f / 16 * cosSqAlpha * (4 + f * (4 - 3 * cosSqAlpha))
-        LambdaPrev = Lambda
-        Lambda = L + (1 - C) * f * sinAlpha * (sigma + C * sinSigma *
-                                               (cos2SigmaM + C * cosSigma *
-                                                (-1 + 2 * cos2SigmaM ** 2)))
-        if abs(Lambda - LambdaPrev) < CONVERGENCE_THRESHOLD:
-            break  # successful convergence
-    else:
-        return None  # failure to converge
- 
-    uSq = cosSqAlpha * (a ** 2 - b ** 2) / (b ** 2)
-    A = 1 + uSq / 16384 * (4096 + uSq * (-768 + uSq * (320 - 175 * uSq)))
-    B = uSq / 1024 * (256 + uSq * (-128 + uSq * (74 - 47 * uSq)))
-    deltaSigma = B * sinSigma * (cos2SigmaM + B / 4 * (cosSigma *
-                 (-1 + 2 * cos2SigmaM ** 2) - B / 6 * cos2SigmaM *
-                 (-3 + 4 * sinSigma ** 2) * (-3 + 4 * cos2SigmaM ** 2)))
-    s = b * A * (sigma - deltaSigma)
- 
-    s /= 1000  # meters to kilometers
-    if miles:
-        s *= MILES_PER_KILOMETER  # kilometers to miles
- 
-    return round(s, 6)
-
 def _walk(startpoint, direction, distance): 
     """
     Walk from a starting point in a direction for x distance to find the endpoint, using geodetic calculations.
@@ -171,119 +95,602 @@ def _walk(startpoint, direction, distance):
 
 
 # PUBLIC FUNCTIONS
- 
-def geodetic_length(geometry):
+
+_GEOMETRY_TYPECODES = {"Point": 1,
+                       "LineString": 2,
+                       "Polygon": 3,
+                       "MultiPoint": 4,
+                       "MultiLineString": 5,
+                       "MultiPolygon": 6,
+                       "GeometryCollection": 7}
+
+def geometry_encoding(geometry, precision=None):
+    """
+    Returns a canonical binary string encoding of a GeoJSON geometry, so that two geometries
+    with the same type, part structure and coordinates always give the same string, 
+    regardless of dict key order or whether coordinates are stored as lists or tuples. 
+
+    Only the x and y values are encoded. If precision is given, coordinates are first rounded
+    to that many decimals, so that geometries differing only by floating point noise encode the same. 
+    """
+    geotype = geometry["type"]
     
-    def _handle(geometry):
-        if "Point" in geometry["type"]:
-            return 0.0
- 
-        elif geometry["type"] == "LineString":
-            length = sum((_vincenty_distance(p1,p2)
-                          for p1,p2 in _pairwise(geometry["coordinates"]))
-                         )
-            return length
- 
-        elif geometry["type"] == "MultiLineString":
-            length = sum((_vincenty_distance(p1,p2)
-                          for line in geometry["coordinates"]
-                          for p1,p2 in _pairwise(line))
-                         )
-            return length
-         
+    if geotype == "GeometryCollection":
+        subs = [geometry_encoding(sub, precision) for sub in geometry["geometries"]]
+        header = struct.pack("<%si" % (2+len(subs)), _GEOMETRY_TYPECODES[geotype], len(subs), *(len(sub) for sub in subs))
+        return header + b"".join(subs)
+
+    if hasattr(geometry, "rings"):
+        # packed geometries already hold the flat coordinates and part lengths
+        rings,polys = geometry.rings,geometry.polys
+        if geotype in ("MultiLineString","Polygon"):
+            counts = [len(rings)-1]
+        elif geotype == "MultiPolygon":
+            counts = [len(polys)-1] + [polys[j+1]-polys[j] for j in xrange(len(polys)-1)]
         else:
-            raise Exception("Geodetic length not yet implemented for Polygons")
- 
-    if geometry["type"] == "GeometryCollection":
-        length = sum((_handle(geom) for geom in geometry["geometries"]))
-        return length
- 
+            counts = []
+        counts.extend(rings[i+1]-rings[i] for i in xrange(len(rings)-1))
+        if precision is None:
+            values = [v + 0.0 for v in geometry.coords]
+        else:
+            values = [round(v, precision) + 0.0 for v in geometry.coords]
+        fmt = "<%si%sd" % (1+len(counts), len(values))
+        return struct.pack(fmt, _GEOMETRY_TYPECODES[geotype], *(counts + values))
+
+    coords = geometry["coordinates"]
+    if geotype == "Point":
+        parts = [[coords]]
+        counts = []
+    elif geotype in ("MultiPoint","LineString"):
+        parts = [coords]
+        counts = []
+    elif geotype in ("MultiLineString","Polygon"):
+        parts = coords
+        counts = [len(parts)]
+    elif geotype == "MultiPolygon":
+        parts = [ext_or_hole for poly in coords for ext_or_hole in poly]
+        counts = [len(coords)] + [len(poly) for poly in coords]
     else:
-        length = _handle(geometry)
-        return length
+        raise Exception("Cannot encode unknown geometry type %s" % geotype)
+    counts.extend(len(part) for part in parts)
+
+    if precision is None:
+        # adding 0.0 turns any negative zero into positive zero
+        values = [v + 0.0 for part in parts for p in part for v in p[:2]]
+    else:
+        values = [round(v, precision) + 0.0 for part in parts for p in part for v in p[:2]]
+
+    fmt = "<%si%sd" % (1+len(counts), len(values))
+    return struct.pack(fmt, _GEOMETRY_TYPECODES[geotype], *(counts + values))
+
+def geometry_hash(geometry, precision=None):
+    """
+    Returns a short fixed-length digest of the canonical geometry encoding, see geometry_encoding(). 
+    """
+    import hashlib
+    return hashlib.md5(geometry_encoding(geometry, precision)).digest()
+ 
+def packed_parts(geometry):
+    """
+    Yields the packed single-type geometries of a GeoJSON, packed or shapely geometry, looking inside collections,
+    and dropping any z coordinates that prevent packing. 
+    """
+    geometry = pack(geometry)
+    if isinstance(geometry, PackedGeometry):
+        yield geometry
+    elif geometry and geometry["type"] == "GeometryCollection":
+        for geom in geometry["geometries"]:
+            for subgeom in packed_parts(geom):
+                yield subgeom
+    elif geometry and geometry.get("coordinates"):
+        def flatten(coords):
+            if isinstance(coords[0], (int,float)):
+                return coords[:2]
+            return [flatten(sub) for sub in coords]
+        geometry = pack({"type": geometry["type"], "coordinates": flatten(geometry["coordinates"])})
+        if isinstance(geometry, PackedGeometry):
+            yield geometry
+
+def geodetic_length(geometry, precise=True):
+    """Returns the geodesic length of a geometry in km, or the perimeter for polygons. See _geodesic.geometry_length."""
+    from ._geodesic import geometry_length
+    return geometry_length(geometry, precise)
+
+def _azimuthal_equidistant(lon0, lat0):
+    """
+    Returns the forward and inverse functions of a spherical azimuthal equidistant projection centered on lon0,lat0,
+    where distances and directions from the center are true, in km. 
+    Both functions take and return a sequence of x coordinates and a sequence of y coordinates, as expected by
+    shapely.ops.transform, so the trigonometry of the center is computed only once for all coordinates.
+    """
+    radius = 6371.009 # the mean radius of the earth
+    sin, cos, asin, acos, atan2, sqrt = math.sin, math.cos, math.asin, math.acos, math.atan2, math.sqrt
+    rad, deg = math.radians, math.degrees
+    lam0,phi0 = rad(lon0),rad(lat0)
+    sin0,cos0 = sin(phi0),cos(phi0)
+
+    def forward(xs, ys):
+        outx,outy = [],[]
+        for lon,lat in itertools.izip(xs, ys):
+            phi,dlam = rad(lat),rad(lon)-lam0
+            sinphi,cosphi,cosdlam = sin(phi),cos(phi),cos(dlam)
+            c = acos(max(-1.0, min(1.0, sin0*sinphi + cos0*cosphi*cosdlam)))
+            k = radius * c / sin(c) if c else radius
+            outx.append(k * cosphi * sin(dlam))
+            outy.append(k * (cos0*sinphi - sin0*cosphi*cosdlam))
+        return outx,outy
+
+    def inverse(xs, ys):
+        outx,outy = [],[]
+        for x,y in itertools.izip(xs, ys):
+            rho = sqrt(x*x + y*y)
+            if not rho:
+                outx.append(lon0)
+                outy.append(lat0)
+                continue
+            c = rho / radius
+            sinc,cosc = sin(c),cos(c)
+            outy.append(deg(asin(max(-1.0, min(1.0, cosc*sin0 + y*sinc*cos0/rho)))))
+            outx.append(deg(lam0 + atan2(x*sinc, rho*cos0*cosc - y*sin0*sinc)))
+        return outx,outy
+
+    return forward, inverse
 
 def geodetic_buffer(geometry, distance, resolution=100):
+    """
+    Buffers a shapely geometry or GeoJSON dictionary of lon,lat coordinates by a distance in km,
+    and returns the buffer as a shapely geometry. Resolution is the number of vertexes used
+    to approximate a full circle. 
+
+    The geometry is buffered in an azimuthal equidistant projection centered on it, which makes
+    point buffers exact on the sphere, while for lines and polygons the error grows with their
+    extent from the center. Each point of a multipoint is buffered around its own center. 
+    Geometries spanning more than a hemisphere are not supported. 
+    """
+    from shapely.geometry import shape, Point
+    from shapely.ops import transform, unary_union
+    if not hasattr(geometry, "geom_type"):
+        geometry = shape(geometry)
+    quadsegs = max(1, int(round(resolution / 4.0)))
+
+    if "Point" in geometry.geom_type:
+        points = list(geometry.geoms) if geometry.geom_type == "MultiPoint" else [geometry]
+        buffers = []
+        for point in points:
+            forward,inverse = _azimuthal_equidistant(point.x, point.y)
+            buffers.append(transform(inverse, Point(0,0).buffer(distance, quadsegs)))
+        return buffers[0] if len(buffers) == 1 else unary_union(buffers)
     
-    if "Point" in geometry["type"]:
-        incr = 360 / float(resolution)
-
-        def singlebuff(subgeom):
-            point = subgeom["coordinates"]
-            buffercoords = []
-            cur = 0
-            while cur < 360:
-                pointbuff = _walk(point, cur, distance)
-                buffercoords.append(pointbuff)
-                cur += incr
-                
-            return buffercoords
-        
-        if "Multi" in geometry["type"]:
-            return {"type":"MultiPolygon", "coordinates":[[singlebuff(subgeom)] for subgeom in geometry["geoms"]]}
+    else:
+        xmin,ymin,xmax,ymax = geometry.bounds
+        forward,inverse = _azimuthal_equidistant((xmin+xmax)/2.0, (ymin+ymax)/2.0)
+        projected = transform(forward, geometry)
+        return transform(inverse, projected.buffer(distance, quadsegs))
 
-        else:
-            return {"type":"Polygon", "coordinates":[singlebuff(geometry)]}
-        
+def distance_bbox(bbox, distance, geodetic=False):
+    """
+    Returns the bbox expanded by a distance in all directions, eg to search the spatial index for features within
+    that distance. If geodetic is True, the bbox is in lon,lat degrees and the distance in km, and the expanded bbox
+    conservatively uses the longitude span at the highest latitude it reaches, spanning all longitudes near the poles
+    or the antimeridian. 
+    """
+    xmin,ymin,xmax,ymax = bbox
+    if geodetic:
+        dy = distance / 111.195 # km per degree latitude on the mean earth sphere
+        maxlat = max(abs(ymin), abs(ymax)) + dy
+        dx = 360 if maxlat >= 90 else dy / math.cos(math.radians(maxlat))
+        if xmin-dx < -180 or xmax+dx > 180:
+            return [-180, ymin-dy, 180, ymax+dy]
+        return [xmin-dx, ymin-dy, xmax+dx, ymax+dy]
     else:
-        raise Exception("Geodetic buffer only implemented for points")
-    
+        return [xmin-distance, ymin-distance, xmax+distance, ymax+distance]
+
+def haversine_distance(point1, point2):
+    """
+    Great circle distance in km between two lon,lat points on a sphere with the
+    earth's mean radius. Less precise than Vincenty but much cheaper, which
+    makes it suitable for filtering large numbers of point pairs.
+    """
+    lon1,lat1 = point1[:2]
+    lon2,lat2 = point2[:2]
+    lat1,lat2 = math.radians(lat1),math.radians(lat2)
+    sinlat = math.sin((lat2 - lat1) / 2.0)
+    sinlon = math.sin(math.radians(lon2 - lon1) / 2.0)
+    h = sinlat*sinlat + math.cos(lat1)*math.cos(lat2)*sinlon*sinlon
+    # 6371.009 represents the mean radius of the earth
+    return 6371.009 * 2 * math.asin(min(1.0, math.sqrt(h)))
 
 def great_circle_path(point1, point2, segments):
+    """
+    Returns a list of segments number of lon,lat points along the great circle between
+    point1 and point2, including both endpoints.
+    """
     # http://gis.stackexchange.com/questions/47/what-tools-in-python-are-available-for-doing-great-circle-distance-line-creati
-    ptlon1,ptlat1 = point1
-    ptlon2,ptlat2 = point2
+    # interpolates between the unit vectors of the two endpoints, with all trigonometry
+    # of the endpoints computed only once per path instead of once per segment
+    ptlon1,ptlat1 = point1[:2]
+    ptlon2,ptlat2 = point2[:2]
+    lon1,lat1 = math.radians(ptlon1),math.radians(ptlat1)
+    lon2,lat2 = math.radians(ptlon2),math.radians(ptlat2)
 
-    numberofsegments = segments
-    onelessthansegments = numberofsegments - 1
-    fractionalincrement = (1.0/onelessthansegments)
+    sinlat = math.sin((lat1 - lat2) / 2.0)
+    sinlon = math.sin((lon1 - lon2) / 2.0)
+    coslat1,coslat2 = math.cos(lat1),math.cos(lat2)
+    distance_radians = 2 * math.asin(min(1.0, math.sqrt(sinlat*sinlat + coslat1*coslat2*sinlon*sinlon)))
+    sin_dist_rad = math.sin(distance_radians)
+    if sin_dist_rad == 0 or segments < 3:
+        return [point1,point2] # avoid zerodiv for identical or antipodal points
 
-    ptlon1_radians = math.radians(ptlon1)
-    ptlat1_radians = math.radians(ptlat1)
-    ptlon2_radians = math.radians(ptlon2)
-    ptlat2_radians = math.radians(ptlat2)
+    x1,y1,z1 = coslat1*math.cos(lon1), coslat1*math.sin(lon1), math.sin(lat1)
+    x2,y2,z2 = coslat2*math.cos(lon2), coslat2*math.sin(lon2), math.sin(lat2)
 
-    distance_radians=2*math.asin(math.sqrt(math.pow((math.sin((ptlat1_radians-ptlat2_radians)/2)),2) + math.cos(ptlat1_radians)*math.cos(ptlat2_radians)*math.pow((math.sin((ptlon1_radians-ptlon2_radians)/2)),2)))
-    # 6371.009 represents the mean radius of the earth
-    # shortest path distance
-    distance_km = 6371.009 * distance_radians
-
-    mylats = []
-    mylons = []
-
-    # write the starting coordinates
-    mylats.append([])
-    mylons.append([])
-    mylats[0] = ptlat1
-    mylons[0] = ptlon1 
-
-    f = fractionalincrement
-    icounter = 1
-    while icounter < onelessthansegments:
-        icountmin1 = icounter - 1
-        mylats.append([])
-        mylons.append([])
-        # f is expressed as a fraction along the route from point 1 to point 2
-        sin_dist_rad = math.sin(distance_radians)
-        if sin_dist_rad == 0:
-            return [point1,point2] # hack to avoid zerodiv
-        A=math.sin((1-f)*distance_radians)/sin_dist_rad
-        B=math.sin(f*distance_radians)/sin_dist_rad
-        x = A*math.cos(ptlat1_radians)*math.cos(ptlon1_radians) + B*math.cos(ptlat2_radians)*math.cos(ptlon2_radians)
-        y = A*math.cos(ptlat1_radians)*math.sin(ptlon1_radians) +  B*math.cos(ptlat2_radians)*math.sin(ptlon2_radians)
-        z = A*math.sin(ptlat1_radians) + B*math.sin(ptlat2_radians)
-        newlat=math.atan2(z,math.sqrt(math.pow(x,2)+math.pow(y,2)))
-        newlon=math.atan2(y,x)
-        newlat_degrees = math.degrees(newlat)
-        newlon_degrees = math.degrees(newlon)
-        mylats[icounter] = newlat_degrees
-        mylons[icounter] = newlon_degrees
-        icounter += 1
-        f = f + fractionalincrement
-
-    # write the ending coordinates
-    mylats.append([])
-    mylons.append([])
-    mylats[onelessthansegments] = ptlat2
-    mylons[onelessthansegments] = ptlon2
-
-    return zip(mylons,mylats)
+    # f is expressed as a fraction along the route from point 1 to point 2
+    sin, atan2, sqrt, degrees = math.sin, math.atan2, math.sqrt, math.degrees
+    incr = distance_radians / float(segments - 1)
+    path = [(ptlon1,ptlat1)]
+    for i in xrange(1, segments - 1):
+        A = sin(distance_radians - i*incr) / sin_dist_rad
+        B = sin(i*incr) / sin_dist_rad
+        x = A*x1 + B*x2
+        y = A*y1 + B*y2
+        z = A*z1 + B*z2
+        path.append((degrees(atan2(y,x)), degrees(atan2(z,sqrt(x*x+y*y)))))
+    path.append((ptlon2,ptlat2))
+
+    return path
+
+def worker_count(workers):
+    """Returns the number of worker processes to use, one per cpu if workers is True or -1."""
+    if workers is True or workers < 0:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    return workers
+
+def parallel_map(func, items, workers=None, chunksize=1):
+    """
+    Applies func to each item and returns the list of results, same as the builtin map(). 
+    
+    If workers is set to more than 1, the items are processed by that many worker processes, or by
+    one per cpu if workers is True or -1. Since items and results are passed between processes, 
+    func must be a module-level function, and geometries are best passed as WKB strings. 
+    If workers is not set (default), runs in the current process. 
+    """
+    if not workers or workers == 1:
+        return map(func, items)
+
+    import multiprocessing
+    pool = multiprocessing.Pool(worker_count(workers))
+    try:
+        return pool.map(func, items, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+def _map_chunk(args):
+    func,chunk = args
+    return [func(item) for item in chunk]
+
+def parallel_imap(func, items, workers=None, chunksize=1, initializer=None, initargs=()):
+    """
+    Same as parallel_map(), but yields the results in order as soon as they are ready,
+    so the results can be consumed while the remaining items are still being processed. 
+    Items are read lazily, with only a few chunks per worker sent ahead at a time, 
+    so items can be generated on the fly without all being held in memory. 
+
+    If initializer is given, each worker process calls initializer(*initargs) when it starts. 
+    """
+    if not workers or workers == 1:
+        for item in items:
+            yield func(item)
+        return
+
+    import multiprocessing
+    import collections
+    count = worker_count(workers)
+    pool = multiprocessing.Pool(count, initializer, initargs)
+    pending = collections.deque()
+    items = iter(items)
+    try:
+        while True:
+            chunk = list(itertools.islice(items, chunksize))
+            if chunk:
+                pending.append(pool.apply_async(_map_chunk, [(func, chunk)]))
+            if pending and (not chunk or len(pending) >= count * 2):
+                for result in pending.popleft().get():
+                    yield result
+            elif not chunk:
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+
+# the shared state of the parallel_chunks() call that a worker process was started for
+_WORKER_JOB = None
+
+def _set_worker_job(job):
+    global _WORKER_JOB
+    _WORKER_JOB = job
+
+def _run_job_chunk(args):
+    func,chunk = args
+    return func(_WORKER_JOB, chunk)
+
+def _check_job_transfer(job):
+    # without fork, worker processes are started fresh and the job has to be pickled to reach them
+    if not sys.platform.startswith("win"):
+        return
+    import cPickle
+    try:
+        cPickle.dumps(job, -1)
+    except Exception as err:
+        raise Exception("Parallel workers are not supported on this platform for this operation, since its data cannot be "
+                        "sent to new worker processes (%s). Run it without the workers option instead." % err)
+
+def parallel_chunks(func, job, items, workers=None, chunksize=None, maxchunksize=None):
+    """
+    Splits a list of items, such as feature ids, into chunks, and yields the result of func(job, chunk) 
+    for each chunk in order, as soon as it is ready. 
+
+    Job is the shared state needed to process the items, such as the datasets and options. It is passed 
+    once to each worker process when it starts, so only the chunks of items and the results are passed 
+    for each chunk, and func must be a module-level function. Where processes are forked, the workers 
+    inherit the job without copying it, while elsewhere, such as on Windows, the job must be picklable, 
+    which datasets are not, so an error is raised before any worker is started. 
+
+    If workers is set to more than 1, the chunks are processed by that many worker processes, or by one per 
+    cpu if workers is True or -1, otherwise they are processed in the current process. By default the items
+    are split into about four chunks per worker, to balance the load, optionally capped to maxchunksize so 
+    that results stream back more evenly. 
+    """
+    items = list(items)
+    if not workers or workers == 1:
+        chunksize = chunksize or maxchunksize or len(items) or 1
+        for i in xrange(0, len(items), chunksize):
+            yield func(job, items[i:i+chunksize])
+        return
+
+    _check_job_transfer(job)
+    if not chunksize:
+        chunksize = max(1, len(items) // (worker_count(workers) * 4))
+        if maxchunksize:
+            chunksize = min(chunksize, maxchunksize)
+    tasks = ((func, items[i:i+chunksize]) for i in xrange(0, len(items), chunksize))
+    for result in parallel_imap(_run_job_chunk, tasks, workers, initializer=_set_worker_job, initargs=(job,)):
+        yield result
+
+class SpillFile(object):
+    """
+    A sequence of records kept in a temporary file on disk instead of in memory, which can be iterated
+    any number of times. Records are pickled, and buffered in memory until there are buffersize of them,
+    so that many spill files can be filled at once without keeping them all open. 
+
+    If group is given, the spill file is instead buffered as part of a SpillGroup, which caps the records
+    buffered by all of its spill files together. 
+    """
+    def __init__(self, path, buffersize=1000, group=None):
+        self.path = path
+        self.buffersize = buffersize
+        self.group = group
+        self._buffer = []
+        self._count = 0
+        if group is not None:
+            group.spills.append(self)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, record):
+        self._buffer.append(record)
+        self._count += 1
+        if self.group is not None:
+            self.group._added()
+        elif len(self._buffer) >= self.buffersize:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            import cPickle
+            with open(self.path, "ab") as fileobj:
+                for record in self._buffer:
+                    cPickle.dump(record, fileobj, cPickle.HIGHEST_PROTOCOL)
+            if self.group is not None:
+                self.group.buffered -= len(self._buffer)
+            self._buffer = []
+
+    def __iter__(self):
+        import cPickle
+        self.flush()
+        if not self._count:
+            return
+        with open(self.path, "rb") as fileobj:
+            load = cPickle.Unpickler(fileobj).load
+            for _ in xrange(self._count):
+                yield load()
+
+class SpillGroup(object):
+    """
+    Caps the total number of records buffered in memory by many spill files that are filled at once, 
+    such as one per spatial bucket. When the cap is reached, the spill file with the most buffered 
+    records is flushed, so that memory stays bounded however many spill files there are, while each 
+    flush still writes as many records as possible. 
+    """
+    def __init__(self, maxrecords=10000):
+        self.maxrecords = maxrecords
+        self.spills = []
+        self.buffered = 0
+
+    def _added(self):
+        self.buffered += 1
+        if self.buffered >= self.maxrecords:
+            max(self.spills, key=lambda spill: len(spill._buffer)).flush()
+
+    def flush(self):
+        for spill in self.spills:
+            spill.flush()
+
+def _spread_bits(v):
+    # spreads the lower 16 bits so there is an empty bit between each
+    v &= 0xFFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    v = (v | (v << 1)) & 0x55555555
+    return v
+
+def zorder_index(x, y, bbox):
+    """
+    Returns the position of the point x,y along a z-order (Morton) curve covering bbox,
+    at a resolution of 65536 by 65536 cells. Sorting by this index places
+    spatially nearby points close together. 
+    """
+    xmin,ymin,xmax,ymax = bbox
+    xscale = 65535 / float(xmax - xmin or 1)
+    yscale = 65535 / float(ymax - ymin or 1)
+    ix = int((x - xmin) * xscale)
+    iy = int((y - ymin) * yscale)
+    return _spread_bits(ix) | (_spread_bits(iy) << 1)
+
+def hilbert_index(x, y, bbox):
+    """
+    Returns the position of the point x,y along a Hilbert curve covering bbox,
+    at a resolution of 65536 by 65536 cells. Like zorder_index(), but the curve
+    never jumps, so consecutive runs of the sorted points are more compact.
+    """
+    xmin,ymin,xmax,ymax = bbox
+    n = 65536
+    ix = int((x - xmin) * (n - 1) / float(xmax - xmin or 1))
+    iy = int((y - ymin) * (n - 1) / float(ymax - ymin or 1))
+    d = 0
+    s = n >> 1
+    while s:
+        rx = 1 if ix & s else 0
+        ry = 1 if iy & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant
+        if not ry:
+            if rx:
+                ix = n - 1 - ix
+                iy = n - 1 - iy
+            ix,iy = iy,ix
+        s >>= 1
+    return d
+
+def spatial_keys(bboxes, bbox, method="hilbert"):
+    """
+    Returns the position along a space-filling curve of the center of each bbox in a flat bbox array
+    of the form xmin,ymin,xmax,ymax,..., where method is "hilbert" or "zorder". Null bboxes (NaN) 
+    get the key None, which sorts before all others. 
+    """
+    if method == "hilbert":
+        curve = hilbert_index
+    elif method == "zorder":
+        curve = zorder_index
+    else:
+        raise Exception("Spatial sort method must be 'hilbert' or 'zorder', not %s" % method)
+    keys = []
+    for i in xrange(0, len(bboxes), 4):
+        xmin,ymin,xmax,ymax = bboxes[i:i+4]
+        if xmin != xmin:
+            # NaN for null geometries
+            keys.append(None)
+        else:
+            keys.append(curve((xmin+xmax)/2.0, (ymin+ymax)/2.0, bbox))
+    return keys
+
+def spatial_partitions(items, keys, n):
+    """
+    Splits items into n lists of nearly equal size, after sorting them by their spatial keys from spatial_keys(),
+    so that each list covers a compact area. Useful for giving parallel workers balanced and spatially coherent
+    chunks of features.
+    """
+    order = [item for key,item in sorted(itertools.izip(keys, items), key=lambda pair: pair[0])]
+    n = max(1, min(n, len(order)))
+    size,extra = divmod(len(order), n)
+    partitions = []
+    start = 0
+    for i in xrange(n):
+        end = start + size + (1 if i < extra else 0)
+        partitions.append(order[start:end])
+        start = end
+    return partitions
+
+def union_geometries(geoms, fanout=32):
+    """
+    Unions a list of shapely geometries by a tree reduction, first unioning groups of fanout 
+    neighbouring geometries, then groups of those results, and so on until only one remains. 
+    Geometries should already be sorted spatially, eg with zorder_index(), so that each small union
+    mostly dissolves shared boundaries instead of carrying along large unrelated shapes. 
+    """
+    from shapely.ops import unary_union
+    geoms = list(geoms)
+    if not geoms:
+        return None
+    while len(geoms) > 1:
+        geoms = [unary_union(geoms[i:i+fanout]) for i in xrange(0, len(geoms), fanout)]
+    return geoms[0]
+
+def touching_groups(geoms):
+    """
+    Splits a list of shapely geometries into groups of geometries that touch or overlap each other, 
+    either directly or through other geometries in the group. Returns a list of index lists. 
+    """
+    import rtree
+    from shapely.prepared import prep
+
+    if len(geoms) < 2:
+        return [range(len(geoms))]
+
+    spindex = rtree.index.Index(((i,geom.bounds,None) for i,geom in enumerate(geoms)))
+    
+    # union-find of connected geometries
+    parents = range(len(geoms))
+    def root(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i,geom in enumerate(geoms):
+        prepped = None
+        for j in spindex.intersection(geom.bounds):
+            if j <= i:
+                continue
+            ri,rj = root(i),root(j)
+            if ri == rj:
+                continue
+            if prepped is None:
+                prepped = prep(geom)
+            if prepped.intersects(geoms[j]):
+                parents[rj] = ri
+
+    groups = dict()
+    for i in xrange(len(geoms)):
+        groups.setdefault(root(i), []).append(i)
+    return sorted(groups.values())
+
+def group_by_key(items, key):
+    """
+    Groups items by the values returned by a key function, returning a list of (keyvalue, items) pairs
+    sorted by key value, with the items of each group in their original order. This gives the same result
+    as sorting all items and using itertools.groupby, but each distinct key value is only hashed to an
+    integer code once, and only the distinct values are sorted, which is much faster for repeated values.
+    Falls back to sorting all items if the key values cannot be hashed, eg lists. 
+    """
+    items = list(items)
+    keys = [key(item) for item in items]
+    codes = dict()
+    groups = []
+    try:
+        for item,keyval in itertools.izip(items, keys):
+            code = codes.get(keyval)
+            if code is None:
+                code = codes[keyval] = len(groups)
+                groups.append((keyval, []))
+            groups[code][1].append(item)
+    except TypeError:
+        # unhashable key values
+        order = sorted(xrange(len(items)), key=keys.__getitem__)
+        return [(keyval, [items[i] for i in indexes])
+                for keyval,indexes in itertools.groupby(order, key=keys.__getitem__)]
+    groups.sort(key=lambda group: group[0])
+    return groups
@@ -0,0 +1,210 @@
+"""
+Network graphs built from line data, for routing and service area analysis.
+
+The graph is stored in compressed sparse row (CSR) form, as flat arrays: the outgoing edges of node i are
+found at positions offsets[i] to offsets[i+1] in the targets, weights and featids arrays. Node coordinates
+are kept in the xs and ys arrays.
+"""
+
+import itertools, math
+import array
+import heapq
+
+from ._packed import pack
+from ._pointindex import PointIndex
+
+
+class Network(object):
+    """
+    A network graph of the line vertexes of a vector dataset, where vertexes within tolerance of each other
+    become the same node, and each line segment becomes an edge. Usually created with manager.to_network().
+
+    Attributes:
+        xs, ys: Arrays of the x and y coordinates of each node.
+        offsets: Array of where the outgoing edges of each node start, with one extra item at the end.
+        targets: Array of the node that each edge leads to.
+        weights: Array of the cost of traversing each edge.
+        featids: Array of the id of the feature that each edge is part of.
+    """
+    def __init__(self, data, tolerance=0, weight=None, geodetic=False, directed=False):
+        """
+        Builds the network from a line dataset.
+
+        Weight is a fieldname or function that gives the cost of traversing each feature, which is split over
+        its segments by length. By default the cost is the length, in km if geodetic is True. If directed is True,
+        lines can only be traversed in the direction they are drawn.
+        """
+        if weight is not None and not hasattr(weight, "__call__"):
+            fieldname = weight
+            weight = lambda f: f[fieldname]
+        self.geodetic = geodetic
+        self.directed = directed
+        self.xs = array.array("d")
+        self.ys = array.array("d")
+        self._spindex = None
+
+        # snap vertexes to nodes
+        nodes = dict()
+        floor = math.floor
+        def node(x, y):
+            if tolerance:
+                cx,cy = int(floor(x/tolerance)), int(floor(y/tolerance))
+                for nx in (cx-1,cx,cx+1):
+                    for ny in (cy-1,cy,cy+1):
+                        for i in nodes.get((nx,ny), ()):
+                            if (self.xs[i]-x)**2 + (self.ys[i]-y)**2 <= tolerance*tolerance:
+                                return i
+                key = (cx,cy)
+            else:
+                key = (x,y)
+                if key in nodes:
+                    return nodes[key][0]
+            i = len(self.xs)
+            self.xs.append(x)
+            self.ys.append(y)
+            nodes.setdefault(key, []).append(i)
+            return i
+
+        # collect the edges
+        froms,tos = array.array("l"),array.array("l")
+        weights,featids = array.array("d"),array.array("l")
+        for feat in data:
+            if not feat.geometry: continue
+            geom = pack(feat.geometry)
+            if not hasattr(geom, "typecode") or geom.typecode not in (2,5):
+                raise Exception("Networks can only be built from LineString data")
+            lines = [zip(ring[0::2], ring[1::2]) for ring in geom.iter_rings()]
+            seglens = [[self._length(p1, p2) for p1,p2 in zip(line, line[1:])] for line in lines]
+            if weight:
+                featweight = float(weight(feat))
+                featlen = sum(sum(lens) for lens in seglens)
+                segcount = sum(len(lens) for lens in seglens)
+            for line,lens in itertools.izip(lines, seglens):
+                prev = node(*line[0])
+                for (x,y),seglen in itertools.izip(line[1:], lens):
+                    cur = node(x, y)
+                    if cur != prev:
+                        if weight:
+                            cost = featweight * seglen / featlen if featlen else featweight / segcount
+                        else:
+                            cost = seglen
+                        froms.append(prev); tos.append(cur)
+                        weights.append(cost); featids.append(feat.id)
+                        if not directed:
+                            froms.append(cur); tos.append(prev)
+                            weights.append(cost); featids.append(feat.id)
+                    prev = cur
+
+        # arrange the edges by their from node
+        n = len(self.xs)
+        counts = [0] * (n + 1)
+        for u in froms:
+            counts[u+1] += 1
+        self.offsets = array.array("l", counts)
+        for i in xrange(n):
+            self.offsets[i+1] += self.offsets[i]
+        fill = list(self.offsets[:-1])
+        self.targets = array.array("l", [0]) * len(froms)
+        self.weights = array.array("d", [0]) * len(froms)
+        self.featids = array.array("l", [0]) * len(froms)
+        for u,v,w,fid in itertools.izip(froms, tos, weights, featids):
+            i = fill[u]
+            self.targets[i] = v
+            self.weights[i] = w
+            self.featids[i] = fid
+            fill[u] += 1
+
+        # lowest cost per distance, so that A* estimates never exceed the true remaining cost
+        ratios = [w / self._length((self.xs[u],self.ys[u]), (self.xs[v],self.ys[v]))
+                  for u,v,w in itertools.izip(froms, tos, weights)
+                  if self.xs[u] != self.xs[v] or self.ys[u] != self.ys[v]]
+        self._costfactor = max(0.0, min(ratios)) if ratios else 0.0
+
+    def __len__(self):
+        return len(self.xs)
+
+    def _length(self, p1, p2):
+        if self.geodetic:
+            lon1,lat1,lon2,lat2 = map(math.radians, (p1[0],p1[1],p2[0],p2[1]))
+            h = math.sin((lat2-lat1)/2.0)**2 + math.cos(lat1)*math.cos(lat2)*math.sin((lon2-lon1)/2.0)**2
+            return 2 * 6371.009 * math.asin(min(1.0, math.sqrt(h)))
+        return math.hypot(p2[0]-p1[0], p2[1]-p1[1])
+
+    def edges(self, node):
+        """Yields the (target node, weight, feature id) of each outgoing edge of a node."""
+        for i in xrange(self.offsets[node], self.offsets[node+1]):
+            yield self.targets[i], self.weights[i], self.featids[i]
+
+    def nearest_node(self, x, y):
+        """Returns the node nearest to the point x,y."""
+        if self._spindex is None:
+            self._spindex = PointIndex(xrange(len(self.xs)), self.xs, self.ys)
+        return next(self._spindex.nearest((x,y,x,y), 1))
+
+    def search(self, sources, targets=None, max_cost=None, heuristic=False):
+        """
+        Searches the network from one or more source nodes with Dijkstra's algorithm, expanding the
+        cheapest known node at a time. Stops when all target nodes have been reached, or when all nodes
+        within max cost have been reached. With a single target, setting heuristic to True uses the
+        A* algorithm, expanding towards the target first.
+
+        Returns a dict of the cost to each reached node, and a dict of the (previous node, feature id)
+        that each node was reached from.
+        """
+        if isinstance(sources, (int,long)):
+            sources = [sources]
+        remaining = set([targets] if isinstance(targets, (int,long)) else targets or [])
+        if heuristic and len(remaining) == 1:
+            target = next(iter(remaining))
+            tx,ty = self.xs[target],self.ys[target]
+            factor = self._costfactor
+            estimate = lambda node: factor * self._length((self.xs[node],self.ys[node]), (tx,ty))
+        else:
+            estimate = lambda node: 0.0
+
+        offsets,edgetargets,weights,featids = self.offsets,self.targets,self.weights,self.featids
+        costs = dict()
+        previous = dict()
+        done = set()
+        queue = []
+        for source in sources:
+            costs[source] = 0.0
+            previous[source] = None
+            heapq.heappush(queue, (estimate(source), source))
+
+        while queue:
+            priority,node = heapq.heappop(queue)
+            if node in done:
+                continue
+            done.add(node)
+            if remaining:
+                remaining.discard(node)
+                if not remaining:
+                    break
+            cost = costs[node]
+            for i in xrange(offsets[node], offsets[node+1]):
+                nextnode = edgetargets[i]
+                newcost = cost + weights[i]
+                if max_cost is not None and newcost > max_cost:
+                    continue
+                if newcost < costs.get(nextnode, float("inf")):
+                    costs[nextnode] = newcost
+                    previous[nextnode] = (node, featids[i])
+                    heapq.heappush(queue, (newcost + estimate(nextnode), nextnode))
+
+        return costs, previous
+
+    def shortest_path(self, sources, target, heuristic=True):
+        """
+        Finds the least cost path to the target node from the nearest of one or more source nodes.
+        Returns the list of nodes along the path and the total cost, or None and None if the target
+        cannot be reached.
+        """
+        costs,previous = self.search(sources, [target], heuristic=heuristic)
+        if target not in costs:
+            return None, None
+        nodes = [target]
+        while previous[nodes[-1]] is not None:
+            nodes.append(previous[nodes[-1]][0])
+        nodes.reverse()
+        return nodes, costs[target]
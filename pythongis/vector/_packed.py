@@ -0,0 +1,435 @@
+"""
+Compact internal storage of feature geometries.
+
+Instead of nested lists of coordinate tuples, each geometry is stored as a flat array of
+float64 x,y values along with integer offsets marking where each ring or line part begins.
+This takes a fraction of the memory, and lets bbox calculations, point iteration, reprojection
+and rendering work directly on the flat arrays without recursively walking nested lists.
+
+The GeoJSON dictionary is only created when someone asks for it, via the __geo_interface__
+protocol or by looking up the "type" and "coordinates" keys as if it were a dictionary.
+"""
+
+import sys
+import array
+import itertools
+import struct
+
+
+_TYPECODES = {"Point": 1,
+              "LineString": 2,
+              "Polygon": 3,
+              "MultiPoint": 4,
+              "MultiLineString": 5,
+              "MultiPolygon": 6}
+
+_TYPENAMES = dict((code,name) for name,code in _TYPECODES.items())
+
+# all points have the same ring offsets, so share a single array
+_POINT_RINGS = array.array("l", [0, 1])
+
+# wkb is written in the native byte order, so the coordinate arrays can be copied over as they are
+_LITTLE_ENDIAN = sys.byteorder == "little"
+_WKB_BYTEORDER = 1 if _LITTLE_ENDIAN else 0
+
+
+
+
+class PackedGeometry(object):
+    """
+    Immutable geometry stored as flat coordinate arrays.
+
+    Behaves like a read-only GeoJSON dictionary with the keys "type", "coordinates" and "bbox",
+    so existing code that reads feat.geometry["type"] etc continues to work, but the nested
+    coordinates are then created on the fly, so should be avoided in performance critical code.
+    Since it cannot be changed, it is safe for multiple features to share the same instance.
+
+    Attributes:
+        typecode: Integer code of the geometry type.
+        type: Name of the geometry type, as used by GeoJSON.
+        coords: Flat array of float64 values in the form x1,y1,x2,y2,...
+        rings: Array of point offsets, where ring, line or multipoint part i spans from point rings[i]
+            up to point rings[i+1]. For polygons this includes both exteriors and holes.
+        polys: For MultiPolygons, array of ring offsets where polygon j spans rings polys[j] up to
+            rings polys[j+1]. None for all other types.
+        bbox: The bounding box of the geometry as a list of [xmin,ymin,xmax,ymax].
+    """
+    __slots__ = ("typecode", "coords", "rings", "polys", "_bbox")
+    __hash__ = None
+
+    def __init__(self, typecode, coords, rings, polys=None, bbox=None):
+        self.typecode = typecode
+        self.coords = coords
+        self.rings = rings
+        self.polys = polys
+        if bbox is None and typecode != 1:
+            xs,ys = coords[0::2],coords[1::2]
+            bbox = (min(xs),min(ys),max(xs),max(ys))
+        self._bbox = bbox
+
+    def __repr__(self):
+        return "<PackedGeometry: type=%s points=%s>" % (self.type, len(self.coords)//2)
+
+    def __eq__(self, other):
+        if not isinstance(other, PackedGeometry):
+            return NotImplemented
+        return (self.typecode == other.typecode
+                and self.coords == other.coords
+                and self.rings == other.rings
+                and self.polys == other.polys)
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    # dict-like access
+
+    def __getitem__(self, key):
+        if key == "type":
+            return self.type
+        elif key == "coordinates":
+            return self.coordinates
+        elif key == "bbox":
+            return self.bbox
+        else:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return ["type", "coordinates", "bbox"]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return 3
+
+    def __contains__(self, key):
+        return key in ("type", "coordinates", "bbox")
+
+    def copy(self):
+        """Since packed geometries are immutable, there is no need to copy, so returns itself."""
+        return self
+
+    # properties
+
+    @property
+    def type(self):
+        return _TYPENAMES[self.typecode]
+
+    @property
+    def bbox(self):
+        if self._bbox is None:
+            # points dont store their bbox
+            x,y = self.coords
+            return [x,y,x,y]
+        return list(self._bbox)
+
+    @property
+    def coordinates(self):
+        """Creates and returns the nested GeoJSON coordinates."""
+        typecode = self.typecode
+        if typecode == 1:
+            return tuple(self.coords)
+        rings = [self._ring_points(i) for i in xrange(len(self.rings)-1)]
+        if typecode in (2,4):
+            return rings[0]
+        elif typecode in (3,5):
+            return rings
+        elif typecode == 6:
+            polys = self.polys
+            return [rings[polys[j]:polys[j+1]] for j in xrange(len(polys)-1)]
+
+    @property
+    def __geo_interface__(self):
+        return {"type": self.type,
+                "coordinates": self.coordinates}
+
+    @property
+    def wkb(self):
+        """Returns the geometry as a WKB (Well-Known Binary) string, written directly from the coordinate arrays.
+        Named the same as the shapely attribute, so that shapely.wkb.loads(geom.wkb) works on both."""
+        typecode,coords,rings = self.typecode,self.coords,self.rings
+        header = struct.pack("=BI", _WKB_BYTEORDER, typecode)
+        if typecode == 1:
+            return header + coords.tostring()
+        elif typecode == 2:
+            return header + struct.pack("=I", len(coords)//2) + coords.tostring()
+        elif typecode == 4:
+            pointheader = struct.pack("=BI", _WKB_BYTEORDER, 1)
+            chunks = [header, struct.pack("=I", len(coords)//2)]
+            for i in xrange(0, len(coords), 2):
+                chunks.append(pointheader)
+                chunks.append(coords[i:i+2].tostring())
+            return b"".join(chunks)
+        
+        def ring_chunks(start, end):
+            # count and coordinates of each ring from start up to end
+            for i in xrange(start, end):
+                yield struct.pack("=I", rings[i+1]-rings[i])
+                yield coords[rings[i]*2:rings[i+1]*2].tostring()
+        
+        nrings = len(rings)-1
+        if typecode == 3:
+            chunks = [header, struct.pack("=I", nrings)]
+            chunks.extend(ring_chunks(0, nrings))
+        elif typecode == 5:
+            lineheader = struct.pack("=BI", _WKB_BYTEORDER, 2)
+            chunks = [header, struct.pack("=I", nrings)]
+            for i in xrange(nrings):
+                chunks.append(lineheader)
+                chunks.extend(ring_chunks(i, i+1))
+        elif typecode == 6:
+            polys = self.polys
+            polyheader = struct.pack("=BI", _WKB_BYTEORDER, 3)
+            chunks = [header, struct.pack("=I", len(polys)-1)]
+            for j in xrange(len(polys)-1):
+                chunks.append(polyheader)
+                chunks.append(struct.pack("=I", polys[j+1]-polys[j]))
+                chunks.extend(ring_chunks(polys[j], polys[j+1]))
+        return b"".join(chunks)
+
+    # flat access
+
+    def _ring_points(self, i):
+        flat = self.coords[self.rings[i]*2:self.rings[i+1]*2]
+        return zip(flat[0::2], flat[1::2])
+
+    def iter_points(self):
+        """Yields every x,y point in the geometry, including polygon holes."""
+        coords = self.coords
+        return itertools.izip(itertools.islice(coords, 0, None, 2),
+                              itertools.islice(coords, 1, None, 2))
+
+    def iter_rings(self):
+        """Yields a flat x,y array for each line, polygon ring, or set of multipoints."""
+        coords,rings = self.coords,self.rings
+        for i in xrange(len(rings)-1):
+            yield coords[rings[i]*2:rings[i+1]*2]
+
+    def iter_polygons(self):
+        """For polygon types, yields a list of flat x,y arrays for each polygon, where the first is the exterior
+        and any remaining ones are holes."""
+        rings = list(self.iter_rings())
+        if self.typecode == 3:
+            yield rings
+        elif self.typecode == 6:
+            polys = self.polys
+            for j in xrange(len(polys)-1):
+                yield rings[polys[j]:polys[j+1]]
+
+    # creating new geometries
+
+    def with_coords(self, coords):
+        """Returns a new geometry with the same structure but with a different flat coordinate array of the same length,
+        eg after a reprojection."""
+        if len(coords) != len(self.coords):
+            raise Exception("New coordinate array must be of same length as the old one")
+        return PackedGeometry(self.typecode, coords, self.rings, self.polys)
+
+    def map_rings(self, func):
+        """Returns a new geometry after applying func to each ring, line or set of multipoints.
+        Func takes a list of x,y points, and returns a new list of points which may be of a different length."""
+        coords = array.array("d")
+        rings = array.array("l", [0])
+        for i in xrange(len(self.rings)-1):
+            points = func(self._ring_points(i))
+            coords.extend(itertools.chain.from_iterable(points))
+            rings.append(len(coords)//2)
+        if self.typecode == 1:
+            rings = _POINT_RINGS
+        return PackedGeometry(self.typecode, coords, rings, self.polys)
+
+
+
+
+def _read_header(wkb, pos):
+    fmt = "<" if wkb[pos] == b"\x01" else ">"
+    typecode, = struct.unpack_from(fmt+"I", wkb, pos+1)
+    swap = (fmt == "<") != _LITTLE_ENDIAN
+    return typecode, fmt, swap, pos+5
+
+def _read_points(wkb, pos, n, swap, coords):
+    chunk = array.array("d", wkb[pos:pos+16*n])
+    if swap:
+        chunk.byteswap()
+    coords.extend(chunk)
+    return pos+16*n
+
+def _read_count(wkb, pos, fmt):
+    n, = struct.unpack_from(fmt+"I", wkb, pos)
+    if n == 0:
+        raise ValueError("Empty geometry part")
+    return n, pos+4
+
+def from_wkb(wkb):
+    """
+    Converts a WKB (Well-Known Binary) string to a PackedGeometry, reading the coordinates
+    straight into the flat arrays without creating any intermediate objects.
+
+    Like pack(), GeometryCollections, empty geometries, and geometries with more than two coordinate
+    dimensions are instead returned as GeoJSON dictionaries (via shapely).
+    """
+    try:
+        typecode, fmt, swap, pos = _read_header(wkb, 0)
+        coords = array.array("d")
+        rings = array.array("l", [0])
+        polys = None
+
+        if typecode == 1:
+            _read_points(wkb, pos, 1, swap, coords)
+            if coords[0] != coords[0]:
+                # empty point is written as nan
+                raise ValueError("Empty geometry part")
+            return PackedGeometry(typecode, coords, _POINT_RINGS)
+        
+        elif typecode == 2:
+            n, pos = _read_count(wkb, pos, fmt)
+            _read_points(wkb, pos, n, swap, coords)
+            rings.append(n)
+            
+        elif typecode == 3:
+            nrings, pos = _read_count(wkb, pos, fmt)
+            for _ in xrange(nrings):
+                n, pos = _read_count(wkb, pos, fmt)
+                pos = _read_points(wkb, pos, n, swap, coords)
+                rings.append(rings[-1] + n)
+                
+        elif typecode in (4,5,6):
+            nparts, pos = _read_count(wkb, pos, fmt)
+            if typecode == 4:
+                rings.append(nparts)
+            elif typecode == 6:
+                polys = array.array("l", [0])
+            for _ in xrange(nparts):
+                # each part is a full wkb geometry with its own header
+                subtype, subfmt, subswap, pos = _read_header(wkb, pos)
+                if subtype != typecode - 3:
+                    raise ValueError("Invalid multipart member")
+                if typecode == 4:
+                    pos = _read_points(wkb, pos, 1, subswap, coords)
+                elif typecode == 5:
+                    n, pos = _read_count(wkb, pos, subfmt)
+                    pos = _read_points(wkb, pos, n, subswap, coords)
+                    rings.append(rings[-1] + n)
+                else:
+                    nrings, pos = _read_count(wkb, pos, subfmt)
+                    for _ in xrange(nrings):
+                        n, pos = _read_count(wkb, pos, subfmt)
+                        pos = _read_points(wkb, pos, n, subswap, coords)
+                        rings.append(rings[-1] + n)
+                    polys.append(len(rings)-1)
+                    
+        else:
+            # collections or 3D types
+            raise ValueError("Cannot pack geometry type %s" % typecode)
+            
+    except ValueError:
+        from shapely.wkb import loads
+        return loads(wkb).__geo_interface__
+
+    return PackedGeometry(typecode, coords, rings, polys)
+
+def pack(geometry):
+    """
+    Converts a GeoJSON geometry dictionary to a PackedGeometry.
+
+    Also accepts WKB strings and shapely geometries, which are read via their WKB.
+    Geometries that are already packed are returned as they are. GeometryCollections, and geometries whose
+    coordinates have more than two dimensions, cannot be packed and are instead returned as a copy of the original
+    dictionary.
+    """
+    if isinstance(geometry, PackedGeometry):
+        return geometry
+    elif isinstance(geometry, bytes) and geometry:
+        return from_wkb(geometry)
+    elif hasattr(geometry, "wkb") and hasattr(geometry, "geom_type"):
+        # shapely geometry
+        return from_wkb(geometry.wkb)
+    elif not geometry:
+        return geometry
+
+    geotype = geometry["type"]
+    typecode = _TYPECODES.get(geotype)
+    coords = geometry["coordinates"] if typecode else None
+    if not coords:
+        # collections and empty geometries
+        return dict(geometry)
+
+    if typecode == 1:
+        parts = [[coords]]
+    elif typecode in (2,4):
+        parts = [coords]
+    elif typecode in (3,5):
+        parts = coords
+    else:
+        parts = [ext_or_hole for poly in coords for ext_or_hole in poly]
+
+    # only pack two-dimensional coordinates
+    for part in parts:
+        for p in part:
+            if len(p) != 2:
+                return dict(geometry)
+            break
+
+    flat = array.array("d", itertools.chain.from_iterable(itertools.chain.from_iterable(parts)))
+
+    if typecode == 1:
+        return PackedGeometry(typecode, flat, _POINT_RINGS)
+
+    rings = array.array("l", [0])
+    i = 0
+    for part in parts:
+        i += len(part)
+        rings.append(i)
+
+    if typecode == 6:
+        polys = array.array("l", [0])
+        i = 0
+        for poly in coords:
+            i += len(poly)
+            polys.append(i)
+    else:
+        polys = None
+
+    bbox = geometry.get("bbox")
+    return PackedGeometry(typecode, flat, rings, polys, bbox)
+
+def iter_flat_polygons(geometry):
+    """
+    Yields a list of flat x,y coordinate lists for each polygon in a Polygon or MultiPolygon geometry,
+    the first being the exterior and the rest holes. Works on both packed and GeoJSON geometries.
+    The flat lists can be passed directly to PIL.ImagePath.Path.
+    """
+    if isinstance(geometry, PackedGeometry):
+        for poly in geometry.iter_polygons():
+            yield [ring.tolist() for ring in poly]
+    else:
+        coords = geometry["coordinates"]
+        if geometry["type"] == "Polygon":
+            coords = [coords]
+        for poly in coords:
+            yield [[v for p in ring for v in p[:2]] for ring in poly]
+
+def iter_flat_lines(geometry):
+    """
+    Yields a flat x,y coordinate list for each line in a LineString or MultiLineString, or for all points in a
+    Point or MultiPoint geometry. Works on both packed and GeoJSON geometries.
+    """
+    if isinstance(geometry, PackedGeometry):
+        for ring in geometry.iter_rings():
+            yield ring.tolist()
+    else:
+        geotype = geometry["type"]
+        coords = geometry["coordinates"]
+        if geotype == "Point":
+            coords = [[coords]]
+        elif geotype in ("LineString","MultiPoint"):
+            coords = [coords]
+        for line in coords:
+            yield [v for p in line for v in p[:2]]
@@ -0,0 +1,160 @@
+"""
+A spatial index specialized for points, used instead of an rtree for point data.
+
+Points are binned into a uniform grid of square cells, with about two points per cell. The grid is stored in
+compressed sparse row (CSR) form, as flat arrays: the points are sorted by cell, and the points of cell i are
+found at positions offsets[i] to offsets[i+1] in the ids, xs and ys arrays. Building the index is a single
+counting sort, and queries only visit the cells that overlap the query area.
+"""
+
+import itertools, math
+import array
+import heapq
+
+
+class PointIndex(object):
+    """
+    A grid index of points, with the same intersection() and nearest() methods as an rtree index,
+    so that it can be used in its place, as well as radius queries and bulk versions of the queries.
+    Usually created by VectorData.create_spatial_index() for point data.
+
+    Attributes:
+        ids, xs, ys: Arrays of the id and coordinates of each point, sorted by cell.
+        offsets: Array of where the points of each cell start, with one extra item at the end.
+        bbox: The bbox of all points.
+        cellsize: The width and height of each cell.
+        cols, rows: The number of grid cells in each direction.
+    """
+    def __init__(self, ids, xs, ys, cellsize=None):
+        """Builds the index from sequences of the ids and x and y coordinates of each point."""
+        ids,xs,ys = array.array("l", ids),array.array("d", xs),array.array("d", ys)
+        n = len(ids)
+        if n:
+            xmin,ymin,xmax,ymax = min(xs),min(ys),max(xs),max(ys)
+        else:
+            xmin = ymin = xmax = ymax = 0.0
+        self.bbox = xmin,ymin,xmax,ymax
+        if not cellsize:
+            # about two points per cell, but no more cells than points in either direction,
+            # eg for points along a line
+            width,height = xmax - xmin, ymax - ymin
+            cellsize = max(math.sqrt(width * height * 2.0 / n), max(width, height) * 2.0 / n) if n else 0
+            cellsize = cellsize or 1.0
+        self.cellsize = cellsize
+        self.cols = int((xmax - xmin) // cellsize) + 1
+        self.rows = int((ymax - ymin) // cellsize) + 1
+
+        # sort the points by cell
+        cells = [self._cell(x, y) for x,y in itertools.izip(xs, ys)]
+        counts = [0] * (self.cols * self.rows + 1)
+        for cell in cells:
+            counts[cell+1] += 1
+        self.offsets = array.array("l", counts)
+        for i in xrange(len(counts) - 1):
+            self.offsets[i+1] += self.offsets[i]
+        fill = list(self.offsets[:-1])
+        self.ids = array.array("l", [0]) * n
+        self.xs = array.array("d", [0]) * n
+        self.ys = array.array("d", [0]) * n
+        for i,cell in enumerate(cells):
+            j = fill[cell]
+            self.ids[j] = ids[i]
+            self.xs[j] = xs[i]
+            self.ys[j] = ys[i]
+            fill[cell] += 1
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _colrow(self, x, y):
+        col = max(0, min(self.cols-1, int((x - self.bbox[0]) // self.cellsize)))
+        row = max(0, min(self.rows-1, int((y - self.bbox[1]) // self.cellsize)))
+        return col,row
+
+    def _cell(self, x, y):
+        col,row = self._colrow(x, y)
+        return row * self.cols + col
+
+    def _ring(self, col1, row1, col2, row2, r):
+        # yields the point ranges of the cells r cells outside the range of cells col1,row1 to col2,row2
+        offsets,cols,rows = self.offsets,self.cols,self.rows
+        for row in xrange(max(0, row1-r), min(rows-1, row2+r) + 1):
+            if r and row1-r < row < row2+r:
+                # only the left and right edge cells
+                edgecols = [col for col in (col1-r, col2+r) if 0 <= col < cols]
+            else:
+                edgecols = xrange(max(0, col1-r), min(cols-1, col2+r) + 1)
+            for col in edgecols:
+                cell = row * cols + col
+                yield offsets[cell], offsets[cell+1]
+
+    def intersection(self, bbox):
+        """Yields the ids of the points inside or on the edge of a bbox."""
+        xmin,ymin,xmax,ymax = bbox
+        xs,ys,ids = self.xs,self.ys,self.ids
+        col1,row1 = self._colrow(xmin, ymin)
+        col2,row2 = self._colrow(xmax, ymax)
+        for start,end in self._ring(col1, row1, col2, row2, 0):
+            for i in xrange(start, end):
+                if xmin <= xs[i] <= xmax and ymin <= ys[i] <= ymax:
+                    yield ids[i]
+
+    def within(self, x, y, radius):
+        """Yields the (id, distance) of the points within radius distance of the point x,y."""
+        xs,ys,ids = self.xs,self.ys,self.ids
+        col1,row1 = self._colrow(x - radius, y - radius)
+        col2,row2 = self._colrow(x + radius, y + radius)
+        maxsq = radius * radius
+        for start,end in self._ring(col1, row1, col2, row2, 0):
+            for i in xrange(start, end):
+                dx,dy = xs[i] - x, ys[i] - y
+                sq = dx*dx + dy*dy
+                if sq <= maxsq:
+                    yield ids[i], math.sqrt(sq)
+
+    def nearest(self, bbox, num_results=1):
+        """
+        Yields the ids of the num_results points nearest to a bbox, or to a point given as a bbox
+        with the same min and max, ordered by distance.
+        """
+        xmin,ymin,xmax,ymax = bbox
+        xs,ys,ids = self.xs,self.ys,self.ids
+        num_results = min(num_results, len(ids))
+        if not num_results:
+            return
+        col1,row1 = self._colrow(xmin, ymin)
+        col2,row2 = self._colrow(xmax, ymax)
+        # keep the nearest candidates in a max-heap of negative distances
+        heap = []
+        r = 0
+        while True:
+            for start,end in self._ring(col1, row1, col2, row2, r):
+                for i in xrange(start, end):
+                    x,y = xs[i],ys[i]
+                    dx = xmin - x if x < xmin else (x - xmax if x > xmax else 0.0)
+                    dy = ymin - y if y < ymin else (y - ymax if y > ymax else 0.0)
+                    sq = dx*dx + dy*dy
+                    if len(heap) < num_results:
+                        heapq.heappush(heap, (-sq, i))
+                    elif sq < -heap[0][0]:
+                        heapq.heapreplace(heap, (-sq, i))
+            # points outside the rings searched so far are more than r cells away
+            if len(heap) == num_results and -heap[0][0] <= (r * self.cellsize) ** 2:
+                break
+            if col1-r <= 0 and row1-r <= 0 and col2+r >= self.cols-1 and row2+r >= self.rows-1:
+                break
+            r += 1
+        for negsq,i in sorted(heap, reverse=True):
+            yield ids[i]
+
+    def within_many(self, points, radius):
+        """Yields the list of (id, distance) within radius distance of each x,y point."""
+        within = self.within
+        for x,y in points:
+            yield list(within(x, y, radius))
+
+    def nearest_many(self, points, num_results=1):
+        """Yields the list of the ids of the num_results points nearest to each x,y point."""
+        nearest = self.nearest
+        for x,y in points:
+            yield list(nearest((x,y,x,y), num_results))
@@ -0,0 +1,211 @@
+"""
+Bulk point-in-polygon assignment, for finding the polygons that contain large numbers of points.
+
+The polygons are indexed once in a uniform grid. Each grid cell records the polygons that contain the whole cell,
+which are assigned to the points in that cell without any testing, and the polygons whose boundary passes through
+the cell, which are tested exactly by ray casting. Since the ray is horizontal, the edges of each polygon are
+binned by grid row, so that a test only visits the edges that cross the row of the point, instead of all edges of
+the polygon. Points are processed cell by cell, so that the lookups are shared by all points in a cell.
+"""
+
+import itertools, math
+import array
+
+from ._packed import PackedGeometry, pack
+
+
+class PolygonLocator(object):
+    """
+    Finds the polygons that contain points. Usually used through the point-in-polygon fast paths of
+    manager.spatial_join() and analyzer.spatial_stats().
+
+    Attributes:
+        ids: Array of the id of each polygon.
+        bbox: The bbox of all polygons.
+        cellsize: The width and height of each grid cell.
+        cols, rows: The number of grid cells in each direction.
+    """
+    def __init__(self, ids, geometries, maxcells=262144):
+        """
+        Indexes a sequence of polygon ids and their Polygon or MultiPolygon geometries, as GeoJSON dicts,
+        packed geometries, WKB or shapely geometries. Maxcells limits the size of the grid, which otherwise
+        has about one cell per polygon edge.
+        """
+        self.ids = array.array("l")
+        rings = []
+        for polyid,geom in itertools.izip(ids, geometries):
+            geom = pack(geom)
+            if not isinstance(geom, PackedGeometry) or geom.typecode not in (3,6):
+                raise Exception("Points can only be located in Polygon or MultiPolygon geometries")
+            self.ids.append(polyid)
+            rings.append(list(geom.iter_rings()))
+
+        # size the grid
+        edgecount = sum(len(ring) // 2 - 1 for polyrings in rings for ring in polyrings)
+        if rings:
+            xmins,ymins = [],[]
+            xmaxs,ymaxs = [],[]
+            for polyrings in rings:
+                for ring in polyrings:
+                    xs,ys = ring[0::2],ring[1::2]
+                    xmins.append(min(xs)); ymins.append(min(ys))
+                    xmaxs.append(max(xs)); ymaxs.append(max(ys))
+            self.bbox = min(xmins),min(ymins),max(xmaxs),max(ymaxs)
+        else:
+            self.bbox = 0.0,0.0,0.0,0.0
+        xmin,ymin,xmax,ymax = self.bbox
+        width,height = xmax - xmin, ymax - ymin
+        ncells = max(1, min(edgecount, maxcells))
+        cellsize = max(math.sqrt(width * height / float(ncells)), max(width, height) / float(ncells))
+        self.cellsize = cellsize = cellsize or 1.0
+        self.cols = int(width // cellsize) + 1
+        self.rows = int(height // cellsize) + 1
+
+        # bin the edges of each polygon by row, and mark the cells they pass through
+        # the marked x range is padded, so that rounding never misses a cell the boundary touches
+        pad = cellsize * 1e-9
+        self._rowedges = []
+        boundary = dict()
+        for p,polyrings in enumerate(rings):
+            rowedges = dict()
+            for ring in polyrings:
+                for i in xrange(0, len(ring) - 2, 2):
+                    x1,y1,x2,y2 = ring[i:i+4]
+                    ey1,ey2 = min(y1,y2),max(y1,y2)
+                    row1,row2 = self._row(ey1),self._row(ey2)
+                    for row in xrange(row1, row2+1):
+                        rowedges.setdefault(row, array.array("d")).extend((x1,y1,x2,y2))
+                        if y1 == y2:
+                            ex1,ex2 = min(x1,x2),max(x1,x2)
+                        else:
+                            # the part of the edge inside the row
+                            ry1 = max(ey1, ymin + row * cellsize)
+                            ry2 = min(ey2, ymin + (row + 1) * cellsize)
+                            xa = x1 + (ry1 - y1) * (x2 - x1) / (y2 - y1)
+                            xb = x1 + (ry2 - y1) * (x2 - x1) / (y2 - y1)
+                            ex1,ex2 = min(xa,xb),max(xa,xb)
+                        for col in xrange(self._col(ex1 - pad), self._col(ex2 + pad) + 1):
+                            boundary.setdefault(row * self.cols + col, set()).add(p)
+            self._rowedges.append(rowedges)
+
+        # cells that are not on the boundary of a polygon have the same status as their center,
+        # so scan along the center of each row for the cells inside each polygon
+        interior = dict()
+        for p,rowedges in enumerate(self._rowedges):
+            for row,edges in rowedges.iteritems():
+                yc = ymin + (row + 0.5) * cellsize
+                crossings = []
+                for i in xrange(0, len(edges), 4):
+                    x1,y1,x2,y2 = edges[i:i+4]
+                    if (y1 > yc) != (y2 > yc):
+                        crossings.append(x1 + (yc - y1) * (x2 - x1) / (y2 - y1))
+                crossings.sort()
+                for i in xrange(0, len(crossings) - 1, 2):
+                    col1 = max(0, int(math.ceil((crossings[i] - xmin) / cellsize - 0.5)))
+                    col2 = min(self.cols - 1, int(math.floor((crossings[i+1] - xmin) / cellsize - 0.5)))
+                    for col in xrange(col1, col2+1):
+                        cell = row * self.cols + col
+                        if p not in boundary.get(cell, ()):
+                            interior.setdefault(cell, []).append(p)
+
+        self._boundary = dict((cell, sorted(polys)) for cell,polys in boundary.iteritems())
+        self._interior = interior
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _col(self, x):
+        return max(0, min(self.cols-1, int((x - self.bbox[0]) // self.cellsize)))
+
+    def _row(self, y):
+        return max(0, min(self.rows-1, int((y - self.bbox[1]) // self.cellsize)))
+
+    def _contains(self, p, row, x, y, boundary):
+        # even-odd ray casting to the right, using only the edges of polygon p that cross the row,
+        # returning the boundary argument for points exactly on an edge
+        edges = self._rowedges[p].get(row)
+        if not edges:
+            return False
+        inside = False
+        for i in xrange(0, len(edges), 4):
+            x1,y1,x2,y2 = edges[i:i+4]
+            if (y1 > y) != (y2 > y):
+                xint = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+                if xint == x:
+                    return boundary
+                if xint > x:
+                    inside = not inside
+            elif y1 == y and (x1 == x or (y2 == y and min(x1,x2) <= x <= max(x1,x2))):
+                # on a vertex or horizontal edge
+                return boundary
+        return inside
+
+    def _locate_cell(self, cell, row, points, boundary):
+        # returns the list of containing polygon ids for each x,y point in a cell
+        ids = self.ids
+        inside = [ids[p] for p in self._interior.get(cell, ())]
+        candidates = self._boundary.get(cell, ())
+        if not candidates:
+            return [list(inside) for _ in points]
+        results = []
+        for x,y in points:
+            found = list(inside)
+            found.extend(ids[p] for p in candidates if self._contains(p, row, x, y, boundary))
+            results.append(found)
+        return results
+
+    def locate(self, x, y, boundary=False):
+        """
+        Returns the list of ids of the polygons that contain the point x,y. Points exactly on the boundary
+        of a polygon are only counted as inside it if boundary is True.
+        """
+        return self.locate_many([(x,y)], boundary)[0]
+
+    def locate_many(self, points, boundary=False):
+        """
+        Returns the list of ids of the polygons that contain each x,y point, in the same order as the points.
+        Points exactly on the boundary of a polygon are only counted as inside it if boundary is True.
+        """
+        xmin,ymin,xmax,ymax = self.bbox
+        cellsize,cols = self.cellsize,self.cols
+        results = [None] * len(points)
+        # group the points by cell
+        groups = dict()
+        for i,(x,y) in enumerate(points):
+            if xmin <= x <= xmax and ymin <= y <= ymax and self.ids:
+                col = min(cols-1, int((x - xmin) // cellsize))
+                row = min(self.rows-1, int((y - ymin) // cellsize))
+                groups.setdefault(row * cols + col, []).append(i)
+            else:
+                results[i] = []
+        for cell,indexes in groups.iteritems():
+            row = cell // cols
+            cellresults = self._locate_cell(cell, row, [points[i] for i in indexes], boundary)
+            for i,found in itertools.izip(indexes, cellresults):
+                results[i] = found
+        return results
+
+def locate_points(points, polygons, boundary=False):
+    """
+    Finds the polygons that contain each point feature, for a point and a polygon VectorData dataset. 
+    Returns a dict of the list of containing polygon ids for each point id, or None if the point dataset
+    has features that are not single points, or the polygons cannot be indexed. 
+    """
+    bboxes = points.bboxes
+    ids,coords = [],[]
+    for i,feat in enumerate(points):
+        xmin,ymin,xmax,ymax = bboxes[i*4:i*4+4]
+        if xmin != xmin:
+            # NaN for null geometries
+            continue
+        if xmin != xmax or ymin != ymax:
+            return None
+        ids.append(feat.id)
+        coords.append((xmin,ymin))
+    polyfeats = [feat for feat in polygons if feat.geometry]
+    try:
+        locator = PolygonLocator([feat.id for feat in polyfeats], [feat.geometry for feat in polyfeats])
+    except Exception:
+        # eg geometry collections
+        return None
+    return dict(itertools.izip(ids, locator.locate_many(coords, boundary)))
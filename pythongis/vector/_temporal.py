@@ -0,0 +1,129 @@
+"""
+Temporal indexing of vector features, for quickly finding the features at a given time or within a period.
+
+Features are sorted by their time, so that queries are answered by binary search instead of testing every feature.
+Features that last over a period, with both a start and an end time, are sorted by their start time and grouped
+into blocks that record the latest end time of the features in them, so that blocks that have all ended before
+the queried time can be skipped.
+"""
+
+import bisect
+import datetime
+
+
+_TIME_FORMATS = ("%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%d %H:%M:%S.%f", "%Y%m%d")
+
+def time_value(value):
+    """
+    Converts a time value to a form that can be compared with other time values: dates become datetimes,
+    and text in common ISO formats, such as "2001-12-31" or "2001-12-31 23:59:59", is parsed to datetimes.
+    Numbers, such as years, are kept as they are. Returns None for missing values.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    if isinstance(value, basestring):
+        value = value.strip()
+        for fmt in _TIME_FORMATS:
+            try:
+                return datetime.datetime.strptime(value, fmt)
+            except ValueError:
+                pass
+        try:
+            return float(value)
+        except ValueError:
+            raise Exception("Could not interpret %r as a time value" % value)
+    if isinstance(value, float) and value != value:
+        # NaN
+        return None
+    return value
+
+
+class TemporalIndex(object):
+    """
+    A sorted index of the times of features. Usually created by VectorData.create_temporal_index().
+
+    Attributes:
+        starts: Sorted list of the start time of each feature.
+        ends: List of the end time of each feature in the same order, or None if the features have a single time.
+            Features without an end time last forever.
+        ids: List of the feature ids in the same order.
+        positions: List of the position of each feature in the dataset, in the same order.
+    """
+    blocksize = 64
+
+    def __init__(self, data, start, end=None):
+        """
+        Indexes the features of a dataset by their start time, and their end time if given, each being
+        a field name or a function that takes a feature and returns its time. Features without a start time
+        are not indexed.
+        """
+        startfunc = start if hasattr(start, "__call__") else (lambda f: f[start])
+        endfunc = None
+        if end is not None:
+            endfunc = end if hasattr(end, "__call__") else (lambda f: f[end])
+
+        items = []
+        for pos,feat in enumerate(data):
+            t1 = time_value(startfunc(feat))
+            if t1 is None:
+                continue
+            t2 = time_value(endfunc(feat)) if endfunc else None
+            items.append((t1, pos, feat.id, t2))
+        items.sort()
+
+        self.starts = [t1 for t1,pos,featid,t2 in items]
+        self.positions = [pos for t1,pos,featid,t2 in items]
+        self.ids = [featid for t1,pos,featid,t2 in items]
+        if endfunc:
+            self.ends = [t2 for t1,pos,featid,t2 in items]
+            # the latest end of each block, where None means that a feature in the block never ends
+            self._blockends = []
+            for i in xrange(0, len(items), self.blocksize):
+                blockends = self.ends[i:i+self.blocksize]
+                self._blockends.append(None if None in blockends else max(blockends))
+        else:
+            self.ends = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _matches(self, t1, t2):
+        # yields the index of each feature that exists at some point from t1 to t2, inclusive
+        stop = bisect.bisect_right(self.starts, t2)
+        if self.ends is None:
+            for i in xrange(bisect.bisect_left(self.starts, t1), stop):
+                yield i
+        else:
+            ends,size = self.ends,self.blocksize
+            for block,blockend in enumerate(self._blockends):
+                start = block * size
+                if start >= stop:
+                    break
+                if blockend is not None and blockend < t1:
+                    # all features in the block ended before t1
+                    continue
+                for i in xrange(start, min(start + size, stop)):
+                    end = ends[i]
+                    if end is None or end >= t1:
+                        yield i
+
+    def between(self, t1, t2):
+        """Returns the ids of the features that exist at some point from t1 to t2, inclusive, in the order of the dataset."""
+        t1,t2 = time_value(t1),time_value(t2)
+        matches = sorted(self._matches(t1, t2), key=self.positions.__getitem__)
+        return [self.ids[i] for i in matches]
+
+    def at_time(self, t):
+        """Returns the ids of the features that exist at time t, in the order of the dataset."""
+        return self.between(t, t)
+
+    def times(self):
+        """Returns the sorted list of unique start and end times, eg for the steps of a time slider."""
+        times = set(self.starts)
+        if self.ends is not None:
+            times.update(end for end in self.ends if end is not None)
+        return sorted(times)
@@ -1,11 +1,19 @@
 
 import itertools, operator, math
+import heapq
+import collections
 import gc   # garbage collector
 from .data import *
 
 import shapely, shapely.ops, shapely.geometry
 from shapely.prepared import prep as supershapely
 
+import PIL, PIL.Image, PIL.ImageDraw, PIL.ImagePath
+
+from ._helpers import parallel_imap, parallel_chunks, distance_bbox
+from ._geodesic import distance as geodesic_distance
+from ._pointinpolygon import locate_points
+
 
 
 
@@ -13,7 +21,7 @@ from shapely.prepared import prep as supershapely
 
 # Overlay Analysis (transfer of values, but no clip)
 
-def spatial_stats(groupbydata, valuedata, fieldmapping=[], keepall=True, subkey=None, key=None, **kwargs):
+def spatial_stats(groupbydata, valuedata, fieldmapping=[], keepall=True, subkey=None, key=None, weighted=False, workers=None, tilesize=1024, **kwargs):
     """
     Summarizes the values of "valuedata" that overlap "groupbydata",
     and adds the summary statistics to the output data.
@@ -25,6 +33,23 @@ def spatial_stats(groupbydata, valuedata, fieldmapping=[], keepall=True, subkey=
     sum, max, min, and average.
 
     Key is a function for determining if a pair of features should be processed, taking feat and clipfeat as input args and returning True or False
+
+    Overlapping value features are found with the spatial index and tested against each group feature's prepared geometry, 
+    feeding each match directly into the statistics instead of collecting them first. If "weighted" is True and both datasets
+    are polygons, each value feature counts in proportion to the share of its area that overlaps the group feature, 
+    so that count becomes the sum of those shares, sum the weighted sum, and mean the weighted mean. 
+    Group features can be processed in parallel by setting "workers" to the number of worker processes, or True to use one per cpu
+    (requires a platform where worker processes are forked, since the datasets are not sent to the workers). 
+    When summarizing single points in polygons, all points are instead located in a single pass with a point-in-polygon grid, 
+    which is much faster and does not use workers. 
+
+    When "valuedata" is a raster, "fieldmapping" is instead a list of ('outfieldname', bandnum, 'statistic name or function') tuples,
+    where valid statistics are count, sum, mean, min, max, median, majority, and minority, or a function that takes the list of
+    cell values. Rather than clipping the raster for each feature, the feature ids are burned onto the raster grid one tile at a time,
+    and all the statistics are collected in a single pass over each tile's cells, ignoring nodata cells. Features that overlap
+    each other are burned onto separate layers, so each cell counts towards every feature that covers it, while cells inside 
+    polygon holes are not counted. "tilesize" sets the width and height of each tile in cells, and "workers" sets the number 
+    of worker processes used to process tiles in parallel, or True to use one per cpu. 
     """
 
     from . import sql
@@ -37,12 +62,46 @@ def spatial_stats(groupbydata, valuedata, fieldmapping=[], keepall=True, subkey=
 
     # loop
     if not hasattr(groupbydata, "spindex"): groupbydata.create_spatial_index()
-    groupfeats = groupbydata if keepall else groupbydata.quick_overlap(valuedata.bbox) # take advantage of spindex if not keeping all
+    if keepall:
+        groupfeats = groupbydata
+    else:
+        # take advantage of spindex if not keeping all
+        x1,y1,x2,y2 = valuedata.bbox
+        groupfeats = list(groupbydata.quick_overlap([min(x1,x2),min(y1,y2),max(x1,x2),max(y1,y2)]))
 
     if isinstance(valuedata, VectorData):
         # vector in vector
         
         if not hasattr(valuedata, "spindex"): valuedata.create_spatial_index()
+        polyonpoly = groupbydata.type == valuedata.type == "Polygon"
+        weighted = weighted and polyonpoly
+        
+        # points in polygons are all located in one pass
+        located = None
+        if groupbydata.type == "Polygon" and valuedata.type == "Point":
+            located = locate_points(valuedata, groupfeats, boundary=True)
+
+        if located is not None:
+            groupvalues = dict()
+            for valfeat in valuedata:
+                for groupid in located.get(valfeat.id, ()):
+                    groupvalues.setdefault(groupid, []).append(valfeat)
+            def get_aggregs(groupfeat):
+                matched = ((valfeat,1.0) for valfeat in groupvalues.get(groupfeat.id, ())
+                           if not key or key(groupfeat, valfeat))
+                return _aggregate_matches(matched, fieldmapping, subkey)
+            
+        elif workers and workers != 1:
+            # worker processes inherit the datasets when forked, and return only the aggregated rows
+            groupids = [f.id for f in groupfeats if f.geometry]
+            job = (groupbydata, valuedata, fieldmapping, subkey, key, weighted, polyonpoly)
+            results = dict(itertools.chain.from_iterable(parallel_chunks(_vector_stats_chunk, job, groupids, workers)))
+            get_aggregs = lambda groupfeat: results[groupfeat.id]
+            
+        else:
+            valshapes = dict()
+            get_aggregs = lambda groupfeat: _vector_stats_group(groupfeat, valuedata, fieldmapping, subkey, key, weighted, polyonpoly, valshapes)
+            
         for groupfeat in groupfeats: 
 
             if not groupfeat.geometry:
@@ -52,104 +111,310 @@ def spatial_stats(groupbydata, valuedata, fieldmapping=[], keepall=True, subkey=
                     out.add_feature(newrow, None)
 
                 continue
-            
-            geom = groupfeat.get_shapely()
-            supergeom = supershapely(geom)
-            print groupfeat
-            valuefeats = ((valfeat,valfeat.get_shapely()) for valfeat in valuedata.quick_overlap(groupfeat.bbox))
 
-            # aggregate
-            if groupbydata.type == valuedata.type == "Polygon":
-                # when comparing polys to polys, dont count neighbouring polygons that just touch on the edge
-                def overlaps(valgeom):
-                    if supergeom.intersects(valgeom) and not geom.touches(valgeom):
-                        return True
-            else:
-                # for lines and points, ok that just touches on the edge
-                def overlaps(valgeom):
-                    return supergeom.intersects(valgeom)
-                
-            if key:
-                matches = (valfeat for valfeat,valgeom in valuefeats
-                           if key(groupfeat,valfeat) and overlaps(valgeom))
-            else:
-                matches = ((valfeat,valgeom) for valfeat,valgeom in valuefeats
-                           if overlaps(valgeom))
+            aggregs = get_aggregs(groupfeat)
+            if aggregs:
+                for aggreg in aggregs:
+                    newrow = list(groupfeat.row)
+                    newrow.extend( aggreg )
+                    out.add_feature(newrow, groupfeat.geometry)
+                    
+            elif keepall:
+                newrow = list(groupfeat.row)
+                newrow.extend( (None for _ in fieldmapping) )
+                out.add_feature(newrow, groupfeat.geometry)
 
-            # clean potential junk, maybe allow user setting of minimum area (put on hold for now, maybe user should make sure of this in advance?)
-            def cleaned():
-                for valfeat,valgeom in matches:
-                    yield valfeat
-            matches = list(cleaned())
+    else:
+        # raster in vector
+        zonestats = _zonal_stats(groupfeats, groupbydata, valuedata, fieldmapping, tilesize, workers)
+        for f in groupfeats:
+            stats = zonestats.get(f.id)
+            if stats is None and not keepall:
+                continue
+            row = f.row + (stats or [None for _ in fieldmapping])
+            out.add_feature(row, f.geometry)
 
-            if subkey:
-                if matches:
-                    for group in sql.groupby(matches, subkey):
-                        aggreg = sql.aggreg(group, fieldmapping)
+    return out
 
-                        newrow = list(groupfeat.row)
-                        newrow.extend( aggreg )
-                        out.add_feature(newrow, geom.__geo_interface__)
 
-                elif keepall:
-                    newrow = list(groupfeat.row)
-                    newrow.extend( (None for _ in fieldmapping) )
-                    out.add_feature(newrow, geom.__geo_interface__)
 
-            else:
-                if matches:
-                    aggreg = sql.aggreg(matches, fieldmapping)
 
-                # add
-                if matches:
-                    newrow = list(groupfeat.row)
-                    newrow.extend( aggreg )
-                    out.add_feature(newrow, geom.__geo_interface__)
 
-                elif keepall:
-                    newrow = list(groupfeat.row)
-                    newrow.extend( (None for _ in fieldmapping) )
-                    out.add_feature(newrow, geom.__geo_interface__)
 
-    else:
-        # raster in vector
-        # TODO: For very large files, something in here produces a crash after returning output even though memory use seems low...
-        from .. import raster
 
-        for f in groupfeats:
-            print f
-            try:
-                cropped = raster.manager.crop(valuedata, f.bbox)
-            except:
+# Vector statistics
+
+def _vector_stats_group(groupfeat, valuedata, fieldmapping, subkey, key, weighted, polyonpoly, valshapes):
+    """Finds and aggregates the value features overlapping a single group feature.
+    Returns a list of aggregated value rows, one for each subkey group, or an empty list if no matches.
+    Valshapes is a dict used to cache the shapely geometries of value features between calls."""
+    geom = groupfeat.get_shapely()
+    prepped = supershapely(geom)
+
+    def matches():
+        for valfeat in valuedata.quick_overlap(groupfeat.bbox):
+            if key and not key(groupfeat, valfeat):
                 continue
-            # TODO: only check overlapping tiles
-            # TODO: how to calc stat on multiple overlapping tiles           
-            fdata = VectorData()
-            fdata.add_feature([], f.geometry)
-            
-            clipped = raster.manager.clip(cropped, fdata)
-
-            #import pythongis as pg
-            #mapp = pg.renderer.Map()
-            #mapp.add_layer(clipped)
-            #mapp.add_layer(fdata, fillcolor=None)
-            #mapp.add_legend()
-            #mapp.view()
-
-            del fdata
-            del cropped
-            gc.collect()
-            
-            row = f.row + [None for _ in fieldmapping]
-            outfeat = out.add_feature(row, f.geometry)
-            for statfield,bandnum,outstat in fieldmapping:
-                stat = clipped.bands[bandnum].summarystats(outstat)[outstat]
-                outfeat[statfield] = stat
+            valgeom = valshapes.get(valfeat.id)
+            if valgeom is None:
+                valgeom = valshapes[valfeat.id] = valfeat.get_shapely()
+            if not prepped.intersects(valgeom):
+                continue
+            if weighted:
+                # share of the value feature's area inside the group feature
+                area = valgeom.area
+                weight = geom.intersection(valgeom).area / area if area else 0
+                if not weight:
+                    continue
+            elif polyonpoly and prepped.touches(valgeom):
+                # when comparing polys to polys, dont count neighbouring polygons that just touch on the edge
+                continue
+            else:
+                weight = 1.0
+            yield valfeat,weight
+
+    return _aggregate_matches(matches(), fieldmapping, subkey)
+
+def _aggregate_matches(matched, fieldmapping, subkey):
+    """Aggregates the (valfeat, weight) pairs that matched a group feature.
+    Returns a list of aggregated value rows, one for each subkey group, or an empty list if no matches."""
+    from . import sql
+
+    if subkey:
+        matched = list(matched)
+        aggregs = []
+        if hasattr(subkey, "__call__"):
+            subkeyfunc = subkey
+        elif isinstance(subkey, (list,tuple)):
+            subkeyfunc = lambda f: tuple((f[k] for k in subkey))
+        else:
+            subkeyfunc = lambda f: f[subkey]
+        for group in sql.groupby(matched, lambda (valfeat,weight): subkeyfunc(valfeat)):
+            acc = sql.Accumulator(fieldmapping)
+            for valfeat,weight in group:
+                acc.add(valfeat, weight)
+            aggregs.append(acc.result())
+        return aggregs
+    
+    else:
+        acc = sql.Accumulator(fieldmapping)
+        for valfeat,weight in matched:
+            acc.add(valfeat, weight)
+        return [acc.result()] if acc.count else []
+
+def _vector_stats_chunk(job, groupids):
+    """Runs in worker processes, aggregating a chunk of group features."""
+    groupbydata, valuedata, fieldmapping, subkey, key, weighted, polyonpoly = job
+    valshapes = dict()
+    return [(groupid, _vector_stats_group(groupbydata[groupid], valuedata, fieldmapping, subkey, key, weighted, polyonpoly, valshapes))
+            for groupid in groupids]
+
+# Zonal statistics
+
+_ZONAL_VALUE_STATS = ("median","majority","minority")
+
+def _zonal_tile_stats(task):
+    """Accumulates the cell values of each zone in a single tile, for each band.
+    Runs in worker processes, so the tile images are given as bytes."""
+    width,height,layerbytes,bands = task
+    layers = [PIL.Image.frombytes("I", (width,height), zonebytes).getdata() for zonebytes in layerbytes]
+    results = []
+    for mode,valuebytes,nodata,keepvalues in bands:
+        values = PIL.Image.frombytes(mode, (width,height), valuebytes).getdata()
+        accums = dict()
+        for zones in layers:
+            for zone,val in itertools.izip(zones, values):
+                if not zone or val == nodata or val != val:
+                    continue
+                acc = accums.get(zone)
+                if acc is None:
+                    # count, sum, min, max, and count of each value if needed
+                    acc = accums[zone] = [0, 0, val, val, dict() if keepvalues else None]
+                acc[0] += 1
+                acc[1] += val
+                if val < acc[2]:
+                    acc[2] = val
+                elif val > acc[3]:
+                    acc[3] = val
+                if keepvalues:
+                    valuecounts = acc[4]
+                    valuecounts[val] = valuecounts.get(val, 0) + 1
+        results.append(accums)
+    return results
+
+def _merge_accums(merged, accums):
+    for zone,acc in accums.iteritems():
+        prev = merged.get(zone)
+        if prev is None:
+            merged[zone] = acc
+        else:
+            prev[0] += acc[0]
+            prev[1] += acc[1]
+            prev[2] = min(prev[2], acc[2])
+            prev[3] = max(prev[3], acc[3])
+            if acc[4] is not None:
+                for val,cnt in acc[4].iteritems():
+                    prev[4][val] = prev[4].get(val, 0) + cnt
+
+def _zonal_stat(acc, stat):
+    count,total,_min,_max,valuecounts = acc
+    if stat == "count": return count
+    elif stat == "sum": return total
+    elif stat in ("mean","average","avg"): return total / float(count)
+    elif stat == "min": return _min
+    elif stat == "max": return _max
+    elif stat == "median":
+        half = count // 2
+        for val,cnt in sorted(valuecounts.items()):
+            half -= cnt
+            if half < 0:
+                return val
+    elif stat == "majority": return max(valuecounts.items(), key=lambda(val,cnt): cnt)[0]
+    elif stat == "minority": return min(valuecounts.items(), key=lambda(val,cnt): cnt)[0]
+    elif hasattr(stat, "__call__"):
+        values = [val for val,cnt in sorted(valuecounts.items()) for _ in xrange(cnt)]
+        return stat(values)
+    else:
+        raise Exception("Unknown statistic %s" % stat)
+
+def _zonal_layers(feats):
+    """Assigns each feature to the first layer where it does not overlap any other feature, 
+    returning the layer number of each feature. Features that only touch can share a layer, 
+    so a layer of neighbouring polygons covers each cell at most once."""
+    import rtree
+    index = rtree.index.Index()
+    layers = []
+    shapes = []
+    for i,feat in enumerate(feats):
+        shape = feat.get_shapely()
+        neighbours = dict()
+        for j in index.intersection(feat.bbox):
+            neighbours.setdefault(layers[j], []).append(shapes[j])
+        layer = 0
+        if neighbours:
+            prepped = supershapely(shape)
+            while any(prepped.intersects(other) and not prepped.touches(other)
+                      for other in neighbours.get(layer, ())):
+                layer += 1
+        layers.append(layer)
+        shapes.append(shape)
+        index.insert(i, feat.bbox)
+    return layers
+
+def _zonal_stats(feats, groupbydata, raster, fieldmapping, tilesize=1024, workers=None):
+    """Calculates raster statistics for each feature, by burning feature ids onto the raster grid
+    and summarizing all cells in a single pass. Returns a dict of feature id to stats row, 
+    for features that overlap at least one valid cell."""
+    from ._packed import iter_flat_polygons, iter_flat_lines
+
+    # zone number for each feature, and the layer it is burned onto, so that overlapping features
+    # are burned onto separate layers and each cell counts towards every feature that covers it
+    feats = [f for f in feats if f.geometry]
+    zones = dict((f.id,i+1) for i,f in enumerate(feats))
+    zonefeats = dict((i+1,f) for i,f in enumerate(feats))
+    zonelayers = dict((i+1,layer) for i,layer in enumerate(_zonal_layers(feats)))
+    
+    bandnums = sorted(set(bandnum for _,bandnum,_ in fieldmapping))
+    keepvalues = dict((bandnum, any(stat in _ZONAL_VALUE_STATS or hasattr(stat, "__call__")
+                                    for _,b,stat in fieldmapping if b == bandnum))
+                      for bandnum in bandnums)
+
+    def tile_tasks():
+        for row in xrange(0, raster.height, tilesize):
+            for col in xrange(0, raster.width, tilesize):
+                width = min(tilesize, raster.width - col)
+                height = min(tilesize, raster.height - row)
+                
+                # find features overlapping the tile
+                x1,y1 = raster.cell_to_geo(col-0.5, row-0.5)
+                x2,y2 = raster.cell_to_geo(col+width-0.5, row+height-0.5)
+                tilebbox = [min(x1,x2),min(y1,y2),max(x1,x2),max(y1,y2)]
+                tilezones = sorted(zones[f.id] for f in groupbydata.quick_overlap(tilebbox) if f.id in zones)
+                if not tilezones:
+                    continue
+
+                # burn zone numbers using the raster's inverse affine shifted to the tile origin
+                a,b,c,d,e,f = raster.inv_affine
+                coeffs = (a,b,c-col,d,e,f-row)
+                layerimgs = dict()
+                for zone in tilezones:
+                    layer = zonelayers[zone]
+                    zoneimg = layerimgs.get(layer)
+                    if zoneimg is None:
+                        zoneimg = layerimgs[layer] = PIL.Image.new("I", (width,height), 0)
+                    drawer = PIL.ImageDraw.Draw(zoneimg)
+                    geom = zonefeats[zone].geometry
+                    geotype = geom["type"]
+                    if "Polygon" in geotype:
+                        for poly in iter_flat_polygons(geom):
+                            path = PIL.ImagePath.Path(poly[0])
+                            path.transform(coeffs)
+                            if len(poly) == 1:
+                                drawer.polygon(path, fill=zone, outline=zone)
+                                continue
+                            # polygons with holes are drawn through a mask, so that the holes do not
+                            # erase features inside them drawn onto the same layer
+                            mask = PIL.Image.new("1", (width,height), 0)
+                            maskdrawer = PIL.ImageDraw.Draw(mask)
+                            maskdrawer.polygon(path, fill=1, outline=1)
+                            for hole in poly[1:]:
+                                path = PIL.ImagePath.Path(hole)
+                                path.transform(coeffs)
+                                maskdrawer.polygon(path, fill=0)
+                            zoneimg.paste(zone, None, mask)
+                    else:
+                        for line in iter_flat_lines(geom):
+                            path = PIL.ImagePath.Path(line)
+                            path.transform(coeffs)
+                            if "LineString" in geotype:
+                                drawer.line(path, fill=zone)
+                            else:
+                                drawer.point(path, fill=zone)
+
+                # only send the part of the tile that was drawn on
+                drawnboxes = [img.getbbox() for img in layerimgs.values()]
+                drawnboxes = [box for box in drawnboxes if box]
+                if not drawnboxes:
+                    continue
+                left,upper,right,lower = drawn = (min(box[0] for box in drawnboxes), min(box[1] for box in drawnboxes),
+                                                  max(box[2] for box in drawnboxes), max(box[3] for box in drawnboxes))
+                layerbytes = [img.crop(drawn).tobytes() for _,img in sorted(layerimgs.items())]
+                box = (col+left, row+upper, col+right, row+lower)
+                bands = []
+                for bandnum in bandnums:
+                    band = raster.bands[bandnum]
+                    valueimg = band.img.crop(box)
+                    bands.append((valueimg.mode, valueimg.tobytes(), band.nodataval, keepvalues[bandnum]))
+                yield right-left, lower-upper, layerbytes, bands
+
+    # summarize tiles and merge the results
+    merged = [dict() for _ in bandnums]
+    if workers and workers != 1:
+        results = parallel_imap(_zonal_tile_stats, tile_tasks(), workers)
+    else:
+        results = itertools.imap(_zonal_tile_stats, tile_tasks())
+    for tileresult in results:
+        for bandmerged,accums in itertools.izip(merged, tileresult):
+            _merge_accums(bandmerged, accums)
+
+    # calculate final stats
+    bandindex = dict((bandnum,i) for i,bandnum in enumerate(bandnums))
+    stats = dict()
+    for zone,feat in zonefeats.iteritems():
+        row = []
+        found = False
+        for _,bandnum,stat in fieldmapping:
+            acc = merged[bandindex[bandnum]].get(zone)
+            if acc:
+                row.append(_zonal_stat(acc, stat))
+                found = True
+            else:
+                row.append(None)
+        if found:
+            stats[feat.id] = row
+    return stats
 
-            del clipped
-            gc.collect()
 
-    return out
 
 
 
@@ -237,7 +502,7 @@ def spatial_stats(groupbydata, valuedata, fieldmapping=[], keepall=True, subkey=
 ##        # aggregate
 ##        if matches:
 ##            newrow.extend( sql.aggreg(matches, fieldmapping) )
-##            out.add_feature(newrow, geom.__geo_interface__)
+##            out.add_feature(newrow, groupfeat.geometry)
 ##
 ##        elif keepall:
 ##            newrow = list(groupfeat.row)
@@ -305,10 +570,161 @@ def closest_point(data, otherdata):
         othershps = (otherfeat.get_shapely() for otherfeat in otherdata)
         nearest = sorted(othershps, key=lambda othershp: shp.distance(othershp))[0]
         npoint = nearest_points(shp, nearest)[0]
-        out.add_feature(feat.row, npoint.__geo_interface__)
+        out.add_feature(feat.row, npoint.wkb)
         
     return out
 
+# Distance matrix
+
+def _point_coords(data):
+    """Returns a dict of feature ids to x,y coordinates if all features are single points, otherwise None."""
+    coords = dict()
+    for feat in data:
+        if not feat.geometry: continue
+        if feat.geometry["type"] != "Point":
+            return None
+        coords[feat.id] = tuple(feat.geometry["coordinates"][:2])
+    return coords
+
+class _DistanceJob(object):
+    # holds the datasets and options of a distance matrix, along with the coordinates and
+    # shapes of the other dataset, which are prepared once and reused for every row
+    def __init__(self, data, other, geodetic, precise, max_distance, k):
+        self.data = data
+        self.other = other
+        self.geodetic = geodetic
+        self.precise = precise
+        self.max_distance = max_distance
+        self.k = k
+        # features are not paired with themselves within a single dataset
+        self.exclude_self = other is data
+        self.datapoints = _point_coords(data)
+        self.otherpoints = _point_coords(other) if self.datapoints is not None else None
+        self.othershapes = dict()
+        self.otherids = [feat.id for feat in other if feat.geometry]
+        if self.otherpoints is not None and geodetic and not precise:
+            # precompute the trigonometry of all the other points for the dense haversine rows
+            lonlats = [self.otherpoints[id] for id in self.otherids]
+            self.otherlons = [math.radians(x) for x,y in lonlats]
+            self.otherlats = [math.radians(y) for x,y in lonlats]
+            self.othercoslats = [math.cos(lat) for lat in self.otherlats]
+
+    def distance(self, feat, otherid):
+        if self.otherpoints is not None:
+            p1,p2 = self.datapoints[feat.id], self.otherpoints[otherid]
+            if self.geodetic:
+                return geodesic_distance(p1, p2, self.precise)
+            return math.hypot(p2[0]-p1[0], p2[1]-p1[1])
+        shp = feat.get_shapely()
+        if otherid not in self.othershapes:
+            self.othershapes[otherid] = self.other[otherid].get_shapely()
+        othershp = self.othershapes[otherid]
+        if self.geodetic:
+            # geodesic distance between the planar nearest points
+            p1,p2 = shapely.ops.nearest_points(shp, othershp)
+            return geodesic_distance((p1.x,p1.y), (p2.x,p2.y), self.precise)
+        return shp.distance(othershp)
+
+    def dense_row(self, feat):
+        # distances to all other features, computed over whole coordinate lists for points
+        if self.otherpoints is not None and not (self.geodetic and self.precise):
+            x,y = self.datapoints[feat.id]
+            if self.geodetic:
+                lon,lat = math.radians(x),math.radians(y)
+                coslat = math.cos(lat)
+                sin, asin, sqrt = math.sin, math.asin, math.sqrt
+                dists = [2 * 6371.009 * asin(min(1.0, sqrt(sin((olat-lat)/2.0)**2 + coslat*ocoslat*sin((olon-lon)/2.0)**2)))
+                         for olon,olat,ocoslat in itertools.izip(self.otherlons, self.otherlats, self.othercoslats)]
+            else:
+                hypot = math.hypot
+                dists = [hypot(ox-x, oy-y) for ox,oy in (self.otherpoints[id] for id in self.otherids)]
+            return zip(self.otherids, dists)
+        return [(otherid, self.distance(feat, otherid)) for otherid in self.otherids]
+
+    def row(self, feat):
+        """Returns a list of (otherid, distance) pairs for a feature, limited by max distance and k."""
+        max_distance,k = self.max_distance,self.k
+        if max_distance is None and not k:
+            pairs = self.dense_row(feat)
+            if self.exclude_self:
+                pairs = [(otherid,dist) for otherid,dist in pairs if otherid != feat.id]
+            return pairs
+
+        if max_distance is None:
+            # the spatial index only knows planar bbox distances, so use the farthest of the k
+            # index-nearest features as a search distance guaranteed to contain the true k nearest
+            n = k + 1 if self.exclude_self else k
+            nearest = [otherfeat.id for otherfeat in self.other.quick_nearest(feat.bbox, n=n)
+                       if not (self.exclude_self and otherfeat.id == feat.id)]
+            if not nearest:
+                return []
+            searchdist = max(self.distance(feat, otherid) for otherid in nearest)
+        else:
+            searchdist = max_distance
+            
+        bbox = distance_bbox(feat.bbox, searchdist, self.geodetic)
+        pairs = ((otherfeat.id, self.distance(feat, otherfeat.id)) for otherfeat in self.other.quick_overlap(bbox)
+                 if not (self.exclude_self and otherfeat.id == feat.id))
+        if max_distance is not None:
+            pairs = ((otherid,dist) for otherid,dist in pairs if dist <= max_distance)
+        if k:
+            pairs = heapq.nsmallest(k, pairs, key=operator.itemgetter(1))
+        return list(pairs)
+
+def _distance_block(job, featids):
+    """Computes the distance rows for a block of features, in worker processes if any."""
+    return [(featid, job.row(job.data[featid])) for featid in featids]
+
+def distance_matrix(data, other=None, geodetic=False, max_distance=None, k=None, precise=False, blocksize=1000, outpath=None, workers=None):
+    """
+    Calculates the distances between each feature in data and the features in other, 
+    or between all features in data if other is not given, in which case features are
+    not paired with themselves. 
+
+    Distances are planar in the units of the coordinate system, or geodesic in km if geodetic
+    is True, using the haversine formula or the precise Vincenty formula if precise is True. 
+    For geometries other than points, the geodesic distance is measured between their planar
+    nearest points. 
+
+    The matrix is sparse if max_distance is set, only including pairs within that distance, 
+    and/or if k is set, only including the k nearest features of each row. Both are found via the
+    spatial index of the other dataset. 
+
+    The rows are computed in blocks of blocksize features, which are spread over the given number 
+    of worker processes if workers is set, or one per cpu if True. 
+
+    Returns a dict mapping each feature id in data to a dict of other feature ids and their distances.
+    For matrices too large to hold in memory, set outpath to stream each block of rows to a csv file 
+    with the columns id, other_id and distance instead, and the outpath is returned. 
+    """
+    if other is None:
+        other = data
+    if (max_distance is not None or k) and not hasattr(other, "spindex"):
+        other.create_spatial_index()
+
+    job = _DistanceJob(data, other, geodetic, precise, max_distance, k)
+    featids = [feat.id for feat in data if feat.geometry]
+    # the rows are streamed back block by block
+    results = parallel_chunks(_distance_block, job, featids, workers, chunksize=blocksize)
+
+    if outpath:
+        import csv
+        with open(outpath, "wb") as fileobj:
+            writer = csv.writer(fileobj)
+            writer.writerow(["id", "other_id", "distance"])
+            for rows in results:
+                writer.writerows((featid,otherid,dist) for featid,pairs in rows for otherid,dist in pairs)
+        return outpath
+    
+    else:
+        matrix = dict()
+        for rows in results:
+            for featid,pairs in rows:
+                matrix[featid] = dict(pairs)
+        return matrix
+
+
+
 
 
 
@@ -318,17 +734,416 @@ def closest_point(data, otherdata):
 
 # Path Analysis
 
-def travelling_salesman(points, **options):
-    pass
+def _tsp_nearest_order(coords, start):
+    # nearest neighbour tour, searching for the nearest unvisited point in expanding rings of grid cells
+    xs,ys = zip(*coords)
+    xmin,ymin = min(xs),min(ys)
+    width,height = max(xs) - xmin, max(ys) - ymin
+    # about one point per cell, but no more cells than points in either direction, eg for points along a line
+    n = len(coords)
+    cellsize = max(math.sqrt(width * height / float(n)), max(width, height) * 2.0 / n) or 1.0
+    cols,rows = int(width // cellsize) + 1, int(height // cellsize) + 1
+    cells = dict()
+    for i,(x,y) in enumerate(coords):
+        cells.setdefault((int((x-xmin) // cellsize), int((y-ymin) // cellsize)), set()).add(i)
+
+    def ring(cx, cy, r):
+        # the cells on the edge of the square r cells out from cx,cy, within the grid
+        if r == 0:
+            yield cx,cy
+            return
+        for col in xrange(max(cx-r, 0), min(cx+r, cols-1) + 1):
+            if cy-r >= 0:
+                yield col,cy-r
+            if cy+r < rows:
+                yield col,cy+r
+        for row in xrange(max(cy-r+1, 0), min(cy+r-1, rows-1) + 1):
+            if cx-r >= 0:
+                yield cx-r,row
+            if cx+r < cols:
+                yield cx+r,row
+
+    hypot = math.hypot
+    order = []
+    cur = start
+    while True:
+        x,y = coords[cur]
+        cx,cy = int((x-xmin) // cellsize), int((y-ymin) // cellsize)
+        cells[(cx,cy)].discard(cur)
+        order.append(cur)
+        if len(order) == len(coords):
+            return order
+        best,bestdist = None,None
+        # no cells remain beyond the furthest edge of the grid
+        maxring = max(cx, cols-1-cx, cy, rows-1-cy)
+        for r in xrange(maxring + 1):
+            # any point beyond this ring is at least r cells away
+            if best is not None and bestdist <= (r - 1) * cellsize:
+                break
+            for cell in ring(cx, cy, r):
+                for j in cells.get(cell, ()):
+                    dist = hypot(coords[j][0]-x, coords[j][1]-y)
+                    if best is None or dist < bestdist:
+                        best,bestdist = j,dist
+        cur = best
+
+def _tsp_neighbours(coords, dist, k):
+    # the k nearest other points of each point, sorted by distance
+    import rtree
+    index = rtree.index.Index(((i, (x,y,x,y), None) for i,(x,y) in enumerate(coords)))
+    neighbours = []
+    for i,(x,y) in enumerate(coords):
+        near = [j for j in itertools.islice(index.nearest((x,y,x,y), k+1), k+1) if j != i][:k]
+        near.sort(key=lambda j: dist(i, j))
+        neighbours.append(near)
+    return neighbours
+
+def _tsp_improve(tour, dist, neighbours, fixed, deadline, iterations):
+    """
+    Improves a closed tour in-place with 2-opt and Or-opt moves, only considering the neighbour lists of each point.
+    Fixed is an edge (pair of points) that must be kept, or None. Stops when no more improving moves are found,
+    after the deadline time, or after the given number of improving moves. Returns the number of improving moves made. 
+    """
+    import time
+    n = len(tour)
+    pos = [0] * n
+    def update_positions():
+        for i,c in enumerate(tour):
+            pos[c] = i
+    update_positions()
+    eps = 1e-10
+    moves = [0]
+
+    def succ(c):
+        return tour[(pos[c] + 1) % n]
+    def pred(c):
+        return tour[pos[c] - 1]
+    def is_fixed(a, b):
+        return fixed is not None and (a,b) in (fixed, fixed[::-1])
+    def out_of_budget():
+        return (iterations is not None and moves[0] >= iterations) or (deadline is not None and time.time() > deadline)
+
+    def reverse(i, j):
+        # reverses the tour from position i forward to position j, or the complement if that is shorter
+        length = (j - i) % n + 1
+        if length * 2 > n:
+            i,j = (j + 1) % n, (i - 1) % n
+            length = n - length
+        for _ in xrange(length // 2):
+            ci,cj = tour[i],tour[j]
+            tour[i],tour[j] = cj,ci
+            pos[cj],pos[ci] = i,j
+            i = (i + 1) % n
+            j = (j - 1) % n
+
+    # both kinds of moves only look at the points in a queue, starting with all of them, 
+    # and then only those next to an improving move (so called don't look bits)
+
+    def two_opt(cities):
+        active = collections.deque(cities)
+        queued = set(cities)
+        touched = set()
+        while active and not out_of_budget():
+            c1 = active.popleft()
+            queued.discard(c1)
+            for forward in (True, False):
+                c2 = succ(c1) if forward else pred(c1)
+                d12 = dist(c1, c2)
+                if is_fixed(c1, c2):
+                    continue
+                for c3 in neighbours[c1]:
+                    d13 = dist(c1, c3)
+                    if d13 >= d12 and d12:
+                        # zero length edges, eg to the dummy point of an open route, try all neighbours
+                        break
+                    c4 = succ(c3) if forward else pred(c3)
+                    if c3 == c2 or c4 == c1 or is_fixed(c3, c4):
+                        continue
+                    delta = d13 + dist(c2, c4) - d12 - dist(c3, c4)
+                    if delta < -eps:
+                        # replace edges c1-c2 and c3-c4 with c1-c3 and c2-c4
+                        if forward:
+                            reverse(pos[c2], pos[c3])
+                        else:
+                            reverse(pos[c1], pos[c4])
+                        moves[0] += 1
+                        for c in (c1,c2,c3,c4):
+                            touched.add(c)
+                            if c not in queued:
+                                active.append(c)
+                                queued.add(c)
+                        break
+                else:
+                    continue
+                break
+        return touched
+
+    def or_opt(cities):
+        # moves segments of 1 to 3 points to between two neighbouring points elsewhere, possibly reversed
+        active = collections.deque(cities)
+        queued = set(cities)
+        touched = set()
+        while active and not out_of_budget():
+            city = active.popleft()
+            queued.discard(city)
+            for seglen in (1,2,3):
+                if n < seglen + 3:
+                    break
+                seg = [tour[(pos[city] + i) % n] for i in xrange(seglen)]
+                first,last = seg[0],seg[-1]
+                prev,nxt = pred(first),succ(last)
+                if is_fixed(prev, first) or is_fixed(last, nxt):
+                    continue
+                removal = dist(prev, first) + dist(last, nxt) - dist(prev, nxt)
+                best = None
+                for c in set(neighbours[first] + neighbours[last]):
+                    if c in seg:
+                        continue
+                    cn = succ(c)
+                    if cn in seg or is_fixed(c, cn):
+                        continue
+                    base = dist(c, cn)
+                    forwardcost = dist(c, first) + dist(last, cn) - base
+                    reversedcost = dist(c, last) + dist(first, cn) - base
+                    cost,rev = min((forwardcost,False), (reversedcost,True))
+                    if cost - removal < -eps and (best is None or cost < best[0]):
+                        best = (cost, c, rev)
+                if best:
+                    cost,c,rev = best
+                    rest = [other for other in tour if other not in seg]
+                    at = rest.index(c) + 1
+                    tour[:] = rest[:at] + (seg[::-1] if rev else seg) + rest[at:]
+                    update_positions()
+                    moves[0] += 1
+                    for other in seg + [prev, nxt, c, succ(c) if rev else cn]:
+                        touched.add(other)
+                        if other not in queued:
+                            active.append(other)
+                            queued.add(other)
+                    break
+        return touched
+
+    cities = set(tour)
+    while cities and not out_of_budget():
+        touched = two_opt(cities)
+        cities = touched | or_opt(cities | touched)
+    return moves[0]
+
+def travelling_salesman(points, start=None, closed=True, geodetic=False, method="nearest", neighbours=10, time_limit=None, iterations=None):
+    """
+    Finds a short route visiting all the points of a point dataset.
 
+    A first route is constructed either by visiting the nearest unvisited point each time (method="nearest"), 
+    or by following a space-filling z-order curve (method="curve"), which is faster but less optimal. The route
+    is then improved with 2-opt and Or-opt moves, considering only the nearest neighbours of each point, until 
+    no more improvements are found, until time_limit seconds have passed, or until the given number of improving
+    moves have been made. 
 
+    Start is the feature id to start from, otherwise the route starts from the first point. 
+    If closed is True the route returns to the start, otherwise it ends at whichever point gives the shortest route. 
+    Distances are planar, or haversine distances in km if geodetic is True. 
 
+    Returns a tuple of the points in visiting order, with an added "order" field, and the route as a 
+    line dataset with a single feature whose "length" field is the total route length. 
+    """
+    import time
+    deadline = time.time() + time_limit if time_limit is not None else None
+
+    # flatten to single points
+    feats = []
+    coords = []
+    for feat in points:
+        if not feat.geometry: continue
+        geoj = feat.geometry
+        if geoj["type"] == "Point":
+            parts = [geoj["coordinates"]]
+        elif geoj["type"] == "MultiPoint":
+            parts = geoj["coordinates"]
+        else:
+            raise Exception("Travelling salesman requires point data")
+        for coord in parts:
+            feats.append(feat)
+            coords.append(tuple(coord[:2]))
+    n = len(coords)
+
+    if geodetic:
+        lons = [math.radians(x) for x,y in coords]
+        lats = [math.radians(y) for x,y in coords]
+        coslats = [math.cos(lat) for lat in lats]
+        sin, asin, sqrt = math.sin, math.asin, math.sqrt
+        def pointdist(i, j):
+            h = sin((lats[j]-lats[i])/2.0)**2 + coslats[i]*coslats[j]*sin((lons[j]-lons[i])/2.0)**2
+            return 2 * 6371.009 * asin(min(1.0, sqrt(h)))
+    else:
+        hypot = math.hypot
+        def pointdist(i, j):
+            (x1,y1),(x2,y2) = coords[i],coords[j]
+            return hypot(x2-x1, y2-y1)
+        
+    # open routes are solved as closed tours through a dummy point with zero distance to all others
+    dummy = n
+    def dist(i, j):
+        if i == dummy or j == dummy:
+            return 0.0
+        return pointdist(i, j)
+
+    startidx = 0
+    if start is not None:
+        startidx = next(i for i,feat in enumerate(feats) if feat.id == start)
+
+    # construct
+    if n < 2:
+        tour = range(n)
+    elif method == "nearest":
+        tour = _tsp_nearest_order(coords, startidx)
+    elif method == "curve":
+        from ._helpers import zorder_index
+        xs,ys = zip(*coords)
+        bbox = min(xs),min(ys),max(xs),max(ys)
+        tour = sorted(xrange(n), key=lambda i: zorder_index(coords[i][0], coords[i][1], bbox))
+    else:
+        raise Exception("Unknown travelling salesman method: %s" % method)
+
+    # improve
+    if n > 3:
+        neighbourlists = _tsp_neighbours(coords, pointdist, min(neighbours, n-1))
+        moves = _tsp_improve(tour, pointdist, neighbourlists, None, deadline, iterations)
+        if iterations is not None:
+            iterations -= moves
+    if not closed and n:
+        # split the closed tour at its longest edge, or the longest edge next to the start,
+        # then keep improving it as an open route, so it is never longer than the split closed tour
+        edges = [(i, (i+1) % len(tour)) for i in xrange(len(tour))]
+        if start is not None:
+            at = tour.index(startidx)
+            edges = [edge for edge in edges if at in edge]
+        i,j = max(edges, key=lambda (i,j): pointdist(tour[i], tour[j]))
+        tour = tour[j:] + tour[:j]
+        if start is not None and tour[0] != startidx:
+            tour.reverse()
+        tour.insert(0, dummy)
+        fixed = (dummy, startidx) if start is not None else None
+        if n > 3:
+            # the dummy can connect to any point, so that moves can change the ends of the route
+            neighbourlists.append(range(n))
+            _tsp_improve(tour, dist, neighbourlists, fixed, deadline, iterations)
+
+    # rotate to the start, or drop the dummy
+    if closed:
+        at = tour.index(startidx) if n else 0
+        tour = tour[at:] + tour[:at]
+    elif n:
+        at = tour.index(dummy)
+        tour = tour[at+1:] + tour[:at]
+        if start is not None and tour[0] != startidx:
+            tour.reverse()
+    
+    # make outputs
+    ordered = VectorData()
+    ordered.fields = list(points.fields) + ["order"]
+    for i,idx in enumerate(tour):
+        ordered.add_feature(list(feats[idx].row) + [i+1], {"type":"Point", "coordinates":coords[idx]})
+
+    linecoords = [coords[idx] for idx in tour]
+    length = sum(pointdist(i, j) for i,j in zip(tour, tour[1:]))
+    if closed and n > 1:
+        linecoords.append(linecoords[0])
+        length += pointdist(tour[-1], tour[0])
+    route = VectorData()
+    route.fields = ["length"]
+    if n > 1:
+        route.add_feature([length], {"type":"LineString", "coordinates":linecoords})
+    
+    return ordered, route
+
+def _network_nodes(network, points):
+    # the nearest network node of an x,y point or point feature, or of each in a sequence or point dataset
+    if hasattr(points, "geometry") or (isinstance(points, (tuple,list)) and points and isinstance(points[0], (int,float))):
+        points = [points]
+    nodes = []
+    for point in points:
+        if hasattr(point, "geometry"):
+            if not point.geometry:
+                continue
+            point = point.geometry["coordinates"]
+        nodes.append(network.nearest_node(*point[:2]))
+    return nodes
 
+def shortest_path(network, frompoints, topoint, method="astar", **kwargs):
+    """
+    Finds the least cost route through a line network to a destination point from the nearest of 
+    one or more origin points, where points are x,y tuples or point features that are snapped to the 
+    nearest network node. Several origin points can be given as a list or as a point dataset. 
+
+    Network is either a Network created by manager.to_network(), or a line dataset, in which case
+    any other keyword args are passed to manager.to_network() and the network is cached on the dataset
+    for repeated queries. Method is either "astar" or "dijkstra". 
 
+    Returns a line dataset with the route and its total "cost", which is empty if the destination 
+    cannot be reached. 
+    """
+    if not hasattr(network, "search"):
+        from .manager import to_network
+        network = to_network(network, **kwargs)
 
+    sources = _network_nodes(network, frompoints)
+    target = _network_nodes(network, topoint)[0]
+    nodes,cost = network.shortest_path(sources, target, heuristic=method == "astar")
 
+    out = VectorData()
+    out.fields = ["cost"]
+    if nodes and len(nodes) > 1:
+        coords = [(network.xs[node],network.ys[node]) for node in nodes]
+        out.add_feature([cost], {"type":"LineString", "coordinates":coords})
+    return out
 
+def service_area(network, points, max_cost, **kwargs):
+    """
+    Finds the parts of a line network that can be reached from one or more origin points within a max cost,
+    eg an isochrone when the network cost is travel time. Points are x,y tuples or point features that are 
+    snapped to the nearest network node, and several can be given as a list or as a point dataset. 
 
+    Network is either a Network created by manager.to_network(), or a line dataset, in which case
+    any other keyword args are passed to manager.to_network() and the network is cached on the dataset
+    for repeated queries.
 
+    Returns a line dataset of each reachable network edge, cut off where the max cost is reached, with the
+    "cost" of reaching its far end and the "featid" of the line it is part of. 
+    """
+    if not hasattr(network, "search"):
+        from .manager import to_network
+        network = to_network(network, **kwargs)
 
+    sources = _network_nodes(network, points)
+    costs,previous = network.search(sources, max_cost=max_cost)
 
+    out = VectorData()
+    out.fields = ["cost", "featid"]
+    xs,ys = network.xs,network.ys
+    for node,cost in costs.iteritems():
+        for target,weight,featid in network.edges(node):
+            # how much of the edge can be reached from this end, and from the other end if undirected
+            reach = min(1.0, (max_cost - cost) / weight) if weight else 1.0
+            if not network.directed and target in costs:
+                othercost = costs[target]
+                otherreach = min(1.0, (max_cost - othercost) / weight) if weight else 1.0
+            else:
+                othercost,otherreach = None,0.0
+
+            if reach + otherreach >= 1.0:
+                # the whole edge, added only once for undirected edges
+                if othercost is not None:
+                    if target < node:
+                        continue
+                    endcost = min(max_cost, (cost + othercost + weight) / 2.0)
+                else:
+                    endcost = cost + weight
+                coords = [(xs[node],ys[node]), (xs[target],ys[target])]
+                out.add_feature([endcost, featid], {"type":"LineString", "coordinates":coords})
+            elif reach > 0:
+                # the part that can be reached from this end
+                x = xs[node] + (xs[target] - xs[node]) * reach
+                y = ys[node] + (ys[target] - ys[node]) * reach
+                coords = [(xs[node],ys[node]), (x,y)]
+                out.add_feature([max_cost, featid], {"type":"LineString", "coordinates":coords})
+    return out
@@ -1,13 +1,12 @@
 """
 Module for converting the geometry type of vector datasets, 
 e.g. converting a polygon or linestring dataset to a point dataset. 
-
-TODO:
-- Add "to_linestring", and "to_polygon" functions. 
 """
 
 import itertools, operator, math
+import array
 from .data import *
+from ._packed import PackedGeometry, pack, _POINT_RINGS
 
 import shapely, shapely.ops, shapely.geometry
 from shapely.prepared import prep as supershapely
@@ -32,11 +31,11 @@ def _to_multicentroids(data):
                 multishape = feat.get_shapely()
                 for geom in multishape.geoms:
                     shapelypoint = geom.centroid
-                    geoj = shapelypoint.__geo_interface__
+                    geoj = shapelypoint.wkb
                     outfile.add_feature(feat.row, geoj)
             else:
                 shapelypoint = feat.get_shapely().centroid
-                geoj = shapelypoint.__geo_interface__
+                geoj = shapelypoint.wkb
                 outfile.add_feature(feat.row, geoj)
         return outfile
     
@@ -56,10 +55,45 @@ def _to_centroids(data):
             outfile.add_feature(feat.row, None)
         elif feat.geometry["type"] != "Point":
             shapelypoint = feat.get_shapely().centroid
-            geoj = shapelypoint.__geo_interface__
+            geoj = shapelypoint.wkb
             outfile.add_feature(feat.row, geoj)
     return outfile
 
+def _iter_vertexes(data):
+    """yields the feature, flat coordinate array and point offset of every vertex, incl holes"""
+    for feat in data:
+        if not feat.geometry:
+            continue
+        geom = pack(feat.geometry)
+        if isinstance(geom, PackedGeometry):
+            coords = geom.coords
+            for i in xrange(0, len(coords), 2):
+                yield feat, coords, i
+        else:
+            # geometries that cannot be packed, such as collections
+            for point in _iter_points(feat.geometry):
+                yield feat, array.array("d", point[:2]), 0
+
+def _iter_points(geoj):
+    if geoj["type"] == "GeometryCollection":
+        for sub in geoj["geometries"]:
+            for point in _iter_points(sub):
+                yield point
+    elif geoj["type"] == "Point":
+        yield geoj["coordinates"]
+    elif geoj["type"] in ("MultiPoint","LineString"):
+        for point in geoj["coordinates"]:
+            yield point
+    elif geoj["type"] in ("MultiLineString","Polygon"):
+        for part in geoj["coordinates"]:
+            for point in part:
+                yield point
+    elif geoj["type"] == "MultiPolygon":
+        for poly in geoj["coordinates"]:
+            for part in poly:
+                for point in part:
+                    yield point
+
 def _to_vertexes(data):
     """create points at every vertex, incl holes"""
     
@@ -67,56 +101,50 @@ def _to_vertexes(data):
     outfile = VectorData()
     outfile.fields = list(data.fields)
     
-    # loop points
-    if "LineString" in data.type:
-        for feat in data:
-            if not feat.geometry:
-                outfile.add_feature(feat.row, None)
-            elif "Multi" in feat.geometry["type"]:
-                for linestring in feat.geometry["coordinates"]:
-                    for point in linsetring:
-                        geoj = {"type": "Point",
-                                "coordinates": point}
-                        outfile.add_feature(feat.row, geoj)
-            else:
-                for point in feat.geometry["coordinates"]:
-                    geoj = {"type": "Point",
-                            "coordinates": point}
-                    outfile.add_feature(feat.row, geoj)
-        return outfile
-                        
-    elif "Polygon" in data.type:
+    # loop points, giving each its own copy of the feature row
+    for feat,coords,i in _iter_vertexes(data):
+        point = PackedGeometry(1, coords[i:i+2], _POINT_RINGS)
+        outfile.add_feature(list(feat.row), point, copy=False)
+    return outfile
+
+def _point_array(data, pointtype):
+    """returns an array of feature ids and a flat x,y array of their points"""
+    featids = array.array("l")
+    coords = array.array("d")
+    if pointtype == "vertex":
+        for feat,featcoords,i in _iter_vertexes(data):
+            featids.append(feat.id)
+            coords.extend(featcoords[i:i+2])
+    else:
         for feat in data:
-            if not feat.geometry:
-                outfile.add_feature(feat.row, None)
-            elif "Multi" in feat.geometry["type"]:
-                for polygon in feat.geometry["coordinates"]:
-                    for ext_or_hole in polygon:
-                        for point in ext_or_hole:
-                            geoj = {"type": "Point",
-                                    "coordinates": point}
-                            outfile.add_feature(feat.row, geoj)
+            if not feat.geometry: continue
+            shp = feat.get_shapely()
+            if pointtype == "multicentroid" and "Multi" in shp.geom_type:
+                parts = shp.geoms
             else:
-                for ext_or_hole in feat.geometry["coordinates"]:
-                    for point in ext_or_hole:
-                        geoj = {"type": "Point",
-                                "coordinates": point}
-                        outfile.add_feature(feat.row, geoj)
-        return outfile
-    
-    else:
-        return data.copy()
+                parts = [shp]
+            for part in parts:
+                centroid = part.centroid
+                featids.append(feat.id)
+                coords.extend((centroid.x, centroid.y))
+    return featids, coords
 
 
 
 
 # Converting between geometry types
 
-def to_points(data, pointtype="centroid"):
+def to_points(data, pointtype="centroid", as_array=False):
     """
     Converts every feature in a non-point vector dataset to one or more point features, returning a new instance. 
     Pointtype can be centroid (default), multicentroid (one for each multipart), or vertex (a point at every vertex). 
+
+    If as_array is True, instead of creating a feature for each point, returns a lightweight tuple of an array of the 
+    feature id that each point comes from, and a flat array of the point coordinates in the form x1,y1,x2,y2,... 
     """
+    if as_array:
+        return _point_array(data, pointtype)
+    
     if pointtype == "vertex":
         return _to_vertexes(data)
     
@@ -126,4 +154,89 @@ def to_points(data, pointtype="centroid"):
     elif pointtype == "multicentroid":
         return _to_multicentroids(data)
 
+def to_linestrings(data, explode=False):
+    """
+    Converts every feature in a polygon dataset to its boundary lines, including holes, returning a new instance.
+    If explode is True, each ring or line part becomes a separate feature. Also works on linestring datasets, 
+    eg to explode them. 
+    """
+    if data.type == "Point":
+        raise Exception("Cannot convert point data to linestrings")
+    
+    # create new file
+    outfile = VectorData()
+    outfile.fields = list(data.fields)
+
+    for feat in data:
+        if not feat.geometry:
+            if not explode:
+                outfile.add_feature(feat.row, None)
+            continue
+        geom = pack(feat.geometry)
+        if isinstance(geom, PackedGeometry):
+            # the rings of packed polygons are already laid out as lines, so the arrays can be shared
+            rings = geom.rings
+            if explode:
+                for ring in geom.iter_rings():
+                    line = PackedGeometry(2, ring, array.array("l", [0, len(ring)//2]))
+                    outfile.add_feature(list(feat.row), line, copy=False)
+            elif len(rings) > 2:
+                outfile.add_feature(feat.row, PackedGeometry(5, geom.coords, rings, bbox=geom.bbox))
+            else:
+                outfile.add_feature(feat.row, PackedGeometry(2, geom.coords, rings, bbox=geom.bbox))
+        else:
+            boundary = feat.get_shapely().boundary
+            if explode and "Multi" in boundary.geom_type:
+                for line in boundary.geoms:
+                    outfile.add_feature(list(feat.row), line.wkb, copy=False)
+            else:
+                outfile.add_feature(feat.row, boundary.wkb)
+
+    return outfile
 
+def to_polygons(data, merge=False):
+    """
+    Converts every feature in a linestring dataset to polygons, returning a new instance. 
+    Features made of a single closed line become polygons directly, while other features are 
+    polygonized into the faces enclosed by their lines. 
+
+    If merge is True, the lines of all features are instead polygonized together, and each
+    resulting face becomes a feature without any attributes. 
+    """
+    if data.type != "LineString":
+        raise Exception("Can only convert linestring data to polygons")
+
+    # create new file
+    outfile = VectorData()
+    
+    if merge:
+        from ._helpers import union_geometries
+        lines = [feat.get_shapely() for feat in data if feat.geometry]
+        noded = union_geometries(lines)
+        if noded is not None:
+            for face in shapely.ops.polygonize(noded):
+                outfile.add_feature([], face.wkb)
+        return outfile
+
+    outfile.fields = list(data.fields)
+    for feat in data:
+        if not feat.geometry:
+            outfile.add_feature(feat.row, None)
+            continue
+        geom = pack(feat.geometry)
+        if isinstance(geom, PackedGeometry) and len(geom.rings) == 2:
+            coords = geom.coords
+            if len(coords) >= 8 and coords[0] == coords[-2] and coords[1] == coords[-1]:
+                # a single closed line can be used as the polygon ring as it is
+                outfile.add_feature(feat.row, PackedGeometry(3, coords, geom.rings, bbox=geom.bbox))
+                continue
+        noded = shapely.ops.unary_union(feat.get_shapely())
+        faces = list(shapely.ops.polygonize(noded))
+        if not faces:
+            outfile.add_feature(feat.row, None)
+        elif len(faces) == 1:
+            outfile.add_feature(feat.row, faces[0].wkb)
+        else:
+            outfile.add_feature(feat.row, shapely.geometry.MultiPolygon(faces).wkb)
+
+    return outfile
@@ -4,6 +4,7 @@ Module containing the data structures and interfaces for operating with vector d
 
 # import builtins
 import sys, os, itertools, operator, math
+import array
 from collections import OrderedDict
 import datetime
 
@@ -11,6 +12,7 @@ import datetime
 # ...and rename them for clarity
 import shapely
 from shapely.geometry import asShape as geojson2shapely
+from shapely.wkb import loads as wkb2shapely
 
 # import rtree for spatial indexing
 import rtree
@@ -18,6 +20,9 @@ import rtree
 # import internal modules
 from . import loader
 from . import saver
+from ._packed import PackedGeometry, pack
+from ._pointindex import PointIndex
+from ._temporal import TemporalIndex
 
 
 
@@ -46,6 +51,8 @@ class _ModuleFuncsAsClassMethods(object):
 
 
 
+NaN = float("nan")
+
 def is_missing(val):
     return val is None or (isinstance(val, float) and math.isnan(val))
 
@@ -54,7 +61,63 @@ def is_missing(val):
 
 
 
-class Feature:
+class _FieldList(list):
+    """
+    List of field names that also keeps a name-to-position lookup dict, so that index() and
+    membership tests are hash lookups instead of linear scans. Any change to the list clears
+    the lookup, which is rebuilt the next time it is needed. 
+    """
+    def __init__(self, fields=()):
+        list.__init__(self, fields)
+        self._lookup = None
+
+    def _get_lookup(self):
+        if self._lookup is None:
+            lookup = dict()
+            for i,field in enumerate(self):
+                lookup.setdefault(field, i)
+            self._lookup = lookup
+        return self._lookup
+
+    def index(self, field, *args):
+        if args:
+            return list.index(self, field, *args)
+        try:
+            return self._get_lookup()[field]
+        except KeyError:
+            raise ValueError("%r is not in list" % (field,))
+
+    def __contains__(self, field):
+        return field in self._get_lookup()
+
+    def _changed(method):
+        def wrapped(self, *args, **kwargs):
+            self._lookup = None
+            return method(self, *args, **kwargs)
+        wrapped.__name__ = method.__name__
+        return wrapped
+
+    append = _changed(list.append)
+    extend = _changed(list.extend)
+    insert = _changed(list.insert)
+    remove = _changed(list.remove)
+    pop = _changed(list.pop)
+    sort = _changed(list.sort)
+    reverse = _changed(list.reverse)
+    __setitem__ = _changed(list.__setitem__)
+    __delitem__ = _changed(list.__delitem__)
+    __setslice__ = _changed(list.__setslice__)
+    __delslice__ = _changed(list.__delslice__)
+    __iadd__ = _changed(list.__iadd__)
+    __imul__ = _changed(list.__imul__)
+    del _changed
+
+
+
+
+
+
+class Feature(object):
     """
     Class representing a vector data feature. 
     A feature object contains attributes/properties describing the feature, 
@@ -71,27 +134,34 @@ class Feature:
     
     Attributes:
         row: A list of values describing the feature properties as listed in the parent dataset's fields. 
-        geometry: A GeoJSON dictionary describing the feature geometry, or None for features without geometry. 
+        geometry: The feature geometry, or None for features without geometry. Geometries are stored as
+            PackedGeometry objects, with the coordinates packed into flat arrays, which behave like read-only
+            GeoJSON dictionaries. Setting the geometry to a GeoJSON dictionary, WKB string, or shapely geometry packs it automatically. 
+            GeometryCollections and geometries with more than two coordinate dimensions cannot be packed, 
+            and are kept as regular GeoJSON dictionaries. 
         bbox: The bounding box of the feature, as a list of [xmin,ymin,xmax,ymax]. 
-        _cached_bbox: A cached version of the feature's bounding box, to avoid having to repeat the calculation each time. 
-            All methods that change the feature's geometry should reset this cache to None in order to recalculate the bbox. 
-            In case of errors, the user may reset this themselves by setting it to None. 
-            
-            TODO:
-            - Make sure all methods that alter the geometry indeed does reset the cache. 
+        _cached_bbox: For geometries that are not packed, a cached version of the feature's bounding box, to avoid having to repeat the calculation each time. 
+            Setting the geometry property or calling transform() resets this cache and tells the parent dataset to 
+            update its bbox array. If the geometry dictionary is instead modified in place, the user must reset this
+            themselves by setting the geometry property again. 
         
         length: Returns the cartesian length of the feature geometry, expressed in units of the coordinate system. 
             See Shapely docs for more. 
         geodetic_length: Returns the geodetic length of the feature geometry, expressed as km distance as calculated by the 
-            vincenty algorithm. 
+            vincenty algorithm, or the perimeter for polygons. 
+        wkb: Returns the feature geometry as a WKB string. 
         area: Returns the cartesian area of the feature geometry, expressed in units of the coordinate system. 
             See Shapely docs for more. 
         
         id: The feature's ID in the parent vector dataset. 
         _data: The parent vector dataset to which the feature belongs. 
-    
+
+    Features are created in large numbers, so they use __slots__ instead of a per-instance __dict__, 
+    meaning no other attributes can be set on them. 
     """
-    def __init__(self, data, row=None, geometry=None, id=None):
+    __slots__ = ("_data", "row", "_geometry", "_cached_bbox", "id")
+    
+    def __init__(self, data, row=None, geometry=None, id=None, copy=True):
         """
         Creates new feature class.
         Mostly used internally by the VectorData class. 
@@ -102,15 +172,19 @@ class Feature:
             row (optional): A list or dictionary of values describing the feature properties as listed in the parent dataset's fields. 
                 Lists must be of the same sequence and length as the dataset fields. 
                 Dictionaries sets only the specified fields, the rest defaulting to None. 
-            geometry (optional): A GeoJSON dictionary describing the feature geometry, or None. 
+            geometry (optional): A GeoJSON dictionary, PackedGeometry, WKB string, or shapely geometry describing the feature geometry, or None. 
             id (optional): If given, manually sets the feature's ID in the parent vector dataset. Otherwise, automatically assigned. 
+            copy (optional): If True (default), the row list and geometry dictionary are copied so that later changes
+                to them do not affect the feature. Can be set to False when the caller hands over ownership of newly created
+                objects that are not referenced anywhere else, avoiding the cost of copying. 
         """
         self._data = data
         if row:
             if isinstance(row, list):
                 if len(row) != len(self._data.fields):
                     raise Exception("Row list must be of same length as parent dataset's field list")
-                row = list(row)
+                if copy:
+                    row = list(row)
             elif isinstance(row, dict):
                 for fn in row.keys():
                     if fn not in self._data.fields:
@@ -120,14 +194,16 @@ class Feature:
             row = [None for _ in self._data.fields]
         self.row  = row
 
-        if geometry:
-            geometry = geometry.copy()
-            bbox = geometry.get("bbox")
-            self._cached_bbox = bbox
+        # packed geometries are immutable and packing always creates new coordinate storage,
+        # so there is no need to copy (geometries that cannot be packed are returned as a copied dict)
+        geometry = pack(geometry)
+        if geometry and not isinstance(geometry, PackedGeometry):
+            self._cached_bbox = geometry.get("bbox")
         else:
             self._cached_bbox = None
 
-        self.geometry = geometry
+        # set directly, since the parent dataset handles the bbox of new features when they are added
+        self._geometry = geometry
 
         # ensure it is same geometry type as parent
         if self.geometry:
@@ -144,19 +220,38 @@ class Feature:
         self.id = id
 
     def __getitem__(self, i):
-        if isinstance(i, (str,unicode)):
-            i = self._data.fields.index(i)
+        if isinstance(i, basestring):
+            i = self._data.fields.index(i) # hash lookup, see _FieldList
         return self.row[i]
 
     def __setitem__(self, i, setvalue):
-        if isinstance(i, (str,unicode)):
-            i = self._data.fields.index(i)
+        if isinstance(i, basestring):
+            i = self._data.fields.index(i) # hash lookup, see _FieldList
         self.row[i] = setvalue
 
+    @property
+    def geometry(self):
+        return self._geometry
+
+    @geometry.setter
+    def geometry(self, geometry):
+        geometry = pack(geometry)
+        self._geometry = geometry
+        if geometry and not isinstance(geometry, PackedGeometry):
+            self._cached_bbox = geometry.get("bbox")
+        else:
+            self._cached_bbox = None
+        if self._data:
+            self._data._bboxes_changed()
+            self._data._lod_changed(self.id)
+
     @property
     def __geo_interface__(self):
+        geometry = self.geometry
+        if isinstance(geometry, PackedGeometry):
+            geometry = geometry.__geo_interface__
         return dict(type="Feature",
-                    geometry=self.geometry,
+                    geometry=geometry,
                     properties=dict(zip(self._data.fields,self.row))
                     )
 
@@ -164,28 +259,14 @@ class Feature:
     def bbox(self):
         if not self.geometry:
             raise Exception("Cannot get bbox of null geometry")
+        if isinstance(self.geometry, PackedGeometry):
+            return self.geometry.bbox
         if not self._cached_bbox:
-            geotype = self.geometry["type"]
-            coords = self.geometry["coordinates"]
-
-            if geotype == "Point":
-                x,y = coords
-                bbox = [x,y,x,y]
-            elif geotype in ("MultiPoint","LineString"):
-                xs, ys = itertools.izip(*coords)
-                bbox = [min(xs),min(ys),max(xs),max(ys)]
-            elif geotype == "MultiLineString":
-                xs = [x for line in coords for x,y in line]
-                ys = [y for line in coords for x,y in line]
-                bbox = [min(xs),min(ys),max(xs),max(ys)]
-            elif geotype == "Polygon":
-                exterior = coords[0]
-                xs, ys = itertools.izip(*exterior)
-                bbox = [min(xs),min(ys),max(xs),max(ys)]
-            elif geotype == "MultiPolygon":
-                xs = [x for poly in coords for x,y in poly[0]]
-                ys = [y for poly in coords for x,y in poly[0]]
-                bbox = [min(xs),min(ys),max(xs),max(ys)]
+            # only collections, empty and 3D geometries are not packed
+            geoj = self.geometry
+            if not (geoj.get("coordinates") or geoj.get("geometries")):
+                raise Exception("Cannot get bbox of empty geometry")
+            bbox = list(self.get_shapely().bounds)
             self._cached_bbox = bbox
         return self._cached_bbox
 
@@ -198,13 +279,23 @@ class Feature:
         """
         if not self.geometry:
             raise Exception("Cannot get shapely object of null geometry")
+        if isinstance(self.geometry, PackedGeometry):
+            # much faster than going via the geojson dictionary
+            return wkb2shapely(self.geometry.wkb)
         return geojson2shapely(self.geometry)                
 
+    @property
+    def wkb(self):
+        """The feature geometry as a WKB (Well-Known Binary) string, or None for null geometries."""
+        if not self.geometry:
+            return None
+        if isinstance(self.geometry, PackedGeometry):
+            return self.geometry.wkb
+        return self.get_shapely().wkb
+
     def copy(self):
         """Copies the feature and returns a new instance."""
-        geoj = self.geometry
-        if self.geometry and self._cached_bbox: geoj["bbox"] = self._cached_bbox
-        return Feature(self._data, self.row, geoj)
+        return Feature(self._data, self.row, self.geometry)
 
     def iter_points(self):
         """Yields every point in the geometry as a flat generator,
@@ -214,6 +305,12 @@ class Feature:
         geoj = self.geometry
         if not geoj:
             yield None
+            return
+
+        if isinstance(geoj, PackedGeometry):
+            for p in geoj.iter_points():
+                yield p
+            return
 
         geotype = self.geometry["type"]
         coords = self.geometry["coordinates"]
@@ -249,6 +346,11 @@ class Feature:
         if not geoj:
             return None
 
+        if isinstance(geoj, PackedGeometry):
+            # packed geometries are immutable, so pack a new one
+            self.geometry = geoj.map_rings(func)
+            return True
+
         geotype = geoj["type"]
         coords = geoj["coordinates"]
         
@@ -267,7 +369,11 @@ class Feature:
                                     for ext_or_hole in poly]
                                    for poly in coords]
             
+        geoj.pop("bbox", None)
         self._cached_bbox = None
+        if self._data:
+            self._data._bboxes_changed()
+            self._data._lod_changed(self.id)
         
         return True
 
@@ -358,7 +464,7 @@ NAMEGEN = Name_generator()
 
 
 
-class VectorData:
+class VectorData(object):
     """
     Class representing a vector dataset. 
     
@@ -381,7 +487,11 @@ class VectorData:
         fields: 
         features: 
         crs: 
-        bbox: 
+        bbox: The bounding box of all features with geometries, as a tuple of (xmin,ymin,xmax,ymax). 
+            Cached, and only recalculated after feature geometries have been changed. 
+        bboxes: Array of feature bounding boxes, with four values xmin,ymin,xmax,ymax for each feature in the same
+            order as the features, and NaN values for features without geometry. Computed when the data is loaded and
+            kept up to date as features are added or changed. 
         
         manage: Access all methods from the manager module, passing self as first arg.
         analyze: Access all methods from the analyzer module, passing self as first arg.
@@ -456,23 +566,42 @@ class VectorData:
         self.fields = fields
 
         self._id_generator = ID_generator()
+        self._lod = []
+        self._view_of = None # the dataset whose features are shared, for views
+
+        # rows and geometries freshly loaded from file are not referenced elsewhere, so no need to copy them
+        copy = not filepath
         
         ids_rows_geoms = itertools.izip(self._id_generator,rows,geometries)
-        featureobjs = (Feature(self,row,geom,id=id) for id,row,geom in ids_rows_geoms )
+        featureobjs = (Feature(self,row,geom,id=id,copy=copy) for id,row,geom in ids_rows_geoms )
         self.features = OrderedDict([ (feat.id,feat) for feat in featureobjs ])
         self.crs = crs
 
+        # compute all feature bboxes once at load time (shapefiles already store them)
+        self._update_bboxes()
+
     def __repr__(self):
         attrs = dict(filepath=self.filepath,
                      type=self.type,
                      length=len(self),
                      )
-        if any((f.geometry for f in self)):
+        if self.has_geometry():
             attrs["bbox"] = self.bbox
         else:
             attrs["bbox"] = None
         return "<Vector data: type={type} length={length} bbox={bbox} filepath='{filepath}'>".format(**attrs)
 
+    @property
+    def fields(self):
+        return self._fields
+
+    @fields.setter
+    def fields(self, fields):
+        if getattr(self, "_view_of", None) is not None:
+            self._check_schema_change()
+        # always store as a _FieldList so that field names can be looked up quickly
+        self._fields = _FieldList(fields)
+
     def __len__(self):
         """
         How many features in data.
@@ -501,8 +630,15 @@ class VectorData:
         """
         if isinstance(i, slice):
             raise Exception("Can only set one feature at a time")
+        elif i in self.features:
+            # replacing an existing feature
+            self.features[i] = feature
+            self._bboxes_changed()
+            self._lod_changed(i)
         else:
+            # adding a new feature to the end
             self.features[i] = feature
+            self._append_bbox(feature)
 
     def __geo_interface__(self):
         """
@@ -512,36 +648,109 @@ class VectorData:
 
     def has_geometry(self):
         """Returns True if at least one feature has non-null geometry."""
-        return any((feat.geometry for feat in self))
+        if self._bboxes is None:
+            self._update_bboxes()
+        return self._bbox is not None
 
     @property
     def bbox(self):
         if self.has_geometry():
-            xmins, ymins, xmaxs, ymaxs = itertools.izip(*(feat.bbox for feat in self if feat.geometry))
-            bbox = min(xmins),min(ymins),max(xmaxs),max(ymaxs)
-            return bbox
+            return self._bbox
         else:
             raise Exception("Cannot get bbox since there are no features with geometries")
 
+    @property
+    def bboxes(self):
+        if self._bboxes is None:
+            self._update_bboxes()
+        return self._bboxes
+
+    def _update_bboxes(self):
+        """Computes the bbox array of all features, and the overall bbox of the dataset."""
+        self._bboxes = array.array("d")
+        self._bbox = None
+        for feat in self:
+            self._append_bbox(feat)
+
+    def _append_bbox(self, feat):
+        """Adds the bbox of a new feature to the end of the bbox array, and grows the dataset bbox if needed."""
+        if self._bboxes is None:
+            # will be recomputed for all features when next needed
+            return
+        geom = feat.geometry
+        if geom and (isinstance(geom, PackedGeometry) or geom.get("coordinates") or geom.get("geometries")):
+            fxmin,fymin,fxmax,fymax = feat.bbox
+            self._bboxes.extend((fxmin,fymin,fxmax,fymax))
+            if self._bbox:
+                xmin,ymin,xmax,ymax = self._bbox
+                self._bbox = min(xmin,fxmin),min(ymin,fymin),max(xmax,fxmax),max(ymax,fymax)
+            else:
+                self._bbox = fxmin,fymin,fxmax,fymax
+        else:
+            self._bboxes.extend((NaN,NaN,NaN,NaN))
+
+    def _bboxes_changed(self):
+        """Called when feature geometries are changed or reordered, so that the bbox array is recomputed when next needed."""
+        self._bboxes = None
+        self._bbox = None
+
     ### DATA ###
 
     def sort(self, key, reverse=False):
         """Sorts the feature order in-place using a key function and optional reverse flag."""
         self.features = OrderedDict([ (feat.id,feat) for feat in sorted(self.features.values(), key=key, reverse=reverse) ])
+        self._bboxes_changed()
         return self
 
-    def add_feature(self, row=None, geometry=None):
+    def sort_spatial(self, method="hilbert"):
+        """Sorts the feature order in-place along a space-filling curve through the centers of their bboxes,
+        so that spatially nearby features are also next to each other in the feature order.
+        Method is either "hilbert" (default) or "zorder". Features without geometry are placed first. 
+        """
+        if not self.has_geometry():
+            return self
+        from ._helpers import spatial_keys
+        bboxes = self.bboxes
+        keys = spatial_keys(bboxes, self.bbox, method)
+        order = sorted(xrange(len(keys)), key=keys.__getitem__)
+        feats = self.features.values()
+        self.features = OrderedDict([ (feats[i].id,feats[i]) for i in order ])
+        # reorder the bbox array rather than recomputing it
+        self._bboxes = array.array("d", itertools.chain.from_iterable(bboxes[i*4:i*4+4] for i in order))
+        return self
+
+    def partition(self, n, method="hilbert"):
+        """Splits the features into n balanced and spatially compact partitions, eg to give to parallel workers,
+        by cutting the order along a space-filling curve into equal parts. Method is either "hilbert" (default) 
+        or "zorder". Returns a list of n lists of feature ids. 
+        """
+        ids = [feat.id for feat in self]
+        if not self.has_geometry():
+            keys = [None] * len(ids)
+        else:
+            from ._helpers import spatial_keys
+            keys = spatial_keys(self.bboxes, self.bbox, method)
+        from ._helpers import spatial_partitions
+        return spatial_partitions(ids, keys, n)
+
+    def add_feature(self, row=None, geometry=None, copy=True):
         """Adds and returns a new feature, given a row list or dict, and a geometry GeoJSON dictionary.
+        The geometry can also be given as a WKB string or shapely geometry, which avoids creating
+        intermediate GeoJSON coordinate lists, eg when adding the results of shapely operations. 
         If neither are set, populates row with None values, and empty geometry.
+        If copy is False, the row and geometry are not copied but owned directly by the new feature,
+        which is faster but only safe if they are not used anywhere else. 
         """
-        feature = Feature(self, row, geometry)
-        self[feature.id] = feature
+        feature = Feature(self, row, geometry, copy=copy)
+        self.features[feature.id] = feature
+        self._append_bbox(feature)
         return feature
 
     def add_field(self, field, index=None):
         """Adds a new field by the name of 'field', optionally at the specified index position.
         All existing feature rows are updated accordingly.
         """
+        self._check_schema_change()
         if index is None:
             self.fields.append(field)
             for feat in self:
@@ -648,6 +857,7 @@ class VectorData:
 
     def drop_field(self, field):
         """Drops the specified field, changing the dataset in-place."""
+        self._check_schema_change()
         fieldindex = self.fields.index(field)
         del self.fields[fieldindex]
         for feat in self:
@@ -669,6 +879,7 @@ class VectorData:
 
     def rename_field(self, oldname, newname):
         """Changes the name of a field from oldname to newname."""
+        self._check_schema_change()
         self.fields[self.fields.index(oldname)] = newname
 
     def convert_field(self, field, valfunc):
@@ -714,7 +925,7 @@ class VectorData:
         outstring += "filepath: %s \n" % self.filepath
         outstring += "type: %s \n" % self.type
         outstring += "length: %s \n" % len(self) 
-        outstring += "bbox: %s \n" % repr(self.bbox) if self.has_geometry else None       
+        outstring += "bbox: %s \n" % (repr(self.bbox) if self.has_geometry() else None)
         outstring += "fields:" + "\n"
         
         row_format = "{:>15}" * (len(printfields))
@@ -781,26 +992,37 @@ class VectorData:
 
     def field_type(self, field):
         """Determines and returns field type of field based on its values (ignoring missing values).
-        For now, only detects int, float, and text.
-        
-        TODO: also detect other types eg datetime, etc.
+        Detects bool, date, datetime, int, float, and text. Empty text is treated as missing.
         """
         values = (f[field] for f in self)
-        values = (v for v in values if not is_missing(v))
-        # approach: at first assume int, if fails then assume float,
+        values = (v for v in values if not is_missing(v) and v != "")
+        # approach: booleans and dates are only detected if all values are of that type,
+        # otherwise at first assume int, if fails then assume float,
         # ...if fails then assume text and stop checking (lowest possible dtype)
-        typ = "int"
+        typ = None
         for v in values:
-            try:
-                v = float(v)
-                if v.is_integer():
-                    pass
-                else:
-                    typ = "float"
-            except:
+            if isinstance(v, bool):
+                valtyp = "bool"
+            elif isinstance(v, datetime.datetime):
+                valtyp = "datetime"
+            elif isinstance(v, datetime.date):
+                valtyp = "date"
+            else:
+                try:
+                    valtyp = "int" if float(v).is_integer() else "float"
+                except:
+                    typ = "text"
+                    break
+            if typ is None or typ == valtyp:
+                typ = valtyp
+            elif set([typ,valtyp]) == set(["date","datetime"]):
+                typ = "datetime"
+            elif set([typ,valtyp]) <= set(["int","float","bool"]):
+                typ = "int" if "float" not in (typ,valtyp) else "float"
+            else:
                 typ = "text"
                 break
-        return typ
+        return typ or "int"
 
     def tab(self, field):
         """Prints a frequency count of the unique values for a single field.
@@ -882,9 +1104,10 @@ class VectorData:
                 yield feat
 
     def group(self, key):
-        """Iterates over keyvalue-group pairs based on key"""
-        for uid,feats in itertools.groupby(sorted(self, key=key), key=key):
-            yield uid, list(feats)
+        """Iterates over keyvalue-group pairs based on key, in sorted key order"""
+        from ._helpers import group_by_key
+        for uid,feats in group_by_key(self, key):
+            yield uid, feats
 
     ### OTHER ###
 
@@ -901,7 +1124,7 @@ class VectorData:
 
         return new
 
-    def aggregate(self, key, geomfunc=None, fieldmapping=[]):
+    def aggregate(self, key, geomfunc=None, fieldmapping=[], touching=False, workers=None):
         """Aggregate values and geometries within key groupings.
         
         Arguments:
@@ -909,6 +1132,8 @@ class VectorData:
             geomfunc (optional): Specifies how to aggregate geometries, either intersection, union, difference,
                 or a function that takes all geometries to aggregate. If not set (default), does not aggregate geometries,
                 returning a non-spatial table with only null-geometries. 
+                Union (alias dissolve) sorts each group's geometries spatially and unions them by a tree reduction, 
+                which is much faster for large groups. 
             fieldmapping: Specifies a set of aggregation rules used to calculate the new value for each group. 
                 Specified as a list of (outfield,valuefield,stat) tuples, where outfield is the field name 
                 of a new or existing field to write, valuefield is the field name or function that retrieves the value
@@ -916,6 +1141,10 @@ class VectorData:
                 the list of values from the group as defined by valuefield. 
                 Valid stat values include: 
                 - fdsf...
+            touching (optional): Only for union, if True only dissolves geometries within each group that touch or 
+                overlap, so each group may result in more than one output feature. 
+            workers (optional): Only for union, the number of worker processes used to dissolve groups in parallel, 
+                or True to use one per cpu. Default is to not use parallel processing. 
         """
         # TODO: Move to manager...?
         out = VectorData()
@@ -932,6 +1161,13 @@ class VectorData:
             geomfunc = lambda fs: None
 
         from . import sql
+
+        if geomfunc in ("union","dissolve"):
+            groups = [list(feats) for feats in sql.groupby(self, key=key)]
+            for geom,feats in sql.dissolve(groups, touching=touching, workers=workers):
+                row = sql.aggreg(feats, aggregfuncs=fieldmapping)
+                out.add_feature(row=row, geometry=geom)
+            return out
         
         for feats in sql.groupby(self, key=key):
             row,geom = sql.aggreg(feats, aggregfuncs=fieldmapping, geomfunc=geomfunc)
@@ -939,30 +1175,57 @@ class VectorData:
 
         return out
 
-    def duplicates(self, subkey=None, fieldmapping=[]):
+    def duplicates(self, subkey=None, fieldmapping=[], precision=None, confirm=False):
         """Removes duplicate geometries by grouping and aggregating their values.
+
+        Duplicates are found in a single pass by looking up a canonical binary encoding of each geometry
+        in a hash table, so the time taken grows linearly with the number of features. 
         
         Arguments: 
             subkey (optional): If specified, for each set of duplicate geometries will perform separate aggregations 
                 for each subgroup defined by subkey. Geometry duplicates will continue to exist if they have more than 
                 one subkey grouping. 
             fieldmapping: Defines the value aggregations. See aggregate(). 
+            precision (optional): Number of decimals to round coordinates to before comparing them, so that geometries 
+                differing only by floating point noise are considered duplicates. Default is to compare exact coordinates. 
+            confirm (optional): By default, geometries are grouped by a short digest of their encoding, which uses little memory
+                but has a vanishingly small chance of mistaking two different geometries as the same. If True, groups 
+                by the full encoding instead, confirming that the (optionally rounded) coordinates are exactly equal. 
         """
         # TODO: Move to manager...?
+        from ._helpers import geometry_encoding, geometry_hash
+        from . import sql
+
         if subkey:
             # additional subgrouping based on eg attributes
             if isinstance(subkey, list):
                 keyfields = subkey
-                subkey = lambda f: [f[field] for field in keyfields]
+                subkey = lambda f: tuple([f[field] for field in keyfields])
                 # add keyfields to fieldmapping
                 fieldmapping = [(field,field,"first") for field in keyfields] + fieldmapping
-            keywrap = lambda f: (f.geometry, subkey(f))
-        else:
-            # only by geometry
-            keywrap = lambda f: f.geometry
-            
-        geomfunc = lambda items: items[0].geometry # since geometries are same within each group, pick first one
-        out = self.aggregate(keywrap, geomfunc=geomfunc, fieldmapping=fieldmapping)
+
+        geomkey = geometry_encoding if confirm else geometry_hash
+
+        # group in hash table, keeping the order in which each geometry was first seen
+        groups = OrderedDict()
+        for feat in self:
+            key = geomkey(feat.geometry, precision) if feat.geometry else None
+            if subkey:
+                subval = subkey(feat)
+                if isinstance(subval, list):
+                    subval = tuple(subval)
+                key = (key, subval)
+            if key in groups:
+                groups[key].append(feat)
+            else:
+                groups[key] = [feat]
+
+        out = VectorData()
+        out.fields = [fieldname for fieldname,_,_ in fieldmapping]
+
+        for feats in groups.itervalues():
+            row = sql.aggreg(feats, aggregfuncs=fieldmapping)
+            out.add_feature(row=row, geometry=feats[0].geometry) # since geometries are same within each group, pick first one
         
         return out
 
@@ -995,6 +1258,7 @@ class VectorData:
         otheridx = [i for i,field in enumerate(other.fields) if field not in self.fields]
 
         from . import sql
+        from ._helpers import group_by_key
 
         if isinstance(key, (list,tuple)):
             keyfunc = lambda f: tuple([f[k] for k in key])
@@ -1025,7 +1289,7 @@ class VectorData:
                 # create hash table
                 # inspired by http://rosettacode.org/wiki/Hash_join#Python
                 hsh = dict()
-                for keyval,f2s in itertools.groupby(sorted(data2,key=key2), key=key2):
+                for keyval,f2s in group_by_key(data2, key2):
                     aggval = sql.aggreg(f2s, aggregfuncs=fieldmapping)
                     hsh[keyval] = aggval
                 # iterate join
@@ -1044,8 +1308,8 @@ class VectorData:
                 # create hash table
                 # inspired by http://rosettacode.org/wiki/Hash_join#Python
                 hsh = dict()
-                for keyval,f2s in itertools.groupby(sorted(data2,key=key2), key=key2):
-                    hsh[keyval] = list(f2s)
+                for keyval,f2s in group_by_key(data2, key2):
+                    hsh[keyval] = f2s
                 # iterate join
                 for f1 in data1:
                     keyval = key1(f1)
@@ -1138,14 +1402,43 @@ class VectorData:
 
     ###### SPATIAL INDEXING #######
 
-    def create_spatial_index(self):
+    def create_spatial_index(self, method="auto"):
         """Creates spatial index to allow quick overlap search methods.
         If features are changed, added, or dropped, the index must be created again.
+
+        Method can be "rtree", or "points" for a grid index that is much faster to build and query for points.
+        By default ("auto"), the grid index is used for point data where each feature is a single point, 
+        and the rtree index otherwise. Both can be queried the same way. 
         """
-        self.spindex = rtree.index.Index()
-        for feat in self:
-            if feat.geometry:
-                self.spindex.insert(feat.id, feat.bbox)
+        bboxes = self.bboxes
+        if method == "auto":
+            points = self.type == "Point" and self.has_geometry()
+            if points:
+                # all non-null bboxes have no extent, ie all features are single points
+                points = all(xmin == xmax and ymin == ymax or xmin != xmin
+                             for xmin,ymin,xmax,ymax in itertools.izip(bboxes[0::4], bboxes[1::4], bboxes[2::4], bboxes[3::4]))
+            method = "points" if points else "rtree"
+            
+        if method == "points":
+            ids,xs,ys = array.array("l"),array.array("d"),array.array("d")
+            for i,feat in enumerate(self):
+                x = bboxes[i*4]
+                if x == x: # skip NaN for null geometries
+                    ids.append(feat.id)
+                    xs.append(x)
+                    ys.append(bboxes[i*4+1])
+            self.spindex = PointIndex(ids, xs, ys)
+        elif method == "rtree":
+            # bulk load from the precomputed bbox array, which is much faster than inserting one by one
+            items = ((feat.id, bboxes[i*4:i*4+4], None)
+                     for i,feat in enumerate(self)
+                     if feat.geometry)
+            if self.has_geometry():
+                self.spindex = rtree.index.Index(items)
+            else:
+                self.spindex = rtree.index.Index()
+        else:
+            raise Exception("Spatial index method must be 'auto', 'rtree' or 'points', not %s" % method)
    
     def quick_overlap(self, bbox):
         """
@@ -1183,9 +1476,6 @@ class VectorData:
 
         TODO: radius option not yet implemented. 
         """
-        # TODO: special handling if points data, might be faster to just test all.
-        # ...
-        
         if not hasattr(self, "spindex"):
             raise Exception("You need to create the spatial index before you can use this method")
 
@@ -1231,12 +1521,135 @@ class VectorData:
 ##                        fdsf
 ##            for key,subfeats in sorted(sortfeats):
 ##                yield self[id]
-        
+
+    ###### TEMPORAL INDEXING #######
+
+    def create_temporal_index(self, start, end=None):
+        """Creates temporal index to allow quick time search methods.
+        If features are changed, added, or dropped, the index must be created again.
+
+        Start is the field name of the time of each feature, or a function that takes a feature and returns its time.
+        For features that last over a period, end is the field name or function for the end time of each feature,
+        where features without an end time last forever. Times can be dates, datetimes, numbers such as years,
+        or text in common ISO formats such as "2001-12-31". Features without a start time are not indexed.
+        """
+        self.timeindex = TemporalIndex(self, start, end)
+
+    def at_time(self, t):
+        """
+        Quickly get the features that exist at time t via the temporal index, as a new VectorData view.
+        The view shares its features and fields with this dataset, so its fields cannot be changed. 
+        """
+        if not hasattr(self, "timeindex"):
+            raise Exception("You need to create the temporal index before you can use this method")
+        return self._view(self.timeindex.at_time(t))
+
+    def between(self, t1, t2):
+        """
+        Quickly get the features that exist at some point from time t1 to t2, inclusive, via the temporal index,
+        as a new VectorData view. The view shares its features and fields with this dataset, so its fields cannot be changed. 
+        """
+        if not hasattr(self, "timeindex"):
+            raise Exception("You need to create the temporal index before you can use this method")
+        return self._view(self.timeindex.between(t1, t2))
+
+    def _view(self, featids):
+        """
+        Returns a new VectorData containing the given features, in the given order. The features are not copied
+        but shared with this dataset, along with the fields, so changes to their values and geometries will show up in both.
+        Since the shared feature rows must match the fields of this dataset, views refuse to add, drop, or rename fields.
+        Use copy() to get an independent dataset that allows this.
+        """
+        new = VectorData(name=self.name, type=self.type, crs=self.crs)
+        new._fields = self._fields
+        new._view_of = self
+        new._id_generator = self._id_generator # so that added features don't reuse ids
+        new.features = OrderedDict([ (featid,self.features[featid]) for featid in featids ])
+        new._bboxes_changed()
+        return new
+
+    ###### LEVEL OF DETAIL #######
+
+    def build_lod(self, tolerances=None, levels=3, shared_boundaries=True):
+        """Precomputes simplified versions of all line and polygon geometries at several tolerances, 
+        so that rendering and analyses at coarse scales can use far fewer vertices. See get_lod(). 
+
+        Each level is simplified from the previous finer level, which is much faster than simplifying 
+        the full resolution geometries each time, at the cost of deviating up to about a third more than 
+        its tolerance. Simplification preserves topology, and if shared_boundaries is True (default), 
+        boundaries shared between polygons are simplified the same way so no gaps open between them. 
+        The levels are kept until geometries are changed, and are not saved to file. 
+
+        Args:
+            tolerances (optional): List of simplification tolerances, in the units of the coordinate system. 
+                By default, the coarsest level uses 1/512th of the width or height of the dataset, 
+                and each finer level a quarter of the previous one. 
+            levels (optional): The number of levels when tolerances is not set, default 3. 
+        """
+        self._lod = []
+        if not self.has_geometry() or self.type == "Point":
+            return self
+        if tolerances is None:
+            xmin,ymin,xmax,ymax = self.bbox
+            span = max(xmax - xmin, ymax - ymin)
+            tolerances = [span / (512.0 * 4**i) for i in xrange(levels)]
+        feats = [feat for feat in self if feat.geometry]
+        shapes = [feat.get_shapely() for feat in feats]
+        shared = shared_boundaries and self.type == "Polygon"
+        if shared:
+            # the shared arcs only need to be found once, and are then simplified level by level
+            from .manager import _shared_arcs, _simplify_arcs, _assign_faces
+            arcs = _shared_arcs(shapes)
+        lod = []
+        for tolerance in sorted(tolerances):
+            if shared:
+                arcs = _simplify_arcs(arcs, tolerance)
+                levelshapes = _assign_faces(shapes, arcs, tolerance)
+            else:
+                levelshapes = shapes = [shp.simplify(tolerance, preserve_topology=True) if shp is not None else None
+                                        for shp in shapes]
+            levelshapes = [None if shp is None or shp.is_empty else shp for shp in levelshapes]
+            level = dict((feat.id, pack(shp)) for feat,shp in itertools.izip(feats, levelshapes) if shp is not None)
+            lod.append((tolerance, level))
+        self._lod = lod
+        return self
+
+    def get_lod(self, tolerance):
+        """Returns a dict of the simplified geometries of each feature id, from the coarsest level of detail whose 
+        tolerance does not exceed the given tolerance, eg the size of a pixel when rendering. Features that are
+        missing from the dict should use their full resolution geometry. Returns None if there is no such level, 
+        or if build_lod() has not been called. 
+        """
+        found = None
+        for leveltolerance,level in self._lod:
+            if leveltolerance <= tolerance:
+                found = level
+        return found
+
+    def _check_schema_change(self):
+        """Raises an error if the fields cannot be changed, because this dataset is a view of another dataset."""
+        if self._view_of is not None:
+            raise Exception("Cannot add, drop, or rename the fields of a view, since its features are shared with the dataset it was created from. Change the fields of that dataset, or make a copy() of the view instead.")
+
+    def _lod_changed(self, featid):
+        """Called when a feature geometry is changed or replaced, so that its outdated simplified geometries are no longer used."""
+        for tolerance,level in self._lod:
+            level.pop(featid, None)
+
     ###### GENERAL #######
 
-    def save(self, savepath, **kwargs):
+    def save(self, savepath, spatial_order=None, **kwargs):
+        """Saves the data to file. If spatial_order is "hilbert" or "zorder", the features are written in that
+        spatial order instead of the current feature order, which is left unchanged."""
         fields = self.fields
-        rowgeoms = ((feat.row,feat.geometry) for feat in self)
+        feats = self
+        if spatial_order and self.has_geometry():
+            from ._helpers import spatial_keys
+            keys = spatial_keys(self.bboxes, self.bbox, spatial_order)
+            order = sorted(xrange(len(keys)), key=keys.__getitem__)
+            values = self.features.values()
+            feats = (values[i] for i in order)
+        rowgeoms = ((feat.row,feat.geometry) for feat in feats)
         rows, geometries = itertools.izip(*rowgeoms)
         saver.to_file(fields, rows, geometries, savepath, **kwargs)
 
@@ -1245,6 +1658,8 @@ class VectorData:
         new.fields = [field for field in self.fields]
         featureobjs = (Feature(new, feat.row, feat.geometry) for feat in self )
         new.features = OrderedDict([ (feat.id,feat) for feat in featureobjs ])
+        new._bboxes = array.array("d", self.bboxes)
+        new._bbox = self._bbox
         #if hasattr(self, "spindex"): new.spindex = self.spindex.copy() # NO SUCH METHOD
         return new
     
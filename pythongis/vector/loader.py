@@ -9,6 +9,7 @@ import csv
 import codecs
 import itertools
 import warnings
+import datetime
 
 # import fileformat modules
 import shapefile as pyshp
@@ -34,7 +35,68 @@ def detect_filetype(filepath):
 
 
 
-def from_file(filepath, encoding="utf8", encoding_errors="strict", **kwargs):
+def _parse_time(string):
+    """
+    Returns the date or datetime of iso text such as 2001-12-31 or 2001-12-31T23:59:59, 
+    or the text itself if it is not a date. 
+    """
+    if len(string) < 10 or string[4:5] != "-" or string[7:8] != "-":
+        return string
+    try:
+        if len(string) == 10:
+            return datetime.datetime.strptime(string, "%Y-%m-%d").date()
+        fmt = "%Y-%m-%d" + string[10] + "%H:%M:%S"
+        if "." in string:
+            fmt += ".%f"
+        return datetime.datetime.strptime(string, fmt)
+    except ValueError:
+        return string
+
+def _typed_rows(rowgeoms, maxcategories=65536):
+    """
+    Converts iso date text to date and datetime values, and dictionary encodes text and date values
+    so that all equal values in a field share a single object, instead of a new copy for every row. 
+    This greatly reduces memory for categorical fields, and makes hashing their values for grouping 
+    and joining cheaper, since each object only computes its hash once. Fields with more than 
+    maxcategories unique values are considered non-categorical and are no longer encoded. 
+    """
+    categories = dict()
+    for row,geom in rowgeoms:
+        if not isinstance(row, list):
+            row = list(row)
+        for i,value in enumerate(row):
+            if not isinstance(value, (basestring, datetime.date)):
+                continue
+            cats = categories.setdefault(i, dict())
+            if cats is not None and value in cats:
+                row[i] = cats[value]
+                continue
+            shared = _parse_time(value) if isinstance(value, basestring) else value
+            if cats is not None:
+                if len(cats) < maxcategories:
+                    cats[value] = shared
+                else:
+                    categories[i] = None
+            row[i] = shared
+        yield row,geom
+
+def from_file(filepath, **kwargs):
+    fields, rowgeoms, crs = iter_file(filepath, **kwargs)
+
+    # load to memory in lists
+    rows,geometries = itertools.izip(*rowgeoms)
+    rows = list(rows)
+    geometries = list(geometries)
+
+    return fields, rows, geometries, crs
+
+def iter_file(filepath, encoding="utf8", encoding_errors="strict", **kwargs):
+    """
+    Same as from_file(), except the rows and geometries are not loaded to memory, 
+    returning the fields, an iterator of row-geometry pairs, and the crs. 
+    Rows are only read from the file as the iterator is consumed, except for GeoJSON files 
+    which are always parsed as a whole. 
+    """
 
     # TODO: for geoj and delimited should detect and force consistent field types in similar manner as when saving
 
@@ -104,8 +166,11 @@ def from_file(filepath, encoding="utf8", encoding_errors="strict", **kwargs):
                         val = int(val)
                     return val
                 except:
-                    if string.upper() == "NULL":
+                    upper = string.upper()
+                    if upper == "NULL":
                         return None
+                    elif upper in ("TRUE","FALSE"):
+                        return upper == "TRUE"
                     else:
                         return string.decode(encoding, errors=encoding_errors)
             rows = ([parsestring(cell) for cell in row] for row in rows)
@@ -193,16 +258,14 @@ def from_file(filepath, encoding="utf8", encoding_errors="strict", **kwargs):
     else:
         raise Exception("Could not create vector data from the given filepath: the filetype extension is either missing or not supported")
 
+    # detect dates and share repeated values
+    rowgeoms = _typed_rows(rowgeoms)
+
     # filter if needed
     if select:
         rowgeoms = ( (row,geom) for row,geom in rowgeoms if select(dict(zip(fields,row))) )
 
-    # load to memory in lists
-    rows,geometries = itertools.izip(*rowgeoms)
-    rows = list(rows)
-    geometries = list(geometries)
-
-    return fields, rows, geometries, crs
+    return fields, rowgeoms, crs
 
 
 
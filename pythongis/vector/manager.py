@@ -1,13 +1,19 @@
 
 import itertools, operator, math
+import os
 import warnings
+import array
 from .data import *
 
 import shapely, shapely.ops, shapely.geometry
 from shapely.geometry import asShape as geojson2shapely
+from shapely.wkb import loads as wkb2shapely
 from shapely.prepared import prep as supershapely
+import rtree
 
-from ._helpers import geodetic_buffer
+from ._helpers import geodetic_buffer, union_geometries, parallel_chunks, distance_bbox, SpillFile, SpillGroup, packed_parts
+from ._packed import PackedGeometry, pack
+from ._pointinpolygon import locate_points
 
 
 
@@ -33,7 +39,7 @@ def crop(data, bbox):
     for feat,geom in iterable:
         intsec = geom.intersection(bboxgeom)
         if not intsec.is_empty:
-            out.add_feature(feat.row, intsec.__geo_interface__)
+            out.add_feature(feat.row, intsec.wkb)
 
     return out
 
@@ -202,61 +208,18 @@ def spatial_join(data, other, condition, subkey=None, keepall=False, clip=False,
         clipname = clip
         
         # determine correct output type for each operation
-        if clipname == 'intersection':
-            # lowest dimension
-            if 'Point' in (data.type,other.type):
-                newtyp = 'Point'
-                newmultiobj = shapely.geometry.MultiPoint
-            elif 'LineString' in (data.type,other.type):
-                newtyp = 'LineString'
-                newmultiobj = shapely.geometry.MultiLineString
-            elif 'Polygon' in (data.type,other.type):
-                newtyp = 'Polygon'
-                newmultiobj = shapely.geometry.MultiPolygon
-        elif clipname == 'union':
-            # highest dimension
-            if 'Polygon' in (data.type,other.type):
-                newtyp = 'Polygon'
-                newmultiobj = shapely.geometry.MultiPolygon
-            elif 'LineString' in (data.type,other.type):
-                newtyp = 'LineString'
-                newmultiobj = shapely.geometry.MultiLineString
-            elif 'Point' in (data.type,other.type):
-                newtyp = 'Point'
-                newmultiobj = shapely.geometry.MultiPoint
-        elif clipname == 'difference':
-            # same as main
-            newtyp = data.type
-            if 'Point' in newtyp: newmultiobj = shapely.geometry.MultiPoint
-            elif 'LineString' in newtyp: newmultiobj = shapely.geometry.MultiLineString
-            elif 'Polygon' in newtyp: newmultiobj = shapely.geometry.MultiPolygon
-
-        print newtyp,newmultiobj
+        newtyp,newmultiobj = _overlay_type(data, other, clipname)
             
         def clip(f1,f2):
             clipfunc = getattr(f1.get_shapely(), clipname)
             #print 'clipping feat'
             try:
-                geom = clipfunc(f2._shapely)
+                geom = clipfunc(othershapes[f2.id])
             except shapely.errors.TopologicalError:
                 warnings.warn('A clip operation failed due to invalid geometries, replacing with null-geometry')
                 return None
                 
-            if geom:
-                #print geom.geom_type
-                if geom.geom_type == 'GeometryCollection':
-                    # only get the subgeoms corresponding to the right type
-                    sgeoms = [g for g in geom.geoms if g.geom_type == newtyp] # single geoms
-                    mgeoms = [g for g in geom.geoms if g.geom_type == 'Multi'+newtyp] # multi geoms
-                    flatmgeoms = [g for mg in mgeoms for g in mg.geoms] # flatten multigeoms
-                    geom = newmultiobj(sgeoms + flatmgeoms)
-                    return geom.__geo_interface__
-                elif newtyp in geom.geom_type:
-                    # normal
-                    return geom.__geo_interface__
-                else:
-                    # ignore wrong types
-                    return None            
+            return _typed_wkb(geom, newtyp, newmultiobj)
 
     if condition in ("distance",):
         radius = kwargs.get("radius")
@@ -266,26 +229,23 @@ def spatial_join(data, other, condition, subkey=None, keepall=False, clip=False,
             raise Exception("The 'distance' join condition requires a 'radius' or 'n' arg")
 
         # prep geoms in other
-        for otherfeat in other:
-            if not otherfeat.geometry:
-                continue
-            otherfeat._shapely = otherfeat.get_shapely()
+        othershapes = dict((otherfeat.id, otherfeat.get_shapely()) for otherfeat in other if otherfeat.geometry)
 
         # match funcs
         def within(feat, other):
             if geodetic:
-                buff = geojson2shapely(geodetic_buffer(feat.geometry, radius))
+                buff = geodetic_buffer(feat.get_shapely(), radius)
             else:
                 buff = geom.buffer(radius)
             superbuff = supershapely(buff)
             otherfeats = other.quick_overlap(buff.bounds) if hasattr(other, "spindex") else other
             for otherfeat in otherfeats:
-                if superbuff.intersects(otherfeat._shapely):
+                if superbuff.intersects(othershapes[otherfeat.id]):
                     yield otherfeat
 
         def nearest(feat, otherfeats):
             # TODO: implement optional geodetic distance
-            for otherfeat in sorted(otherfeats, key=lambda otherfeat: geom.distance(otherfeat._shapely)):
+            for otherfeat in sorted(otherfeats, key=lambda otherfeat: geom.distance(othershapes[otherfeat.id])):
                 yield otherfeat
 
         # begin
@@ -310,7 +270,7 @@ def spatial_join(data, other, condition, subkey=None, keepall=False, clip=False,
             for otherfeat in other.quick_overlap(feat.bbox):
                 if subkey and not subkey(feat,otherfeat):
                     continue
-                if supergeom.intersects(otherfeat._shapely):
+                if supergeom.intersects(othershapes[otherfeat.id]):
                     overlaps.append(otherfeat)
                 else:
                     nonoverlaps.append(otherfeat)
@@ -373,13 +333,18 @@ def spatial_join(data, other, condition, subkey=None, keepall=False, clip=False,
 
     elif condition in ("intersects", "within", "contains", "crosses", "touches", "equals", "covers"):
         # prep geoms in other
-        for otherfeat in other:
-            if not otherfeat.geometry:
-                continue
-            otherfeat._shapely = otherfeat.get_shapely()
+        othershapes = dict((otherfeat.id, otherfeat.get_shapely()) for otherfeat in other if otherfeat.geometry)
+
+        # features outside the other bbox cannot match, but are still needed if keepall
+        feats = data if keepall else data.quick_overlap(other.bbox)
+
+        # points in polygons are all located in one pass
+        located = None
+        if condition in ("intersects","within") and data.type == "Point" and other.type == "Polygon":
+            located = locate_points(data, other, boundary=condition == "intersects")
 
         # begin
-        for feat in data.quick_overlap(other.bbox):
+        for feat in feats:
 
             #print feat
 
@@ -390,21 +355,26 @@ def spatial_join(data, other, condition, subkey=None, keepall=False, clip=False,
                     out.add_feature(newrow, None)
                 continue
 
-            # match funcs
-            geom = feat.get_shapely()
-            if condition in ("intersects", "contains", "covers"):
-                supergeom = supershapely(geom)
-                matchtest = getattr(supergeom, condition)
+            if located is not None:
+                matches = [other[otherid] for otherid in located[feat.id]]
+                if subkey:
+                    matches = [otherfeat for otherfeat in matches if subkey(feat, otherfeat)]
             else:
-                matchtest = getattr(geom, condition)
+                # match funcs
+                geom = feat.get_shapely()
+                if condition in ("intersects", "contains", "covers"):
+                    supergeom = supershapely(geom)
+                    matchtest = getattr(supergeom, condition)
+                else:
+                    matchtest = getattr(geom, condition)
 
-            # get spindex possibilities
-            matches = (otherfeat for otherfeat in other.quick_overlap(feat.bbox))
-            # filter by subkey
-            if subkey:
-                matches = (otherfeat for otherfeat in matches if subkey(feat, otherfeat))
-            # test spatial
-            matches = [otherfeat for otherfeat in matches if matchtest(otherfeat._shapely)]
+                # get spindex possibilities
+                matches = (otherfeat for otherfeat in other.quick_overlap(feat.bbox))
+                # filter by subkey
+                if subkey:
+                    matches = (otherfeat for otherfeat in matches if subkey(feat, otherfeat))
+                # test spatial
+                matches = [otherfeat for otherfeat in matches if matchtest(othershapes[otherfeat.id])]
             if matches:
                 for match in matches:
                     if clip:
@@ -425,10 +395,7 @@ def spatial_join(data, other, condition, subkey=None, keepall=False, clip=False,
 
     elif condition in ("disjoint",):
         # prep geoms in other
-        for otherfeat in other:
-            if not otherfeat.geometry:
-                continue
-            otherfeat._shapely = otherfeat.get_shapely()
+        othershapes = dict((otherfeat.id, otherfeat.get_shapely()) for otherfeat in other if otherfeat.geometry)
 
         # begin
         for feat in data:
@@ -456,7 +423,7 @@ def spatial_join(data, other, condition, subkey=None, keepall=False, clip=False,
             if subkey:
                 closeones = (otherfeat for otherfeat in closeones if subkey(feat, otherfeat))
             # test spatial
-            closeones = [otherfeat for otherfeat in closeones if geom.disjoint(otherfeat._shapely)]
+            closeones = [otherfeat for otherfeat in closeones if geom.disjoint(othershapes[otherfeat.id])]
 
             # add
             matches = nonoverlaps + closeones
@@ -481,6 +448,418 @@ def spatial_join(data, other, condition, subkey=None, keepall=False, clip=False,
     else:
         raise Exception("%s is not a valid join condition" % condition)
 
+# Out-of-core spatial join
+
+def _spill_records(source, spill, expand=None):
+    """
+    Writes (index, row, wkb, bbox) records of all features in a VectorData instance or filepath to a spill file,
+    where bbox is expanded by the function expand if given, and is None for null geometries. 
+    Returns the fields and the overall bbox. 
+    """
+    if isinstance(source, basestring):
+        from . import loader
+        fields,rowgeoms,crs = loader.iter_file(source)
+    else:
+        fields = source.fields
+        rowgeoms = ((feat.row,feat.geometry) for feat in source)
+    bbox = None
+    for index,(row,geom) in enumerate(rowgeoms):
+        geom = pack(geom)
+        wkb = featbbox = None
+        if isinstance(geom, PackedGeometry):
+            wkb,featbbox = geom.wkb,geom.bbox
+        elif geom and (geom.get("coordinates") or geom.get("geometries")):
+            shp = geojson2shapely(geom)
+            wkb,featbbox = shp.wkb,shp.bounds
+        if featbbox:
+            featbbox = expand(featbbox) if expand else tuple(featbbox)
+            if bbox:
+                bbox = min(bbox[0],featbbox[0]),min(bbox[1],featbbox[1]),max(bbox[2],featbbox[2]),max(bbox[3],featbbox[3])
+            else:
+                bbox = featbbox
+        spill.append((index, list(row), wkb, featbbox))
+    spill.flush()
+    return list(fields), bbox
+
+class _BucketGrid(object):
+    """A grid of buckets over a bbox, where positions outside the bbox belong to the nearest edge bucket."""
+    def __init__(self, bbox, cols, rows):
+        self.xmin,self.ymin,xmax,ymax = bbox
+        self.cols,self.rows = cols,rows
+        self.cellwidth = (xmax - self.xmin) / float(cols) or 1.0
+        self.cellheight = (ymax - self.ymin) / float(rows) or 1.0
+
+    def _colrow(self, x, y):
+        col = max(0, min(self.cols-1, int((x - self.xmin) // self.cellwidth)))
+        row = max(0, min(self.rows-1, int((y - self.ymin) // self.cellheight)))
+        return col,row
+
+    def bucket(self, x, y):
+        """Returns the bucket containing the position x,y."""
+        col,row = self._colrow(x, y)
+        return row * self.cols + col
+
+    def buckets(self, bbox):
+        """Returns the buckets that a bbox overlaps."""
+        col1,row1 = self._colrow(bbox[0], bbox[1])
+        col2,row2 = self._colrow(bbox[2], bbox[3])
+        return [row * self.cols + col for row in xrange(row1, row2+1) for col in xrange(col1, col2+1)]
+
+def _join_bucket(job, bucket):
+    """
+    Runs in worker processes, joining the features of one bucket. Since features are copied to every bucket
+    their bbox overlaps, a pair is only joined in the bucket containing the lower left corner of their bbox intersection. 
+    Returns the spill file of joined (row, wkb) records, and the list of left indexes that were matched. 
+    """
+    fields, otherfields, grid, spills, condition, subkey, clip, kwargs, tempdir = job
+    leftspill,rightspill = spills[bucket]
+    
+    left = VectorData(fields=["_index"] + fields)
+    leftbboxes = dict()
+    for index,row,wkb,bbox in leftspill:
+        feat = left.add_feature([index] + row, wkb, copy=False)
+        leftbboxes[feat.id] = bbox
+    right = VectorData(fields=otherfields)
+    for index,row,wkb,bbox in rightspill:
+        right.add_feature(row, wkb, copy=False)
+
+    def bucketkey(feat, otherfeat):
+        xmin,ymin = leftbboxes[feat.id][:2]
+        oxmin,oymin = otherfeat.bbox[:2]
+        if grid.bucket(max(xmin,oxmin), max(ymin,oymin)) != bucket:
+            return False
+        return subkey(feat, otherfeat) if subkey else True
+
+    joined = spatial_join(left, right, condition, subkey=bucketkey, clip=clip, **kwargs)
+    out = SpillFile(os.path.join(tempdir, "joined_%s" % bucket))
+    matched = set()
+    for feat in joined:
+        matched.add(feat.row[0])
+        out.append((feat.row[1:], feat.wkb))
+    out.flush()
+    return out, sorted(matched)
+
+def _join_buckets(job, buckets):
+    return [_join_bucket(job, bucket) for bucket in buckets]
+
+def spatial_join_files(data, other, condition, outpath, subkey=None, keepall=False, clip=False, buckets=None, bucketsize=10000, workers=None, **kwargs):
+    """
+    Same as spatial_join(), but for datasets too large to fit in memory, streaming the joined features to outpath
+    instead of returning a new dataset. Data and other can be filepaths or VectorData instances. 
+
+    Both datasets are first split into a grid of spatial buckets stored on disk, where features are copied to each bucket 
+    their bbox overlaps. The buckets are then joined one at a time, or in parallel by that many worker processes if 
+    workers is set. Each matching pair is only joined in one bucket, and only one bucket of features needs to fit in memory
+    at a time. The joined features are kept on disk until they are written to outpath. Writing to CSV streams the rows 
+    without loading them, while other formats may be held in memory by the file writer. 
+
+    The "distance" condition is only supported with a "radius", and the "disjoint" condition is not supported, since 
+    matches for these conditions can be anywhere in the dataset. 
+
+    Arguments:
+        buckets (optional): The number of (columns, rows) in the bucket grid. By default, chosen so each bucket 
+            has about bucketsize features of the largest dataset. 
+        bucketsize (optional): The approximate number of features per bucket when choosing the grid, default 10000. 
+            Also the most features held in memory while copying them to the buckets on disk. 
+
+        For the remaining arguments, see spatial_join(). 
+
+    Returns the outpath. 
+    """
+    import tempfile, shutil
+    condition = condition.lower()
+    if condition == "distance":
+        if kwargs.get("n"):
+            raise Exception("The out-of-core 'distance' join condition only supports the 'radius' arg, not 'n'")
+        radius = kwargs.get("radius")
+        if not radius:
+            raise Exception("The 'distance' join condition requires a 'radius' arg")
+        geodetic = kwargs.get("geodetic", True)
+        expand = lambda bbox: tuple(distance_bbox(bbox, radius, geodetic))
+    elif condition in ("intersects", "within", "contains", "crosses", "touches", "equals", "covers"):
+        expand = None
+    else:
+        raise Exception("%s is not a valid out-of-core join condition" % condition)
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        # store both datasets as temporary files
+        leftall = SpillFile(os.path.join(tempdir, "left"))
+        fields,leftbbox = _spill_records(data, leftall, expand)
+        rightall = SpillFile(os.path.join(tempdir, "right"))
+        otherfields,rightbbox = _spill_records(other, rightall)
+        outfields = fields + [field for field in otherfields if field not in fields]
+        otheridx = [i for i,field in enumerate(otherfields) if field not in fields]
+
+        results = []
+        if leftbbox and rightbbox:
+            # only the area where both datasets overlap needs to be bucketed
+            xmin,ymin = max(leftbbox[0],rightbbox[0]),max(leftbbox[1],rightbbox[1])
+            xmax,ymax = min(leftbbox[2],rightbbox[2]),min(leftbbox[3],rightbbox[3])
+            if xmin <= xmax and ymin <= ymax:
+                if buckets:
+                    cols,rows = buckets
+                else:
+                    cols = rows = max(1, int(math.ceil(math.sqrt(max(len(leftall),len(rightall)) / float(bucketsize)))))
+                grid = _BucketGrid((xmin,ymin,xmax,ymax), cols, rows)
+                # buffer no more than about one bucket of features in memory across all the buckets
+                group = SpillGroup(bucketsize)
+                spills = [(SpillFile(os.path.join(tempdir, "left_%s" % i), group=group), SpillFile(os.path.join(tempdir, "right_%s" % i), group=group))
+                          for i in xrange(cols * rows)]
+
+                # copy each feature to the buckets that its bbox overlaps, skipping those outside the overlap area
+                for side,spill in ((0,leftall),(1,rightall)):
+                    for record in spill:
+                        bbox = record[3]
+                        if bbox and bbox[0] <= xmax and bbox[2] >= xmin and bbox[1] <= ymax and bbox[3] >= ymin:
+                            for bucket in grid.buckets(bbox):
+                                spills[bucket][side].append(record)
+                group.flush()
+
+                # join the buckets that have features from both datasets
+                nonempty = [bucket for bucket,(leftspill,rightspill) in enumerate(spills) if len(leftspill) and len(rightspill)]
+                job = (fields, otherfields, grid, spills, condition, subkey, clip, kwargs, tempdir)
+                results = [result for chunk in parallel_chunks(_join_buckets, job, nonempty, workers, chunksize=1)
+                           for result in chunk]
+
+        matched = bytearray(len(leftall))
+        for spill,indexes in results:
+            for index in indexes:
+                matched[index] = 1
+
+        # stream the joined features to file, followed by the unmatched features if keepall
+        class Records(object):
+            def __init__(self, item):
+                self.item = item
+            def __iter__(self):
+                for spill,indexes in results:
+                    for record in spill:
+                        yield pack(record[1]) if self.item else record[0]
+                if keepall:
+                    for index,row,wkb,bbox in leftall:
+                        if not matched[index]:
+                            if self.item:
+                                yield pack(wkb) if wkb else None
+                            else:
+                                yield row + [None for i in otheridx]
+
+        from . import saver
+        saver.to_file(outfields, Records(0), Records(1), outpath)
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    return outpath
+
+
+
+
+
+
+
+
+
+
+# Overlay operations
+
+def _overlay_type(data, other, op):
+    """Determines the correct output geometry type and multi geometry class of an overlay operation."""
+    if op == 'intersection':
+        # lowest dimension
+        if 'Point' in (data.type,other.type):
+            newtyp = 'Point'
+        elif 'LineString' in (data.type,other.type):
+            newtyp = 'LineString'
+        else:
+            newtyp = 'Polygon'
+    elif op == 'union':
+        # highest dimension
+        if 'Polygon' in (data.type,other.type):
+            newtyp = 'Polygon'
+        elif 'LineString' in (data.type,other.type):
+            newtyp = 'LineString'
+        else:
+            newtyp = 'Point'
+    else:
+        # same as main
+        newtyp = data.type
+    newmultiobj = {'Point': shapely.geometry.MultiPoint,
+                   'LineString': shapely.geometry.MultiLineString,
+                   'Polygon': shapely.geometry.MultiPolygon}[newtyp]
+    return newtyp,newmultiobj
+
+def _typed_wkb(geom, newtyp, newmultiobj):
+    """Returns the wkb of the parts of an overlay result geometry that are of the expected type, or None if there are none."""
+    if not geom:
+        return None
+    if geom.geom_type == 'GeometryCollection':
+        # only get the subgeoms corresponding to the right type
+        sgeoms = [g for g in geom.geoms if g.geom_type == newtyp] # single geoms
+        mgeoms = [g for g in geom.geoms if g.geom_type == 'Multi'+newtyp] # multi geoms
+        flatmgeoms = [g for mg in mgeoms for g in mg.geoms] # flatten multigeoms
+        if not (sgeoms or flatmgeoms):
+            return None
+        return newmultiobj(sgeoms + flatmgeoms).wkb
+    elif newtyp in geom.geom_type:
+        # normal
+        return geom.wkb
+    else:
+        # ignore wrong types
+        return None
+
+def _overlay_feature(feat, other, op, newtyp, newmultiobj, othershapes):
+    """
+    Overlays a single feature with the overlapping features of the other dataset. 
+    Returns a list of (otherid,wkb) pieces, where otherid is the id of the other feature the piece belongs to, 
+    or None for clip, erase and the remainder of identity. A wkb of None means the original feature geometry is kept unchanged.
+    Othershapes is a dict used to cache the shapely and prepared geometries of other features between calls.
+    """
+    geom = feat.get_shapely()
+    prepped = supershapely(geom)
+
+    # find overlapping other features
+    candidates = []
+    for otherfeat in other.quick_overlap(feat.bbox):
+        shapes = othershapes.get(otherfeat.id)
+        if shapes is None:
+            othergeom = otherfeat.get_shapely()
+            shapes = othershapes[otherfeat.id] = othergeom, supershapely(othergeom)
+        if prepped.intersects(shapes[0]):
+            candidates.append((otherfeat.id, shapes))
+
+    def overlay(func, othergeom):
+        try:
+            return _typed_wkb(func(othergeom), newtyp, newmultiobj)
+        except shapely.errors.TopologicalError:
+            warnings.warn('An overlay operation failed due to invalid geometries, skipping the result')
+            return None
+    
+    pieces = []
+    if op in ("clip","erase"):
+        if not candidates:
+            # nothing to clip by, or nothing to erase
+            return [] if op == "clip" else [(None,None)]
+        # no need to calculate anything if fully inside one of the other features
+        if any(otherprepped.contains(geom) for _,(othergeom,otherprepped) in candidates):
+            return [(None,None)] if op == "clip" else []
+        # union the candidates once
+        union = union_geometries(othergeom for _,(othergeom,otherprepped) in candidates)
+        func = geom.intersection if op == "clip" else geom.difference
+        wkb = overlay(func, union)
+        if wkb:
+            pieces.append((None, wkb))
+            
+    elif op in ("intersect","identity"):
+        for otherid,(othergeom,otherprepped) in candidates:
+            if otherprepped.contains(geom):
+                pieces.append((otherid, None))
+            else:
+                wkb = overlay(geom.intersection, othergeom)
+                if wkb:
+                    pieces.append((otherid, wkb))
+        if op == "identity":
+            # also keep the remainder not covered by any of the other features
+            if not candidates:
+                pieces.append((None, None))
+            elif not any(wkb is None for _,wkb in pieces):
+                union = union_geometries(othergeom for _,(othergeom,otherprepped) in candidates)
+                wkb = overlay(geom.difference, union)
+                if wkb:
+                    pieces.append((None, wkb))
+                    
+    return pieces
+
+def _overlay_chunk(job, featids):
+    """Runs in worker processes, overlaying a chunk of features."""
+    data, other, op, newtyp, newmultiobj = job
+    othershapes = dict()
+    return [(featid, _overlay_feature(data[featid], other, op, newtyp, newmultiobj, othershapes))
+            for featid in featids]
+
+def _overlay(data, other, op, workers=None):
+    # create spatial index
+    if not hasattr(data, "spindex"): data.create_spatial_index()
+    if not hasattr(other, "spindex"): other.create_spatial_index()
+
+    out = VectorData()
+    out.fields = list(data.fields)
+    if op in ("intersect","identity"):
+        out.fields += (field for field in other.fields if field not in data.fields)
+    otheridx = [i for i,field in enumerate(other.fields) if field not in data.fields]
+    
+    newtyp,newmultiobj = _overlay_type(data, other, "intersection" if op in ("clip","intersect") else "difference")
+
+    # only features that may overlap the other data need to be processed
+    if op in ("clip","intersect"):
+        feats = [feat for feat in data.quick_overlap(other.bbox)]
+    else:
+        feats = [feat for feat in data if feat.geometry]
+
+    if workers and workers != 1:
+        # worker processes inherit the datasets when forked, and return only the overlay pieces
+        featids = [feat.id for feat in feats]
+        job = (data, other, op, newtyp, newmultiobj)
+        results = itertools.chain.from_iterable(parallel_chunks(_overlay_chunk, job, featids, workers))
+    else:
+        othershapes = dict()
+        results = ((feat.id, _overlay_feature(feat, other, op, newtyp, newmultiobj, othershapes)) for feat in feats)
+
+    for featid,pieces in results:
+        feat = data[featid]
+        for otherid,wkb in pieces:
+            newrow = list(feat.row)
+            if op in ("intersect","identity"):
+                if otherid is None:
+                    newrow += (None for i in otheridx)
+                else:
+                    otherrow = other[otherid].row
+                    newrow += (otherrow[i] for i in otheridx)
+            out.add_feature(newrow, feat.geometry if wkb is None else wkb)
+
+    return out
+
+def clip(data, clipdata, workers=None):
+    """
+    Clips the features of a dataset to only the parts that are inside the features of another dataset. 
+    Only the fields of the main dataset are kept. 
+
+    The overlapping clip features are found using the spatial indexes of both datasets, and unioned once for each feature.
+    Features that are fully inside a clip feature are kept as they are without any geometry calculations. 
+    The output geometry type is the lowest dimension of the two datasets. 
+    Features can be processed in parallel by setting workers to the number of worker processes, or True to use one per cpu
+    (requires a platform where worker processes are forked, since the datasets are not sent to the workers). 
+    """
+    return _overlay(data, clipdata, "clip", workers)
+
+def erase(data, erasedata, workers=None):
+    """
+    Erases the parts of the features of a dataset that are inside the features of another dataset. 
+    Only the fields of the main dataset are kept, and features that are entirely erased are dropped. 
+
+    Works the same way as clip(), see there for details. The output geometry type is the same as the main dataset. 
+    """
+    return _overlay(data, erasedata, "erase", workers)
+
+def intersect(data, other, workers=None):
+    """
+    Returns the intersection of each pair of overlapping features of the two datasets, with the fields of both.
+    If the other dataset has fields with the same name as the main dataset, those will not be included. 
+
+    Features that are fully inside an overlapping feature are kept as they are without any geometry calculations. 
+    The output geometry type is the lowest dimension of the two datasets. 
+    See clip() for the workers option. 
+    """
+    return _overlay(data, other, "intersect", workers)
+
+def identity(data, other, workers=None):
+    """
+    Splits each feature of the main dataset into the parts that overlap each feature of the other dataset,
+    with the fields of both, and the remaining part that does not overlap any of them, with only the fields of the main 
+    dataset. Features that do not overlap anything are kept as they are. 
+    If the other dataset has fields with the same name as the main dataset, those will not be included. 
+    
+    The output geometry type is the same as the main dataset. See clip() for the workers option. 
+    """
+    return _overlay(data, other, "identity", workers)
 
 
 
@@ -557,6 +936,20 @@ def merge(*datalist):
     #return merged file
     return outfile
 
+def dissolve(data, key=None, fieldmapping=[], touching=False, workers=None):
+    """
+    Dissolves the geometries of features that share the same key, aggregating their values.
+
+    Shortcut for VectorData.aggregate() with geomfunc set to union, see there for details. 
+    Key can be a list of field names or a function, and if not set dissolves all features together. 
+    If touching is True, only dissolves features that touch or overlap each other. 
+    Groups can be dissolved in parallel by setting workers to the number of worker processes, 
+    or to True to use one per cpu. 
+    """
+    if key is None:
+        key = lambda f: None
+    return data.aggregate(key, geomfunc="union", fieldmapping=fieldmapping, touching=touching, workers=workers)
+
 
 
 
@@ -566,39 +959,279 @@ def merge(*datalist):
 
 # Polishing
 
-def clean(data, tolerance=0, preserve_topology=True):
+def _polygonal(shp):
+    """Returns only the polygon parts of a shapely geometry, or None if there are none."""
+    if shp is None or shp.is_empty:
+        return None
+    elif "Polygon" in shp.geom_type:
+        return shp
+    elif shp.geom_type == "GeometryCollection":
+        polys = [geom for geom in shp.geoms if "Polygon" in geom.geom_type and not geom.is_empty]
+        if polys:
+            return shapely.ops.unary_union(polys)
+
+def _inside_ring(x, y, ring):
+    # ray crossing test, which unlike shapely also works for self-intersecting rings
+    inside = False
+    for (x1,y1),(x2,y2) in itertools.izip(ring, ring[1:]):
+        if (y1 > y) != (y2 > y) and x < x1 + (y-y1) * (x2-x1) / float(y2-y1):
+            inside = not inside
+    return inside
+
+def _repair_make_valid(shp):
+    try:
+        from shapely.validation import make_valid
+    except ImportError:
+        # requires shapely 1.8 or later
+        return None
+    return make_valid(shp)
+
+def _repair_polygonize(shp):
+    # nodes the rings at their self-intersections, and keeps the resulting faces
+    # that fall inside an odd number of rings of each polygon (the even-odd rule)
+    if "Polygon" not in shp.geom_type:
+        return None
+    polys = list(shp.geoms) if shp.geom_type == "MultiPolygon" else [shp]
+    parts = []
+    for poly in polys:
+        rings = [list(ring.coords) for ring in [poly.exterior] + list(poly.interiors)]
+        lines = [shapely.geometry.LineString(ring) for ring in rings if len(ring) >= 2]
+        noded = shapely.ops.unary_union(lines)
+        for face in shapely.ops.polygonize(noded):
+            pt = face.representative_point()
+            if sum(1 for ring in rings if _inside_ring(pt.x, pt.y, ring)) % 2 == 1:
+                parts.append(face)
+    if parts:
+        return shapely.ops.unary_union(parts)
+
+def _repair_buffer(shp):
+    # fixes bowtie polygons, though may drop some of their parts
+    if "Polygon" not in shp.geom_type:
+        return None
+    return shp.buffer(0.0)
+
+_REPAIR_STRATEGIES = {"make_valid": _repair_make_valid,
+                      "polygonize": _repair_polygonize,
+                      "buffer": _repair_buffer}
+
+def _vertex_count(geometry):
+    return sum(len(geom.coords) // 2 for geom in packed_parts(geometry))
+
+def _clean_feature(wkb, tolerance, preserve_topology, repair, simplify):
+    """
+    Validates, repairs and simplifies a single geometry given as WKB.
+    Returns the cleaned geometry as WKB, or None if it could not be repaired, along with a stats dict.
+    Null geometries (None) are returned as they are, with a valid status of None. 
+    """
+    if wkb is None:
+        return None, {"valid": None, "repair": None, "removed": 0}
+    shp = wkb2shapely(wkb)
+    before = _vertex_count(shp)
+    stats = {"valid": shp.is_valid, "repair": None, "removed": 0}
+
+    # try fixing invalid geoms, with each strategy in turn
+    if not stats["valid"]:
+        fixed = None
+        for name in repair:
+            try:
+                fixed = _REPAIR_STRATEGIES[name](shp)
+            except ValueError:
+                fixed = None
+            if fixed is not None and "Polygon" in shp.geom_type:
+                fixed = _polygonal(fixed)
+            if fixed is not None and not fixed.is_empty and fixed.is_valid:
+                stats["repair"] = name
+                break
+            fixed = None
+        if fixed is None:
+            stats["repair"] = "failed"
+            return None, stats
+        shp = fixed
+
+    # remove repeat points (tolerance=0)
+    # (and optionally smooth out complex shapes, tolerance > 0)
+    if simplify:
+        simple = shp.simplify(tolerance, preserve_topology=preserve_topology)
+        # if still invalid, keep the unsimplified geometry
+        if not simple.is_empty and simple.is_valid:
+            shp = simple
+        
+    stats["removed"] = before - _vertex_count(shp)
+    return shp.wkb, stats
+
+def _clean_chunk(job, featids):
+    """Runs in worker processes, cleaning a chunk of features."""
+    data, options = job
+    return [(featid, _clean_feature(data[featid].wkb, *options)) for featid in featids]
+
+def _shared_arcs(shapes):
+    """Splits the boundaries of a list of shapely polygons into arcs between the nodes where three or more of them meet."""
+    boundaries = [shp.boundary for shp in shapes if shp is not None]
+    if not boundaries:
+        return []
+    arcs = shapely.ops.linemerge(shapely.ops.unary_union(boundaries))
+    return [arcs] if arcs.geom_type == "LineString" else list(arcs.geoms)
+
+def _simplify_arcs(arcs, tolerance):
+    """Simplifies each arc, keeping the original of any simplified arcs that would cross another arc."""
+    simple = [arc.simplify(tolerance, preserve_topology=True) for arc in arcs]
+
+    # simplified arcs that cross another arc would break the polygons apart,
+    # so revert those to their original arcs until no more crossings are found
+    changed = set(i for i,arc in enumerate(arcs) if len(simple[i].coords) != len(arc.coords))
+    # the end nodes of each arc, where arcs are allowed to meet, also for closed arcs which have no boundary
+    ends = [shapely.geometry.MultiPoint([arc.coords[0], arc.coords[-1]]) for arc in arcs]
+    while changed:
+        arcindex = rtree.index.Index(((i, arc.bounds, None) for i,arc in enumerate(simple)))
+        crossing = set()
+        for i in changed:
+            for j in arcindex.intersection(simple[i].bounds):
+                if j != i and simple[i].relate(simple[j])[0] != "F" \
+                   and not simple[i].intersection(simple[j]).difference(ends[i].union(ends[j])).is_empty:
+                    # interiors intersect somewhere other than at their end nodes
+                    crossing.add(i)
+                    if j in changed:
+                        crossing.add(j)
+        if not crossing:
+            break
+        for i in crossing:
+            simple[i] = arcs[i]
+        changed -= crossing
+    return simple
+
+def _assign_faces(shapes, arcs, tolerance):
+    """
+    Rebuilds a list of shapely polygons from the faces that result from polygonizing their simplified arcs,
+    assigning each face to the polygons that contain it. Polygons that end up with no faces are simplified on their own.
+    """
+    items = ((i, shp.bounds, None) for i,shp in enumerate(shapes) if shp is not None)
+    spindex = rtree.index.Index(items)
+    prepped = dict()
+    faces = dict()
+    for face in shapely.ops.polygonize(arcs):
+        pt = face.representative_point()
+        for i in spindex.intersection(pt.bounds):
+            if i not in prepped:
+                prepped[i] = supershapely(shapes[i])
+            if prepped[i].contains(pt):
+                faces.setdefault(i, []).append(face)
+
+    out = []
+    for i,shp in enumerate(shapes):
+        if shp is None:
+            out.append(None)
+        elif i in faces:
+            out.append(union_geometries(faces[i]))
+        else:
+            out.append(shp.simplify(tolerance, preserve_topology=True))
+    return out
+
+def _simplify_shared(shapes, tolerance):
+    """
+    Simplifies a list of shapely polygons so that boundaries shared between adjacent polygons are
+    simplified the same way, which avoids opening up slivers between them. 
+    
+    The boundaries are split into arcs between the nodes where three or more of them meet, each arc is
+    simplified once, and the faces that result from polygonizing the simplified arcs are assigned back to
+    the polygon they fall inside. Polygons that end up with no faces are simplified on their own.
+    """
+    arcs = _shared_arcs(shapes)
+    if not arcs:
+        return shapes
+    return _assign_faces(shapes, _simplify_arcs(arcs, tolerance), tolerance)
+
+def iter_clean(data, tolerance=0, preserve_topology=True, repair=("make_valid","polygonize","buffer"), workers=None):
+    """
+    Same as clean(), but yields each cleaned feature as a (feature, wkb, stats) tuple as soon as it is ready,
+    so that large datasets can be processed without waiting for all the results. Wkb is None for null geometries, 
+    and for features that could not be repaired, which have a stats repair value of "failed". 
+    """
+    options = (tolerance, preserve_topology, repair, True)
+    feats = iter(data)
+    
+    if workers and workers != 1:
+        # worker processes inherit the data when forked, and stream back the results chunk by chunk
+        featids = [feat.id for feat in feats]
+        for results in parallel_chunks(_clean_chunk, (data, options), featids, workers, maxchunksize=1000):
+            for featid,(wkb,stats) in results:
+                yield data[featid], wkb, stats
+    else:
+        for feat in feats:
+            wkb,stats = _clean_feature(feat.wkb, *options)
+            yield feat, wkb, stats
+
+def clean(data, tolerance=0, preserve_topology=True, shared_boundaries=False, repair=("make_valid","polygonize","buffer"), report=False, workers=None):
     """Cleans the vector data of unnecessary clutter such as repeat
     points or closely related points within the distance specified in the
     'tolerance' parameter. Also tries to fix any broken geometries, dropping
-    any unfixable ones.
+    any unfixable ones with a warning. Features with null geometries are kept as they are.
 
-    Adds the resulting cleaned data to the layers list.
-    """    
+    Invalid geometries are repaired by trying each of the strategies listed in
+    'repair' in turn, until one gives a valid result: 
+    
+    - make_valid: shapely's make_valid (requires shapely 1.8 or later). 
+    - polygonize: rebuilds polygons from their self-intersecting rings. 
+    - buffer: a zero-distance buffer. 
+
+    If 'shared_boundaries' is True, polygon boundaries that are shared with adjacent
+    polygons are simplified together, so that no gaps or overlaps open up between them.
+
+    If 'report' is True, adds the fields "clean_valid" (whether the geometry was
+    originally valid, or None for null geometries), "clean_repair" (the repair strategy used, if any), and
+    "clean_removed" (the number of vertexes removed). 
+
+    Set workers to the number of processes to validate and repair with in parallel,
+    or True for one per cpu. 
+    """
+    shared = shared_boundaries and tolerance > 0 and data.type == "Polygon"
+    
     # create new file
     outfile = VectorData()
     outfile.fields = list(data.fields)
+    if report:
+        outfile.fields += ["clean_valid", "clean_repair", "clean_removed"]
+
+    def add(feat, wkb, stats):
+        row = list(feat.row)
+        if report:
+            valid = None if stats["valid"] is None else int(stats["valid"])
+            row += [valid, stats["repair"], stats["removed"]]
+        outfile.add_feature(row, wkb)
 
     # clean
-    for feat in data:
-        shapelyobj = feat.get_shapely()
-        
-        # try fixing invalid geoms
-        if not shapelyobj.is_valid:
-            if "Polygon" in shapelyobj.type:
-                # fix bowtie polygons
-                shapelyobj = shapelyobj.buffer(0.0)
-
-        # remove repeat points (tolerance=0)
-        # (and optionally smooth out complex shapes, tolerance > 0)
-        shapelyobj = shapelyobj.simplify(tolerance, preserve_topology=preserve_topology)
+    failed = 0
+    if shared:
+        # simplifying requires all the repaired polygons, so only validate and repair in the first pass
+        results = []
+        options = (tolerance, preserve_topology, repair, False)
+        feats = list(data)
+        if workers and workers != 1:
+            featids = [feat.id for feat in feats]
+            chunkresults = parallel_chunks(_clean_chunk, (data, options), featids, workers)
+            results = [(data[featid],wkb,stats) for featid,(wkb,stats) in itertools.chain.from_iterable(chunkresults)]
+        else:
+            results = [(feat,)+_clean_feature(feat.wkb, *options) for feat in feats]
             
-        # if still invalid, do not add to output
-        if not shapelyobj.is_valid:
-            continue
+        shapes = [wkb2shapely(wkb) if wkb else None for feat,wkb,stats in results]
+        simplified = _simplify_shared(shapes, tolerance)
+        for (feat,wkb,stats),shp,simple in itertools.izip(results, shapes, simplified):
+            if stats["repair"] == "failed":
+                failed += 1
+                continue
+            if simple is not None and not simple.is_empty and simple.is_valid:
+                stats["removed"] = _vertex_count(feat.geometry) - _vertex_count(simple)
+                wkb = simple.wkb
+            add(feat, wkb, stats)
 
-        # write to file
-        geojson = shapelyobj.__geo_interface__
-        outfile.add_feature(feat.row, geojson)
+    else:
+        for feat,wkb,stats in iter_clean(data, tolerance, preserve_topology, repair, workers):
+            if stats["repair"] == "failed":
+                failed += 1
+                continue
+            add(feat, wkb, stats)
+
+    if failed:
+        warnings.warn("%s features could not be repaired and were dropped" % failed)
 
     return outfile
 
@@ -612,31 +1245,119 @@ def clean(data, tolerance=0, preserve_topology=True):
 ##
 ##    raise Exception("Not yet implemented")
 
-def snap(data, otherdata, tolerance=0.0000001):
-    """Snaps all vertexes from the features in one layer snap to the vertexes of features in another layer within a certain distance"""
-    
-    # default should be 0.001 meters (1 millimeter), ala ArcGIS
-    # should be calculated based on crs
+def _snap_index(otherdata, tolerance, segments=False):
+    """
+    Indexes all vertexes of otherdata in a dict of grid cells the size of the tolerance,
+    so that any vertex within tolerance of a point is in one of the 3x3 cells around it.
+    If segments is True, also bulk loads the line and ring segments into an rtree index.
+    """
+    grid = dict()
+    segs = []
+    floor = math.floor
+    for feat in otherdata:
+        if not feat.geometry: continue
+        for geom in packed_parts(feat.geometry):
+            for x,y in geom.iter_points():
+                grid.setdefault((int(floor(x/tolerance)), int(floor(y/tolerance))), []).append((x,y))
+            if segments and geom.typecode not in (1,4):
+                for ring in geom.iter_rings():
+                    segs.extend(itertools.izip(ring[0:-2:2], ring[1:-2:2], ring[2::2], ring[3::2]))
+
+    segindex = None
+    if segs:
+        items = ((i, (min(x1,x2),min(y1,y2),max(x1,x2),max(y1,y2)), None)
+                 for i,(x1,y1,x2,y2) in enumerate(segs))
+        segindex = rtree.index.Index(items)
+        
+    return grid, segindex, segs
+
+def _snap_coords(coords, index, tolerance):
+    """Snaps a flat x,y coordinate array to the nearest indexed vertex, or else segment, within tolerance."""
+    grid, segindex, segs = index
+    floor = math.floor
+    maxdist = tolerance * tolerance
+    new = array.array("d", coords)
+    for i in xrange(0, len(coords), 2):
+        x,y = coords[i],coords[i+1]
+        cx,cy = int(floor(x/tolerance)), int(floor(y/tolerance))
+        best = None
+        bestdist = maxdist
+        for nx in (cx-1,cx,cx+1):
+            for ny in (cy-1,cy,cy+1):
+                for vx,vy in grid.get((nx,ny), ()):
+                    dist = (vx-x)*(vx-x) + (vy-y)*(vy-y)
+                    if dist <= bestdist:
+                        best = vx,vy
+                        bestdist = dist
+        if best is None and segindex is not None:
+            # nearest point on any segment within tolerance
+            for j in segindex.intersection((x-tolerance, y-tolerance, x+tolerance, y+tolerance)):
+                x1,y1,x2,y2 = segs[j]
+                dx,dy = x2-x1,y2-y1
+                seglen = dx*dx + dy*dy
+                f = ((x-x1)*dx + (y-y1)*dy) / seglen if seglen else 0.0
+                f = min(1.0, max(0.0, f))
+                px,py = x1+f*dx, y1+f*dy
+                dist = (px-x)*(px-x) + (py-y)*(py-y)
+                if dist <= bestdist:
+                    best = px,py
+                    bestdist = dist
+        if best is not None:
+            new[i],new[i+1] = best
+    return new
 
-    # NOTSURE: for now, if multiple within tolerance, snaps first to furtherst away, then to next farthest, etc.
-    # this means might be snapped back and forth multiple times, but at least the closest one will have the final say.
+def _snap_geometry(geometry, index, tolerance):
+    geometry = pack(geometry)
+    if isinstance(geometry, PackedGeometry):
+        return geometry.with_coords(_snap_coords(geometry.coords, index, tolerance))
+    elif geometry and geometry["type"] == "GeometryCollection":
+        geoms = [_snap_geometry(geom, index, tolerance) for geom in geometry["geometries"]]
+        return {"type": "GeometryCollection",
+                "geometries": [geom.__geo_interface__ if isinstance(geom, PackedGeometry) else geom
+                               for geom in geoms]}
+    else:
+        # 3D or empty geometries are left as they are
+        return geometry
+
+def _snap_chunk(job, featids):
+    """Runs in worker processes, snapping a chunk of features and returning their new geometries."""
+    data, index, tolerance = job
+    results = []
+    for featid in featids:
+        geom = _snap_geometry(data[featid].geometry, index, tolerance)
+        results.append((featid, geom.wkb if isinstance(geom, PackedGeometry) else geom))
+    return results
+
+def snap(data, otherdata, tolerance=0.0000001, segments=False, workers=None):
+    """
+    Snaps all vertexes from the features in one layer to the nearest vertex of the features in another layer
+    within a certain distance.
 
-    if not hasattr(otherdata, "spindex"):
-        otherdata.create_spatial_index()
+    All vertexes of the other layer are first indexed in a grid of tolerance sized cells, so each vertex is
+    snapped in a single lookup. If segments is True, vertexes without any other vertex within tolerance are
+    instead snapped to the nearest point on the other layer's lines or polygon boundaries.
 
-    from shapely.ops import snap as _snap
+    Set workers to the number of processes to snap with in parallel, or True for one per cpu. 
+    """
+    # default should be 0.001 meters (1 millimeter), ala ArcGIS
+    # should be calculated based on crs
 
     out = data.copy()
-    for feat in out:
-        shp = feat.get_shapely()
-        buff = shp.buffer(tolerance)
-        withindist = (otherfeat.get_shapely() for otherfeat in otherdata.quick_overlap(buff.bounds))
-        withindist = (othershp for othershp in withindist if buff.intersects(othershp))
-        withindist = ((othershp,shp.distance(othershp)) for othershp in withindist)
-        for othershp,dist in sorted(withindist, key=lambda(shp,dist): dist, reverse=True):
-            print "snap"
-            shp = _snap(shp, othershp, tolerance)
-        feat.geometry = shp.__geo_interface__
+    if not tolerance or tolerance <= 0:
+        return out
+
+    index = _snap_index(otherdata, tolerance, segments)
+    feats = [feat for feat in out if feat.geometry]
+
+    if workers and workers != 1:
+        # worker processes inherit the data and vertex index when forked
+        featids = [feat.id for feat in feats]
+        results = parallel_chunks(_snap_chunk, (out, index, tolerance), featids, workers)
+        for featid,geom in itertools.chain.from_iterable(results):
+            out[featid].geometry = geom
+    else:
+        for feat in feats:
+            feat.geometry = _snap_geometry(feat.geometry, index, tolerance)
         
     return out
 
@@ -648,40 +1369,103 @@ def snap(data, otherdata, tolerance=0.0000001):
 
 
 
+
 # Create operations
 
-def connect(frompoints, topoints, key=None, greatcircle=True, segments=100):
+def connect(frompoints, topoints, key=None, greatcircle=True, segments=100, radius=None, n=None):
     """Two point files, and for each frompoint draw line to each topoint
-    that matches based on some key value."""
+    that matches based on some key value.
+
+    Key can be a fieldname or function, or a pair of them for the from and to
+    points respectively. Matching topoints are looked up in a hash table of key
+    values instead of being compared one by one. If key is None, all points are
+    connected.
+
+    Radius limits the connections to topoints within a max distance, and n to
+    the n nearest topoints of each frompoint. Distances are given in km if
+    greatcircle is True, otherwise in coordinate units. When no key is given,
+    these candidates are found via the spatial index of the topoints.
+    """
+    import heapq
+    from ._helpers import great_circle_path, haversine_distance, distance_bbox
 
     # get key
-    if isinstance(key, (list,tuple)) and len(key) == 2:
-        k1,k2 = key
+    if key is None:
+        key1 = key2 = None
     else:
-        k1 = k2 = key # same key for both
-    key1 = k1 if hasattr(k1,"__call__") else lambda f:f[k1]
-    key2 = k2 if hasattr(k2,"__call__") else lambda f:f[k2]
-
-    from ._helpers import great_circle_path
+        if isinstance(key, (list,tuple)) and len(key) == 2:
+            k1,k2 = key
+        else:
+            k1 = k2 = key # same key for both
+        key1 = k1 if hasattr(k1,"__call__") else lambda f:f[k1]
+        key2 = k2 if hasattr(k2,"__call__") else lambda f:f[k2]
 
     # TODO: allow any geometry types via centroids, not just point types
     # ...
 
-    # TODO: optimize with hash lookup table
-    # ...
-        
-    def flatten(data):
-        for feat in data:
-            if not feat.geometry: continue
-            geotype = feat.geometry["type"]
-            coords = feat.geometry["coordinates"]
-            if "Multi" in geotype:
-                for singlepart in coords:
-                    geoj = {"type": geotype.replace("Multi", ""),
-                            "coordinates": singlepart}
-                    yield feat, geoj
-            else:
-                yield feat, feat.geometry
+    def flatten(feat):
+        if not feat.geometry:
+            return []
+        coords = feat.geometry["coordinates"]
+        if "Multi" in feat.geometry["type"]:
+            return [tuple(singlepart) for singlepart in coords]
+        else:
+            return [tuple(coords)]
+
+    if greatcircle:
+        distance = haversine_distance
+    else:
+        distance = lambda p1,p2: math.hypot(p2[0]-p1[0], p2[1]-p1[1])
+
+    # hash the topoints by key, or by feature id for spatial lookups
+    lookup = dict()
+    for tofeat in topoints:
+        entries = [(tofeat,topoint) for topoint in flatten(tofeat)]
+        if not entries: continue
+        if key2:
+            lookup.setdefault(key2(tofeat), []).extend(entries)
+        else:
+            lookup[tofeat.id] = entries
+    allentries = [entry for entries in lookup.values() for entry in entries] if key2 is None else None
+
+    spatial = key2 is None and (radius is not None or n)
+    if spatial and not hasattr(topoints, "spindex"):
+        topoints.create_spatial_index()
+
+    def within(point, dist):
+        # all topoints whose bbox is within dist of point, via the spatial index
+        x,y = point[:2]
+        bbox = distance_bbox([x,y,x,y], dist, geodetic=greatcircle)
+        return [entry for tofeat in topoints.quick_overlap(bbox) for entry in lookup[tofeat.id]]
+
+    def nearest(point, num):
+        # the spatial index only knows planar bbox distances, so use the farthest of the num
+        # index-nearest points as a search radius guaranteed to contain the true nearest ones
+        x,y = point[:2]
+        cands = [entry for tofeat in topoints.quick_nearest([x,y,x,y], n=num) for entry in lookup[tofeat.id]]
+        dists = heapq.nsmallest(num, (distance(point,topoint) for tofeat,topoint in cands))
+        if not dists:
+            return []
+        return within(point, dists[-1])
+
+    def candidates(fromfeat, frompoint):
+        if key1:
+            cands = lookup.get(key1(fromfeat), [])
+        elif radius is not None:
+            cands = within(frompoint, radius)
+        elif n:
+            cands = nearest(frompoint, n)
+        else:
+            return allentries
+        if radius is None and not n:
+            return cands
+        # exact distance filtering
+        dists = ((distance(frompoint,topoint),(tofeat,topoint)) for tofeat,topoint in cands)
+        if radius is not None:
+            dists = (item for item in dists if item[0] <= radius)
+        if n:
+            dists = heapq.nsmallest(n, dists, key=operator.itemgetter(0))
+        return [entry for dist,entry in dists]
 
     # create new file
     outfile = VectorData()
@@ -689,22 +1473,41 @@ def connect(frompoints, topoints, key=None, greatcircle=True, segments=100):
     outfile.fields.extend(topoints.fields)
 
     # connect points matching criteria
-    for fromfeat,frompoint in flatten(frompoints):
-        for tofeat,topoint in flatten(topoints):
-            match = key1(fromfeat) == key2(tofeat) if key1 and key2 else True
-            if match:
+    for fromfeat in frompoints:
+        for frompoint in flatten(fromfeat):
+            for tofeat,topoint in candidates(fromfeat, frompoint):
                 if greatcircle:
-                    linepath = great_circle_path(frompoint["coordinates"], topoint["coordinates"], segments=segments)
+                    linepath = great_circle_path(frompoint, topoint, segments=segments)
                 else:
-                    linepath = [frompoint["coordinates"], topoint["coordinates"]]
+                    linepath = [frompoint, topoint]
                 geoj = {"type": "LineString",
                         "coordinates": linepath}
                 row = list(fromfeat.row)
                 row.extend(tofeat.row)
-                outfile.add_feature(row=row, geometry=geoj)
+                outfile.add_feature(row=row, geometry=geoj, copy=False)
 
     return outfile
 
+def to_network(data, tolerance=0, weight=None, geodetic=False, directed=False, cache=True):
+    """
+    Builds a network graph from a line dataset, for routing with analyzer.shortest_path() and
+    analyzer.service_area(). Line vertexes within tolerance of each other become the same node. 
+
+    Weight is a fieldname or function that gives the cost of traversing each feature, split over
+    its segments by length. By default the cost is the length, in km if geodetic is True. If directed
+    is True, lines can only be traversed in the direction they are drawn. 
+
+    The network is cached on the dataset and reused when called again with the same options. 
+    If features are changed, added, or dropped, set cache to False to build it again. 
+    """
+    from ._network import Network
+    key = (tolerance, weight, geodetic, directed)
+    if not hasattr(data, "_networks"):
+        data._networks = dict()
+    if not cache or key not in data._networks:
+        data._networks[key] = Network(data, tolerance, weight, geodetic, directed)
+    return data._networks[key]
+
 
 
 
@@ -716,14 +1519,24 @@ def connect(frompoints, topoints, key=None, greatcircle=True, segments=100):
 
 # Modify operations
 
-def buffer(data, dist, join_style="round", cap_style="round", mitre_limit=1.0, geodetic=False, resolution=None):
+def _buffer_chunk(job, featids):
+    """Runs in worker processes, buffering a chunk of features."""
+    data, bufferfunc = job
+    return [(featid, bufferfunc(data[featid])) for featid in featids]
+
+def buffer(data, dist, join_style="round", cap_style="round", mitre_limit=1.0, geodetic=False, resolution=None, workers=None):
     """
     Buffering the data by a positive distance grows the geometry,
     while a negative distance shrinks it. Distance units should be given in
-    units of the data's coordinate reference system. 
+    units of the data's coordinate reference system, or in km if geodetic is True. 
 
     Distance is an expression written in Python syntax, where it is possible
     to access the attributes of each feature by writing: feat['fieldname'].
+
+    Geodetic buffers work for all geometry types, and are made in an azimuthal
+    equidistant projection centered on each feature. 
+
+    Set workers to the number of processes to buffer with in parallel, or True for one per cpu. 
     """
     # get distance func
     if hasattr(dist, "__call__"):
@@ -734,17 +1547,12 @@ def buffer(data, dist, join_style="round", cap_style="round", mitre_limit=1.0, g
     # get buffer func
     if geodetic:
         # geodetic
-        if data.type != None and data.type != "Point":
-            raise Exception("Geodetic buffer only implemented for points")
-
-        from ._helpers import geodetic_buffer
         kwargs = dict()
         if resolution:
             kwargs["resolution"] = resolution
         def bufferfunc(feat):
-            geoj = feat.geometry
             distval = distfunc(feat)
-            return geodetic_buffer(geoj, distval, **kwargs)
+            return geodetic_buffer(feat.get_shapely(), distval, **kwargs).wkb
 
     else:
         # geometry
@@ -758,15 +1566,22 @@ def buffer(data, dist, join_style="round", cap_style="round", mitre_limit=1.0, g
             geom = feat.get_shapely()
             distval = distfunc(feat)
             buffered = geom.buffer(distval, join_style=joincode, cap_style=capcode, mitre_limit=mitre_limit)
-            return buffered.__geo_interface__
+            return buffered.wkb
+
+    feats = [feat for feat in data if feat.geometry]
+    if workers and workers != 1:
+        # worker processes inherit the data and buffer func when forked
+        featids = [feat.id for feat in feats]
+        results = parallel_chunks(_buffer_chunk, (data, bufferfunc), featids, workers)
+        results = ((data[featid],buffered) for featid,buffered in itertools.chain.from_iterable(results))
+    else:
+        results = ((feat,bufferfunc(feat)) for feat in feats)
         
     # buffer and change each geojson dict in-place
     new = VectorData()
     new.fields = list(data.fields)
-    for feat in data:
-        if feat.geometry:
-            buffered = bufferfunc(feat)
-            new.add_feature(feat.row, buffered)
+    for feat,buffered in results:
+        new.add_feature(feat.row, buffered)
         
     # change data type to polygon
     new.type = "Polygon"
@@ -808,7 +1623,7 @@ def cut(data, cutter):
         newgeom = _split(geom, cutgeom)
 
         # add feature
-        outdata.add_feature(feat.row, newgeom.__geo_interface__)
+        outdata.add_feature(feat.row, newgeom.wkb)
         
     return outdata
 
@@ -818,18 +1633,33 @@ def reproject(data, tocrs):
 
     fromcrs = data.crs
 
+    fromproj = pyproj.Proj(fromcrs)
+    toproj = pyproj.Proj(tocrs)
+
     def _project(points):
         xs,ys = itertools.izip(*points)
-        xs,ys = pyproj.transform(pyproj.Proj(fromcrs),
-                                    pyproj.Proj(tocrs),
-                                    xs, ys)
+        xs,ys = pyproj.transform(fromproj,
+                                 toproj,
+                                 xs, ys)
         newpoints = list(itertools.izip(xs, ys))
         return newpoints
 
     out = data.copy()
     
     for feat in out:
-        feat.transform(_project)
+        geom = feat.geometry
+        if hasattr(geom, "coords"):
+            # packed geometries can be projected all at once using the flat coordinate arrays
+            coords = geom.coords
+            xs,ys = pyproj.transform(fromproj,
+                                     toproj,
+                                     coords[0::2], coords[1::2])
+            newcoords = array.array("d", coords)
+            newcoords[0::2] = xs
+            newcoords[1::2] = ys
+            feat.geometry = geom.with_coords(newcoords)
+        else:
+            feat.transform(_project)
 
     return out
 
@@ -3,6 +3,7 @@
 # import builtins
 import itertools
 import math
+import datetime
 
 # import fileformats
 import shapefile as pyshp
@@ -33,26 +34,45 @@ def to_file(fields, rows, geometries, filepath, encoding="utf8", maxprecision=12
             return value.encode(encoding)
         elif value is None:
             return value
+        elif isinstance(value, datetime.date):
+            # dates are written as iso text, eg 2001-12-31 or 2001-12-31T23:59:59
+            return value.isoformat()
         else:
             # brute force anything else to string representation
             return bytes(value)
 
     def detect_fieldtypes(fields, rows):
-        # TODO: allow other data types such as dates etc...
         # set fields with correct fieldtype
         fieldtypes = []
         for fieldindex,fieldname in enumerate(fields):
             fieldlen = 1
             decimals = 0
             fieldtype = "N" # assume number until proven otherwise
+            # fields where all values are booleans or dates get their own types
+            logical = dates = True
+            found = False
             for row in rows:
                 value = row[fieldindex]
                 
                 if is_missing(value):
                     # empty value, so just keep assuming same type
                     pass
+
+                elif isinstance(value, datetime.date):
+                    found = True
+                    logical = False
+                    if isinstance(value, datetime.datetime) and value.time() != datetime.time():
+                        # dbf dates cannot store the time of day
+                        dates = False
+                    # as text if mixed with other types
+                    fieldtype = "C"
+                    fieldlen = max(( len(value.isoformat()), fieldlen ))
                 
                 else:
+                    found = True
+                    dates = False
+                    if not isinstance(value, bool):
+                        logical = False
                     try:
                         # make nr fieldtype if content can be made into nr
 
@@ -78,18 +98,25 @@ def to_file(fields, rows, geometries, filepath, encoding="utf8", maxprecision=12
                     except ValueError:
                         # but turn to text if any of the cells cannot be made to float bc they are txt
                         fieldtype = "C"
-                        value = value if isinstance(value, unicode) else bytes(value)
+                        # measured in encoded bytes, as written to file
+                        value = value.encode(encoding) if isinstance(value, unicode) else bytes(value)
                         fieldlen = max(( len(value), fieldlen ))
                         
-            if fieldtype == "N" and decimals == 0:
-                fieldlen -= 2 # bc above we measure lengths for ints as if they were floats, ie with an additional ".0"
+            if found and logical and fieldtype == "N":
+                fieldtype,fieldlen = "L",1
+                func = lambda v: None if is_missing(v) else bool(v)
+            elif dates and fieldtype == "C":
+                fieldtype,fieldlen = "D",8
+                func = lambda v: None if is_missing(v) else v
+            elif fieldtype == "N" and decimals == 0:
+                fieldlen = max(1, fieldlen - 2) # bc above we measure lengths for ints as if they were floats, ie with an additional ".0"
                 func = lambda v: "" if is_missing(v) else int(float(v))
             elif fieldtype == "N" and decimals:
                 func = lambda v: "" if is_missing(v) else float(v)
             elif fieldtype == "C":
                 func = lambda v: v #encoding are handled later
             else:
-                raise Exception("Unexpected bug: Detected field should be always N or C")
+                raise Exception("Unexpected bug: Detected field should be always N, C, L or D")
             fieldtypes.append( (fieldtype,func,fieldlen,decimals) )
         return fieldtypes
     
@@ -127,7 +154,11 @@ def to_file(fields, rows, geometries, filepath, encoding="utf8", maxprecision=12
             shape.shapeType = pyshptype
             
             # set points and parts
-            if geojtype == "Point":
+            if hasattr(geoj, "rings"):
+                # packed geometries are already laid out as shapefile points and parts
+                shape.points = list(geoj.iter_points())
+                shape.parts = list(geoj.rings[:-1])
+            elif geojtype == "Point":
                 shape.points = [ geoj["coordinates"] ]
                 shape.parts = [0]
             elif geojtype in ("MultiPoint","LineString"):
@@ -170,7 +201,9 @@ def to_file(fields, rows, geometries, filepath, encoding="utf8", maxprecision=12
         for row,geom in itertools.izip(rows, geometries):
             shape = geoj2shape(geom)
             shapewriter._shapes.append(shape)
-            row = [encode(func(value)) for (typ,func,length,deci),value in zip(fieldtypes,row)]
+            # pyshp writes dates and booleans itself
+            row = [func(value) if typ in ("D","L") else encode(func(value))
+                   for (typ,func,length,deci),value in zip(fieldtypes,row)]
             shapewriter.record(*row)
             
         # save
@@ -1,6 +1,7 @@
 
 import itertools, operator
 from .data import *
+from ._helpers import union_geometries, touching_groups, zorder_index, parallel_map, group_by_key
 
 import shapely, shapely.ops, shapely.geometry
 from shapely.prepared import prep as supershapely
@@ -11,6 +12,47 @@ from shapely.prepared import prep as supershapely
 
 # SQL components
 
+def _lookup_aggfunc(agg):
+    # handle aliases
+    if agg in ("average","avg"):
+        agg = "mean"
+
+    # detect
+    if agg == "count": return len
+    elif agg == "sum": return sum
+    elif agg == "max": return max
+    elif agg == "min": return min
+    elif agg == "first": return lambda seq: seq.__getitem__(0)
+    elif agg == "last": return lambda seq: seq.__getitem__(-1)
+    elif agg == "majority": return lambda seq: max(itertools.groupby(sorted(seq)), key=lambda(gid,group): len(list(group)))[0]
+    elif agg == "minority": return lambda seq: min(itertools.groupby(sorted(seq)), key=lambda(gid,group): len(list(group)))[0]
+    elif agg == "mean": return lambda seq: sum(seq)/float(len(seq))
+    elif isinstance(agg, basestring) and agg.endswith("concat"):
+        delim = agg[:-6]
+        return lambda seq: delim.join((str(v) for v in seq))
+    elif hasattr(agg, "__call__"):
+        # agg is not a string but a function
+        return agg
+    else:
+        raise Exception("aggfunc must be a callable function or a valid statistics string name")
+
+def _check_valfunc(valfunc):
+    if hasattr(valfunc,"__call__"):
+        pass
+    elif isinstance(valfunc,(str,unicode)):
+        hashindex = valfunc
+        valfunc = lambda f: f[hashindex]
+    else:
+        raise Exception("valfunc '%s' must be a callable function or a string of the hash index for retrieving the value"%valfunc)
+    return valfunc
+
+def _make_number(value):
+    try: return float(value)
+    except: return None
+
+def _is_missing(val):
+    return val is None or (isinstance(val, float) and math.isnan(val))
+
 def aggreg(iterable, aggregfuncs, geomfunc=None):
     """Each func must be able to take an iterable and return a single item.
     Aggregfuncs is a series of 3-tuples: an output column name, a value function or value hash index on which to base the aggregation, and a valid string or custom function for aggregating the retieved values.
@@ -30,25 +72,28 @@ def aggreg(iterable, aggregfuncs, geomfunc=None):
                 for g in gs:
                     if not g.is_empty:
                         cur = cur.intersection(g)
-                return cur.__geo_interface__
+                        if cur.is_empty:
+                            # nothing left to intersect
+                            break
+                return cur.wkb
             
         elif agg == "difference":
             def _func(fs):
-                gs = (f.get_shapely() for f in fs if f.geometry)
-                cur = next(gs)
-                for g in gs:
-                    if not g.is_empty:
-                        cur = cur.difference(g)
-                return cur.__geo_interface__
+                fs = [f for f in fs if f.geometry]
+                cur = fs[0].get_shapely()
+                # subtract the union of all the others at once, instead of one at a time
+                others = union_geometries(f.get_shapely() for f in _spatially_sorted(fs[1:]))
+                if others is not None and not others.is_empty:
+                    cur = cur.difference(others)
+                return cur.wkb
 
         elif agg == "union":
             def _func(fs):
-                gs = [f.get_shapely() for f in fs if f.geometry]
-                if len(gs) > 1:
-                    from shapely.ops import cascaded_union
-                    return cascaded_union(gs).__geo_interface__
-                elif len(gs) == 1:
-                    return gs[0].__geo_interface__
+                fs = [f for f in fs if f.geometry]
+                if len(fs) > 1:
+                    return union_geometries(f.get_shapely() for f in _spatially_sorted(fs)).wkb
+                elif len(fs) == 1:
+                    return fs[0].wkb
 
         elif hasattr(agg, "__call__"):
             # agg is not a string but a custom function
@@ -59,48 +104,7 @@ def aggreg(iterable, aggregfuncs, geomfunc=None):
 
         return _func
     
-    def lookup_aggfunc(agg):
-        # handle aliases
-        if agg in ("average","avg"):
-            agg = "mean"
-
-        # detect
-        if agg == "count": return len
-        elif agg == "sum": return sum
-        elif agg == "max": return max
-        elif agg == "min": return min
-        elif agg == "first": return lambda seq: seq.__getitem__(0)
-        elif agg == "last": return lambda seq: seq.__getitem__(-1)
-        elif agg == "majority": return lambda seq: max(itertools.groupby(sorted(seq)), key=lambda(gid,group): len(list(group)))[0]
-        elif agg == "minority": return lambda seq: min(itertools.groupby(sorted(seq)), key=lambda(gid,group): len(list(group)))[0]
-        elif agg == "mean": return lambda seq: sum(seq)/float(len(seq))
-        elif isinstance(agg, basestring) and agg.endswith("concat"):
-            delim = agg[:-6]
-            return lambda seq: delim.join((str(v) for v in seq))
-        elif hasattr(agg, "__call__"):
-            # agg is not a string but a function
-            return agg
-        else:
-            raise Exception("aggfunc must be a callable function or a valid statistics string name")
-
-    def check_valfunc(valfunc):
-        if hasattr(valfunc,"__call__"):
-            pass
-        elif isinstance(valfunc,(str,unicode)):
-            hashindex = valfunc
-            valfunc = lambda f: f[hashindex]
-        else:
-            raise Exception("valfunc for field '%s' must be a callable function or a string of the hash index for retrieving the value"%name)
-        return valfunc
-    
-    aggregfuncs = [(name,check_valfunc(valfunc),aggname,lookup_aggfunc(aggname)) for name,valfunc,aggname in aggregfuncs]
-
-    def make_number(value):
-        try: return float(value)
-        except: return None
-
-    def is_missing(val):
-        return val is None or (isinstance(val, float) and math.isnan(val))
+    aggregfuncs = [(name,_check_valfunc(valfunc),aggname,_lookup_aggfunc(aggname)) for name,valfunc,aggname in aggregfuncs]
 
     iterable = list(iterable)
     row = []
@@ -108,11 +112,11 @@ def aggreg(iterable, aggregfuncs, geomfunc=None):
         values = (valfunc(item) for item in iterable)
 
         # missing values are not considered when calculating stats
-        values = [val for val in values if not is_missing(val)] 
+        values = [val for val in values if not _is_missing(val)] 
         
         if aggname in ("sum","max","min","mean"):
             # only consider number values if numeric stats
-            values = [make_number(value) for value in values if make_number(value) != None]
+            values = [_make_number(value) for value in values if _make_number(value) != None]
 
         if values:
             aggval = aggfunc(values)
@@ -129,6 +133,145 @@ def aggreg(iterable, aggregfuncs, geomfunc=None):
     else:
         return row
 
+class Accumulator(object):
+    """
+    Calculates the same statistics as aggreg(), but one item at a time, so that the items
+    do not have to be collected in a list first. 
+
+    Count, sum, min, max, mean, first and last are updated incrementally, while other statistics
+    collect the values and are calculated at the end. 
+    
+    Each item can be given a weight, eg the share of a feature that overlaps an area. The count is then
+    the sum of weights, the sum is the weighted sum, and the mean the weighted mean. The other statistics
+    ignore weights. Without weights, the count is an int, same as with aggreg(). 
+    """
+    _INCREMENTAL = ("count","sum","min","max","mean","average","avg","first","last")
+    _NUMERIC = ("sum","max","min","mean","average","avg")
+    
+    def __init__(self, aggregfuncs):
+        self.aggregfuncs = [(_check_valfunc(valfunc),aggname,_lookup_aggfunc(aggname)) for name,valfunc,aggname in aggregfuncs]
+        # for incremental stats, the running value and total weight of values, for others the list of values
+        self.states = [[None,0.0] if aggname in self._INCREMENTAL else [] 
+                       for valfunc,aggname,aggfunc in self.aggregfuncs]
+        self.count = 0
+
+    def add(self, item, weight=1):
+        self.count += 1
+        for (valfunc,aggname,aggfunc),state in itertools.izip(self.aggregfuncs, self.states):
+            val = valfunc(item)
+            if _is_missing(val):
+                continue
+            if aggname in self._NUMERIC:
+                val = _make_number(val)
+                if val is None:
+                    continue
+                    
+            if aggname not in self._INCREMENTAL:
+                state.append(val)
+                continue
+
+            cur,total = state
+            # unweighted items are counted as ints, same as aggreg()
+            if aggname == "count":
+                cur = (cur or 0) + (1 if weight == 1 else weight)
+            elif aggname in ("sum","mean","average","avg"):
+                cur = (cur or 0) + (val if weight == 1 else val * weight)
+            elif aggname == "min":
+                cur = val if cur is None else min(cur, val)
+            elif aggname == "max":
+                cur = val if cur is None else max(cur, val)
+            elif aggname == "first":
+                cur = val if total == 0 else cur
+            elif aggname == "last":
+                cur = val
+            state[0] = cur
+            state[1] = total + weight
+
+    def result(self):
+        """Returns the row of aggregated values, with empty strings where there were no values."""
+        row = []
+        for (valfunc,aggname,aggfunc),state in itertools.izip(self.aggregfuncs, self.states):
+            if aggname not in self._INCREMENTAL:
+                aggval = aggfunc(state) if state else ""
+            else:
+                cur,total = state
+                if not total:
+                    aggval = ""
+                elif aggname in ("mean","average","avg"):
+                    aggval = cur / float(total)
+                else:
+                    aggval = cur
+            row.append(aggval)
+        return row
+
+def _spatially_sorted(feats):
+    """Returns the given features with geometries, sorted along a z-order curve of their bbox centers."""
+    feats = [f for f in feats if f.geometry]
+    if not feats:
+        return []
+    bboxes = [f.bbox for f in feats]
+    xmins,ymins,xmaxs,ymaxs = zip(*bboxes)
+    fullbbox = min(xmins),min(ymins),max(xmaxs),max(ymaxs)
+    def sortkey(i):
+        xmin,ymin,xmax,ymax = bboxes[i]
+        return zorder_index((xmin+xmax)/2.0, (ymin+ymax)/2.0, fullbbox)
+    order = sorted(xrange(len(feats)), key=sortkey)
+    return [feats[i] for i in order]
+
+def _dissolve_worker(args):
+    """Unions a group of WKB geometries, optionally only those that touch each other.
+    Returns a list of (wkb,memberindexes) tuples, one for each dissolved geometry.
+    Runs in a separate process when dissolving in parallel."""
+    from shapely.wkb import loads
+    wkbs,touching = args
+    geoms = [loads(wkb) for wkb in wkbs]
+    if touching:
+        groups = touching_groups(geoms)
+    else:
+        groups = [range(len(geoms))]
+    results = []
+    for members in groups:
+        union = union_geometries(geoms[i] for i in members)
+        results.append((union.wkb, members))
+    return results
+
+def dissolve(groups, touching=False, workers=None):
+    """
+    Unions the geometries of each group of features, as used by VectorData.aggregate() and manager.dissolve(). 
+    
+    Each group's geometries are sorted spatially and unioned by a tree reduction, see union_geometries(),
+    and separate groups can be processed in parallel worker processes. 
+    
+    Arguments:
+        groups: A list of feature lists. 
+        touching (optional): If True, only dissolves geometries that touch or overlap each other, 
+            so a group may result in more than one geometry. 
+        workers (optional): Number of worker processes to use, or True to use one per cpu. Default is to not use parallel processing. 
+
+    Returns:
+        A list of (wkb,feats) tuples, for each dissolved geometry and the features that were dissolved into it. 
+        Groups without any geometries result in a None geometry. When touching is True, features without 
+        geometry are left out. 
+    """
+    # sort spatially before sending to workers
+    groups = [list(feats) for feats in groups]
+    sortedgroups = [_spatially_sorted(feats) for feats in groups]
+    tasks = [([f.wkb for f in sortedfeats], touching) for sortedfeats in sortedgroups if sortedfeats]
+    results = iter(parallel_map(_dissolve_worker, tasks, workers))
+    
+    out = []
+    for feats,sortedfeats in itertools.izip(groups, sortedgroups):
+        if not sortedfeats:
+            # no geometries to dissolve
+            out.append((None, feats))
+        elif touching:
+            for wkb,members in next(results):
+                out.append((wkb, [sortedfeats[i] for i in members]))
+        else:
+            wkb,members = next(results)[0]
+            out.append((wkb, feats))
+    return out
+
 def select(iterable, columnfuncs, geomfunc=None):
     if geomfunc:
         # iterate and yield rows and geoms
@@ -161,8 +304,7 @@ def groupby(iterable, key):
     else:
         raise Exception("groupby key must be a callable function or a string or list/tuple of strings of the hash index(es) for retrieving the value(s)")
 
-    iterable = sorted(iterable, key=key)
-    for groupid,items in itertools.groupby(iterable, key=key):
+    for groupid,items in group_by_key(iterable, key):
         yield items
 
 def limit(iterable, n):
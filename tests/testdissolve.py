@@ -0,0 +1,28 @@
+import pythongis as pg
+from time import time
+
+# grid of parcels dissolved into districts
+# guarded, since worker processes re-import this script where they are not forked (eg on Windows)
+
+if __name__ == "__main__":
+    parcels = pg.VectorData(fields=["id","district","value"])
+    i = 0
+    for x in range(300):
+        for y in range(300):
+            district = (x // 10) * 100 + (y // 10)
+            box = [(x,y),(x+1,y),(x+1,y+1),(x,y+1),(x,y)]
+            parcels.add_feature([i, district, 1], {"type":"Polygon", "coordinates":[box]})
+            i += 1
+    print parcels
+
+    t=time()
+    districts = pg.vector.manager.dissolve(parcels, ["district"], [("total","value","sum")])
+    print "dissolve", time()-t, districts
+
+    t=time()
+    districts = pg.vector.manager.dissolve(parcels, ["district"], [("total","value","sum")], workers=True)
+    print "dissolve parallel", time()-t, districts
+
+    t=time()
+    islands = pg.vector.manager.dissolve(parcels.select(lambda f: f["id"] % 3), touching=True)
+    print "dissolve touching", time()-t, islands
@@ -0,0 +1,27 @@
+
+import pythongis as pg
+from time import time
+import random
+
+# many noisy duplicate gps points
+
+points = pg.VectorData(fields=["id","speed"])
+for i in range(1000000):
+    x,y = random.randrange(1000), random.randrange(1000)
+    noise = random.uniform(-1e-9, 1e-9)
+    points.add_feature([i, random.random()*100], {"type":"Point", "coordinates":(x+noise, y)})
+print points
+
+t=time()
+dedup = points.duplicates(fieldmapping=[("count","id","count"),("avgspeed","speed","mean")],
+                          precision=6)
+print "dedup with snapping", time()-t, dedup
+
+t=time()
+dedup = points.duplicates(fieldmapping=[("count","id","count")],
+                          precision=6, confirm=True)
+print "dedup with snapping and confirm", time()-t, dedup
+
+t=time()
+dedup = points.duplicates(fieldmapping=[("count","id","count")])
+print "dedup exact", time()-t, dedup